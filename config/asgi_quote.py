@@ -0,0 +1,15 @@
+"""
+ASGI config of the quote-only worker.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+always with config.settings_quote, whatever DJANGO_SETTINGS_MODULE is set to
+for the rest of the deployment.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'config.settings_quote'
+
+application = get_asgi_application()
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pricing.middleware.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -128,3 +129,89 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Pricing
+# Upper bound on the number of trips accepted by one batch quote request
+PRICING_BATCH_MAX_TRIPS = 1000
+
+# Pricing configurations shown per page of the configuration list
+PRICING_CONFIGS_PER_PAGE = 25
+
+# Change log entries shown per page of a configuration's history
+PRICING_LOGS_PER_PAGE = 50
+
+# archive_pricing_logs moves log rows older than this into monthly gzipped
+# NDJSON files under PRICING_LOG_ARCHIVE_DIR
+PRICING_LOG_RETENTION_DAYS = 365
+PRICING_LOG_ARCHIVE_DIR = BASE_DIR / 'log_archive'
+
+# In-process LRU cache of price quotes, keyed on tariff version and trip
+# inputs. MAX_SIZE 0 disables it; TTL is in seconds (0 means no expiry).
+PRICING_QUOTE_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+}
+
+# Price calculation logs are buffered in memory and written in batches by a
+# background thread, after BATCH_SIZE entries or FLUSH_INTERVAL seconds.
+# Entries are dropped when MAX_QUEUE entries are waiting; SAMPLE_RATE logs
+# only that fraction of quotes.
+PRICING_CALCULATION_LOG = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_QUEUE': 10000,
+    'SAMPLE_RATE': 1.0,
+}
+
+# Serve the active tariff from a binary snapshot file written by the
+# snapshot_tariff command instead of the database. Workers re-check the file
+# at most every CHECK_INTERVAL seconds. None reads the database.
+PRICING_TARIFF_SNAPSHOT_PATH = None
+PRICING_TARIFF_SNAPSHOT_CHECK_INTERVAL = 1.0
+
+# Unix socket the serve_quote_socket command serves quotes on, for services
+# on the same host (see pricing/quote_protocol.py for the client).
+PRICING_QUOTE_SOCKET_PATH = None
+
+# Every change to pricing data bumps a counter row in the same transaction.
+# Each process compares it with the value its caches were built at when a
+# request starts, at most every PRICING_STAMP_CHECK_INTERVAL seconds, so a
+# change reaches all workers within that delay. None turns the check off.
+PRICING_STAMP_CHECK_INTERVAL = 1.0
+
+# Time the stages of each quote request, report them in a Server-Timing
+# header and aggregate them into histograms shown by /pricing/api/metrics/.
+PRICING_STAGE_TIMING = False
+
+# Per-request SQL profiling: query count, SQL time and repeated queries. A
+# warning is logged when a view runs more queries than its budget (keyed by
+# URL name) or a request spends more than SLOW_REQUEST_MS in SQL. Budgets hold
+# for any single request: quote budgets allow for the first quote after a
+# change, which compiles the tariff, and the edit budget for a submission.
+# pricing.test_query_budgets checks every view against this table.
+PRICING_QUERY_PROFILING = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 200,
+    'BUDGETS': {
+        'pricing_config_list': 4,
+        'pricing_config_create': 2,
+        'pricing_config_detail': 8,
+        'pricing_config_logs': 4,
+        'pricing_config_edit': 18,
+        'pricing_config_delete': 1,
+        'price_calculator': 2,
+        'calculate_price': 12,
+        'calculate_price_async': 12,
+        'calculate_price_batch': 12,
+        'calculate_price_compare': 12,
+        'price_trips_stream': 12,
+        'pricing_metrics': 2,
+        'export_pricing_configs': 7,
+        'import_pricing_configs': 12,
+        'admin:pricing_pricingconfig_changelist': 5,
+        'admin:pricing_pricingconfiglog_changelist': 6,
+        'admin:pricing_pricecalculationlog_changelist': 6,
+    },
+}
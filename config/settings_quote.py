@@ -0,0 +1,34 @@
+"""
+Settings for a quote-only worker.
+
+Serves the price calculation endpoints and nothing else, for deployments that
+scale quote traffic separately from the admin and configuration pages:
+
+    gunicorn config.wsgi_quote:application
+    uvicorn config.asgi_quote:application
+
+Only the apps the pricing models need are installed, no middleware runs and
+no templates, DRF, admin or sessions are loaded. Quotes need no login or CSRF
+token, exactly as on the full site. Database, cache and PRICING_* settings are
+shared with config.settings.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# pricing's models reference auth.User, which needs contenttypes
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'pricing',
+]
+
+MIDDLEWARE = []
+
+ROOT_URLCONF = 'config.urls_quote'
+
+TEMPLATES = []
+
+WSGI_APPLICATION = 'config.wsgi_quote.application'
+
+# Responses carry no translated text
+USE_I18N = False
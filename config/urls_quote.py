@@ -0,0 +1,14 @@
+"""
+URL configuration of the quote-only worker (config.settings_quote).
+
+The quote endpoints keep the paths and URL names they have on the full site,
+so clients and query budgets need no changes.
+"""
+from django.urls import path
+
+from pricing import quote_views
+
+urlpatterns = [
+    path('pricing/api/calculate-price/', quote_views.calculate_price, name='calculate_price'),
+    path('pricing/api/calculate-price/async/', quote_views.calculate_price_async, name='calculate_price_async'),
+]
@@ -0,0 +1,15 @@
+"""
+WSGI config of the quote-only worker.
+
+It exposes the WSGI callable as a module-level variable named ``application``,
+always with config.settings_quote, whatever DJANGO_SETTINGS_MODULE is set to
+for the rest of the deployment.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'config.settings_quote'
+
+application = get_wsgi_application()
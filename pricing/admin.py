@@ -1,15 +1,20 @@
 from django.contrib import admin
+from .forms import DistanceBasePriceForm
+from .pagination import CappedCountPaginator
+from .tariff import snapshot_config
 from .models import (
     PricingConfig,
     DistanceBasePrice,
     DistanceAdditionalPrice,
     TimeMultiplierFactor,
     WaitingCharge,
-    PricingConfigLog
+    PricingConfigLog,
+    PriceCalculationLog
 )
 
 class DistanceBasePriceInline(admin.TabularInline):
     model = DistanceBasePrice
+    form = DistanceBasePriceForm
     extra = 1
 
 class DistanceAdditionalPriceInline(admin.TabularInline):
@@ -36,9 +41,32 @@ class PricingConfigAdmin(admin.ModelAdmin):
         WaitingChargeInline,
     ]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Snapshot once the inlines are saved, so the version covers them
+        snapshot_config(form.instance)
+
 @admin.register(PricingConfigLog)
 class PricingConfigLogAdmin(admin.ModelAdmin):
     list_display = ('pricing_config', 'user', 'action', 'timestamp')
+    list_select_related = ('pricing_config', 'user')
     list_filter = ('action', 'timestamp')
+    ordering = ('-timestamp', '-id')
+    # The log grows without bound: never count all of it
+    paginator = CappedCountPaginator
+    show_full_result_count = False
     search_fields = ('pricing_config__name', 'user__username')
-    readonly_fields = ('pricing_config', 'user', 'action', 'timestamp', 'details') 
\ No newline at end of file
+    readonly_fields = ('pricing_config', 'user', 'action', 'timestamp', 'details')
+
+@admin.register(PriceCalculationLog)
+class PriceCalculationLogAdmin(admin.ModelAdmin):
+    list_display = ('timestamp', 'pricing_config', 'distance', 'duration', 'waiting_time', 'day_of_week', 'final_price')
+    list_select_related = ('pricing_config',)
+    list_filter = ('day_of_week', 'timestamp')
+    ordering = ('-timestamp', '-id')
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    readonly_fields = (
+        'pricing_config', 'version', 'timestamp', 'distance', 'duration',
+        'waiting_time', 'day_of_week', 'final_price', 'breakdown'
+    )
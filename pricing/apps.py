@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class PricingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'pricing' 
\ No newline at end of file
+    name = 'pricing'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,283 @@
+"""
+What-if backtests of a draft pricing configuration.
+
+A trip history is replayed against two tariffs, the current one and a draft,
+with the same vectorised engine that bulk pricing uses, which agrees with
+calculate_price to the paisa. The input is split into chunks and every
+chunk is parsed and priced under both tariffs in a worker process; workers
+send back per-chunk totals and a histogram of final price deltas, which are
+merged here into per-component totals and aggregate statistics.
+"""
+import csv
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from functools import partial
+from itertools import islice
+
+import django
+
+from .bulk import DEFAULT_CHUNK_SIZE, _parse_trip, read_trips
+from .engine import price_trips
+
+# Report name: engine column, all in paise
+COMPONENTS = {
+    'distance_base_price': 'distance_base_price_paise',
+    'additional_distance_price': 'additional_distance_price_paise',
+    'base_fare': 'base_fare_paise',
+    'time_multiplier_adjustment': None,
+    'waiting_charge': 'waiting_charge_paise',
+    'final_price': 'final_price_paise',
+}
+
+PERCENTILES = (1, 5, 50, 95, 99)
+
+CENT = Decimal('0.01')
+
+DETAIL_FIELDS = ['trip', 'distance', 'duration', 'waiting_time', 'day_of_week', 'error'] + [
+    f'{component}_{side}' for component in COMPONENTS for side in ('current', 'draft', 'delta')
+]
+
+
+def _component_columns(result):
+    columns = {}
+    for component, column in COMPONENTS.items():
+        if column is None:
+            # What the time multiplier added on top of the base fare
+            columns[component] = result['time_adjusted_fare_paise'] - result['base_fare_paise']
+        else:
+            columns[component] = result[column]
+    return columns
+
+
+def _rupees(paise):
+    return Decimal(int(paise)).scaleb(-2)
+
+
+def price_chunk(current, draft, rows, details=False):
+    """
+    Parse one chunk of trip rows and price the trips under both tariffs,
+    returning the chunk's partial totals. Rows that do not parse are counted
+    as invalid; with details, 'positions' holds the place in the chunk of
+    each parsed trip.
+    """
+    positions, trips = [], []
+    for position, row in enumerate(rows):
+        if isinstance(row, dict):
+            try:
+                trips.append(_parse_trip(row))
+                positions.append(position)
+            except (TypeError, ValueError):
+                pass
+    result = _price_trips(current, draft, trips, details)
+    result['rows'] = len(rows)
+    result['invalid'] = len(rows) - len(trips)
+    result['positions'] = positions if details else None
+    return result
+
+
+def price_lines(current, draft, lines, details=False, fmt='csv'):
+    """price_chunk for raw lines of a CSV or NDJSON file; CSV chunks start with the header line."""
+    return price_chunk(current, draft, list(read_trips(lines, fmt)), details)
+
+
+def _price_trips(current, draft, trips, details):
+    # Parsed (distance, duration, waiting_time, day_of_week) tuples
+    result = {
+        'trips': len(trips),
+        'unpriced_current': 0,
+        'unpriced_draft': 0,
+        'compared': 0,
+        'totals': {component: [0, 0] for component in COMPONENTS},
+        'deltas': Counter(),
+        'details': [] if details else None,
+    }
+    if not trips:
+        return result
+
+    distances, durations, waiting_times, days = zip(*trips)
+    current_result = price_trips(current, distances, durations, waiting_times, days)
+    draft_result = price_trips(draft, distances, durations, waiting_times, days)
+    current_columns = _component_columns(current_result)
+    draft_columns = _component_columns(draft_result)
+
+    # Only trips that both tariffs can price are compared
+    both = current_result['valid'] & draft_result['valid']
+    result['unpriced_current'] = int((~current_result['valid']).sum())
+    result['unpriced_draft'] = int((~draft_result['valid']).sum())
+    result['compared'] = int(both.sum())
+    for component in COMPONENTS:
+        result['totals'][component] = [
+            int(current_columns[component][both].sum()),
+            int(draft_columns[component][both].sum()),
+        ]
+    deltas = draft_result['final_price_paise'][both] - current_result['final_price_paise'][both]
+    result['deltas'].update(deltas.tolist())
+
+    if details:
+        for i, trip in enumerate(trips):
+            row = dict(zip(('distance', 'duration', 'waiting_time', 'day_of_week'), trip))
+            if not (current_result['in_range'][i] and draft_result['in_range'][i]):
+                row['error'] = 'Trip is too long to price under both configurations'
+            elif not current_result['valid'][i]:
+                row['error'] = f'No base price under the current configuration for day {trip[3]}'
+            elif not draft_result['valid'][i]:
+                row['error'] = f'No base price under the draft configuration for day {trip[3]}'
+            else:
+                for component in COMPONENTS:
+                    before = int(current_columns[component][i])
+                    after = int(draft_columns[component][i])
+                    row[f'{component}_current'] = _rupees(before)
+                    row[f'{component}_draft'] = _rupees(after)
+                    row[f'{component}_delta'] = _rupees(after - before)
+            result['details'].append(row)
+    return result
+
+
+def _weighted_percentile(counts, total, percent):
+    """Nearest-rank percentile of a {value: count} histogram."""
+    rank = max(1, -(-total * percent // 100))
+    seen = 0
+    for value in sorted(counts):
+        seen += counts[value]
+        if seen >= rank:
+            return value
+
+
+class BacktestSummary:
+    """Running totals of a backtest, merged one chunk at a time."""
+
+    def __init__(self):
+        self.trips = 0
+        self.invalid = 0
+        self.unpriced_current = 0
+        self.unpriced_draft = 0
+        self.compared = 0
+        self.totals = {component: [0, 0] for component in COMPONENTS}
+        self.deltas = Counter()
+
+    def add(self, result):
+        self.trips += result['trips']
+        self.invalid += result['invalid']
+        self.unpriced_current += result['unpriced_current']
+        self.unpriced_draft += result['unpriced_draft']
+        self.compared += result['compared']
+        for component, (current, draft) in result['totals'].items():
+            self.totals[component][0] += current
+            self.totals[component][1] += draft
+        self.deltas.update(result['deltas'])
+
+    def as_dict(self):
+        components = {}
+        for component, (current, draft) in self.totals.items():
+            components[component] = {
+                'current': _rupees(current),
+                'draft': _rupees(draft),
+                'delta': _rupees(draft - current),
+                'mean_delta': (
+                    (_rupees(draft - current) / self.compared).quantize(CENT) if self.compared else None
+                ),
+                'change_percent': round((draft - current) * 100 / current, 2) if current else None,
+            }
+
+        final_price = {
+            'increased': sum(count for delta, count in self.deltas.items() if delta > 0),
+            'decreased': sum(count for delta, count in self.deltas.items() if delta < 0),
+            'unchanged': self.deltas.get(0, 0),
+        }
+        if self.compared:
+            final_price['min_delta'] = _rupees(min(self.deltas))
+            final_price['max_delta'] = _rupees(max(self.deltas))
+            for percent in PERCENTILES:
+                final_price[f'p{percent}_delta'] = _rupees(
+                    _weighted_percentile(self.deltas, self.compared, percent)
+                )
+
+        return {
+            'trips': self.trips + self.invalid,
+            'invalid': self.invalid,
+            'unpriced_current': self.unpriced_current,
+            'unpriced_draft': self.unpriced_draft,
+            'compared': self.compared,
+            'components': components,
+            'final_price': final_price,
+        }
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _line_chunks(stream, fmt, chunk_size):
+    """Split a binary CSV or NDJSON stream into lists of lines, each CSV chunk headed by the header line."""
+    lines = iter(stream)
+    header = [next(lines, b'')] if fmt == 'csv' else []
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield header + chunk
+
+
+def run_backtest(current, draft, rows, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, details=None):
+    """
+    Replay trip rows (dicts as read by pricing.bulk.read_trips) against the
+    current and draft CompiledTariffs and return a BacktestSummary. With more
+    than one worker, chunks are parsed and priced in a process pool, at most
+    two chunks per worker in flight. details, if given, is called with the
+    per-trip comparison rows of each chunk, in input order.
+    """
+    return _run(current, draft, price_chunk, _chunks(rows, chunk_size), workers, details)
+
+
+def run_backtest_file(current, draft, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, details=None):
+    """
+    run_backtest for a binary CSV or NDJSON stream. Chunks of raw lines go
+    to the workers, which decode and parse them, so the parent only splits
+    the input into lines. Records must not span lines.
+    """
+    return _run(current, draft, partial(price_lines, fmt=fmt), _line_chunks(stream, fmt, chunk_size), workers, details)
+
+
+def _run(current, draft, price, chunks, workers, details):
+    summary = BacktestSummary()
+    want_details = details is not None
+    offset = 0
+
+    def merge(result):
+        nonlocal offset
+        summary.add(result)
+        if want_details:
+            for row, position in zip(result['details'], result['positions']):
+                row['trip'] = offset + position
+            details(result['details'])
+        offset += result['rows']
+
+    if workers <= 1:
+        for chunk in chunks:
+            merge(price(current, draft, chunk, want_details))
+        return summary
+
+    # Workers import the pricing models to unpickle tariffs, so they set up
+    # Django first in case they are spawned rather than forked
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(price, current, draft, chunk, want_details))
+            if len(pending) >= workers * 2:
+                merge(pending.popleft().result())
+        while pending:
+            merge(pending.popleft().result())
+    return summary
+
+
+def write_details(stream):
+    """Return a details callback writing per-trip comparison rows as CSV to stream."""
+    writer = csv.DictWriter(stream, fieldnames=DETAIL_FIELDS)
+    writer.writeheader()
+    return writer.writerows
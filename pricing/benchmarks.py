@@ -0,0 +1,116 @@
+"""
+Helpers shared by the pricing benchmarks and the query budget tests: seeding
+configurations of a given size, building edit form submissions and
+summarising latency samples.
+"""
+from decimal import Decimal
+
+from django.forms.models import InlineForeignKeyField
+from django.utils import timezone
+
+from .forms import (
+    PricingConfigForm,
+    DistanceBasePriceFormSet,
+    DistanceAdditionalPriceFormSet,
+    TimeMultiplierFactorFormSet,
+    WaitingChargeFormSet
+)
+from .models import (
+    PricingConfig,
+    DistanceBasePrice,
+    DistanceAdditionalPrice,
+    TimeMultiplierFactor,
+    WaitingCharge,
+    PricingConfigLog
+)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarise(latencies, elapsed):
+    """Throughput and latency percentiles (in ms) of a list of request latencies in seconds."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def seed_config(name, size, logs=0, user=None, is_active=True):
+    """
+    Create a PricingConfig with `size` base prices and time multipliers,
+    one additional price, one waiting charge and `logs` change log rows.
+    """
+    config = PricingConfig.objects.create(name=name, is_active=is_active)
+    DistanceBasePrice.objects.bulk_create([
+        DistanceBasePrice(
+            pricing_config=config,
+            # Every weekday gets a base price, however small the config
+            days_of_week=[day for day in range(7) if day % min(size, 7) == i % 7],
+            base_distance=Decimal('3') + i % 5,
+            base_price=Decimal('80') + i,
+        )
+        for i in range(size)
+    ])
+    DistanceAdditionalPrice.objects.create(pricing_config=config, price_per_km=Decimal('30'))
+    TimeMultiplierFactor.objects.bulk_create([
+        TimeMultiplierFactor(
+            pricing_config=config,
+            time_threshold=30 * (i + 1),
+            multiplier=Decimal('1') + Decimal(i) / 10,
+        )
+        for i in range(size)
+    ])
+    WaitingCharge.objects.create(
+        pricing_config=config,
+        initial_wait_time=3,
+        charge_per_interval=Decimal('5'),
+        interval_minutes=3
+    )
+    PricingConfigLog.objects.bulk_create([
+        PricingConfigLog(pricing_config=config, user=user, action='updated', details={'name': name})
+        for _ in range(logs)
+    ])
+    # bulk_create skips the model signals, so touch the config to invalidate caches
+    config.updated_at = timezone.now()
+    config.save()
+    return config
+
+
+def _form_values(form):
+    values = {}
+    for name, field in form.fields.items():
+        if isinstance(field, InlineForeignKeyField):
+            # Taken from the parent instance, not from the submission
+            continue
+        value = form.instance.pk if name == 'id' else form.initial.get(name)
+        if value is None or value is False:
+            continue
+        if value is True:
+            value = 'on'
+        values[form.add_prefix(name)] = [str(item) for item in value] if isinstance(value, list) else str(value)
+    return values
+
+
+def edit_post_data(config):
+    """POST data for pricing_config_edit that resubmits a config as stored."""
+    data = _form_values(PricingConfigForm(instance=config))
+    for formset_class in (
+        DistanceBasePriceFormSet,
+        DistanceAdditionalPriceFormSet,
+        TimeMultiplierFactorFormSet,
+        WaitingChargeFormSet,
+    ):
+        formset = formset_class(instance=config)
+        management_form = formset.management_form
+        for name, value in management_form.initial.items():
+            data[management_form.add_prefix(name)] = str(value)
+        for form in formset.initial_forms:
+            data.update(_form_values(form))
+    return data
@@ -0,0 +1,164 @@
+"""
+Streaming bulk pricing of trip files.
+
+Trips are read incrementally from CSV or NDJSON, priced in fixed-size chunks
+with the vectorised engine and written back out row by row, so memory use
+depends on the chunk size and not on the size of the input.
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from .engine import price_trips
+from .tariff import check_trip
+
+FORMATS = ('csv', 'ndjson')
+
+PRICE_FIELDS = [
+    'distance_base_price',
+    'additional_distance',
+    'additional_distance_price',
+    'time_multiplier',
+    'waiting_intervals',
+    'waiting_charge',
+    'base_fare',
+    'time_adjusted_fare',
+    'final_price',
+    'error',
+]
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# Serialised output is handed on in pieces of roughly this many bytes
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+
+class InvalidTrip:
+    """Placeholder for an input record that could not be decoded."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def format_fixed(value, places):
+    """Format a non-negative fixed-point integer, e.g. 12345 with 2 places -> '123.45'."""
+    scale = 10 ** places
+    return f'{value // scale}.{value % scale:0{places}d}'
+
+
+def read_trips(stream, fmt):
+    """Yield one dict per trip from a binary CSV or NDJSON stream."""
+    # Decode line by line; request bodies are file-like but not io objects
+    text = (line.decode('utf-8-sig' if i == 0 else 'utf-8') for i, line in enumerate(stream))
+    if fmt == 'csv':
+        yield from csv.DictReader(text)
+    elif fmt == 'ndjson':
+        for line in text:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield InvalidTrip(f'Invalid JSON: {e}')
+    else:
+        raise ValueError(f'Unsupported format {fmt!r}, expected one of {", ".join(FORMATS)}')
+
+
+def _parse_trip(row):
+    # Distances are parsed as calculate_price parses them, so the engine
+    # rounds them to the same metres
+    value = row.get('distance') or 0
+    try:
+        distance = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'Invalid distance {value!r}')
+    duration = int(row.get('duration') or 0)
+    waiting_time = int(row.get('waiting_time') or 0)
+    check_trip(distance, duration, waiting_time)
+    return distance, duration, waiting_time, int(row.get('day_of_week') or 0)
+
+
+def _price_chunk(tariff, chunk):
+    rows = []
+    parsed = []
+    for row in chunk:
+        trip = None
+        if isinstance(row, InvalidTrip):
+            row = {'error': row.error}
+        elif not isinstance(row, dict):
+            row = {'error': 'Each trip must be an object'}
+        else:
+            # Drop price columns left over from an earlier run of the same file
+            for field in PRICE_FIELDS:
+                row.pop(field, None)
+            try:
+                trip = _parse_trip(row)
+            except (TypeError, ValueError) as e:
+                row['error'] = str(e)
+        rows.append(row)
+        parsed.append(trip)
+
+    priced_rows = [row for row, trip in zip(rows, parsed) if trip is not None]
+    trips = [trip for trip in parsed if trip is not None]
+    if not trips:
+        return rows
+
+    distances, durations, waiting_times, days = zip(*trips)
+    result = price_trips(tariff, distances, durations, waiting_times, days)
+    for i, row in enumerate(priced_rows):
+        if not result['in_range'][i]:
+            row['error'] = 'Trip is too long to price under this configuration'
+            continue
+        if not result['valid'][i]:
+            row['error'] = f'No base price configuration found for day {days[i]}'
+            continue
+        row.update({
+            'distance_base_price': format_fixed(int(result['distance_base_price_paise'][i]), 2),
+            'additional_distance': format_fixed(int(result['additional_distance_m'][i]), 3),
+            'additional_distance_price': format_fixed(int(result['additional_distance_price_paise'][i]), 2),
+            'time_multiplier': format_fixed(int(result['time_multiplier_c'][i]), 2),
+            'waiting_intervals': int(result['waiting_intervals'][i]),
+            'waiting_charge': format_fixed(int(result['waiting_charge_paise'][i]), 2),
+            'base_fare': format_fixed(int(result['base_fare_paise'][i]), 2),
+            'time_adjusted_fare': format_fixed(int(result['time_adjusted_fare_paise'][i]), 2),
+            'final_price': format_fixed(int(result['final_price_paise'][i]), 2),
+        })
+    return rows
+
+
+def price_rows(tariff, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Price an iterable of trip dicts chunk by chunk, yielding the priced rows."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from _price_chunk(tariff, chunk)
+
+
+def write_rows(rows, fmt):
+    """Serialise priced rows to CSV or NDJSON, yielding encoded chunks of output."""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if fmt == 'ndjson':
+            buffer.write(json.dumps(row))
+            buffer.write('\n')
+        else:
+            if writer is None:
+                input_fields = [field for field in row if field is not None and field not in PRICE_FIELDS]
+                writer = csv.DictWriter(buffer, fieldnames=input_fields + PRICE_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow(row)
+        if buffer.tell() >= OUTPUT_BUFFER_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def price_stream(tariff, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Read, price and serialise a whole trip stream lazily."""
+    return write_rows(price_rows(tariff, read_trips(stream, fmt), chunk_size), fmt)
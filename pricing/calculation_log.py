@@ -0,0 +1,186 @@
+"""
+Buffered, write-behind logging of price calculations.
+
+Quotes only append an entry to a bounded in-process queue. A background thread
+drains the queue and writes PriceCalculationLog rows with bulk_create, either
+once a batch has filled up or after a flush interval, and once more when the
+process exits. When the queue is full new entries are dropped and counted
+rather than blocking the quote; PRICING_CALCULATION_LOG['SAMPLE_RATE'] can be
+lowered to log only a fraction of quotes.
+"""
+import atexit
+import logging
+import queue
+import random
+import threading
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import PriceCalculationLog
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_QUEUE': 10000,
+    'SAMPLE_RATE': 1.0,
+}
+
+# Largest values that fit the PriceCalculationLog decimal columns
+MAX_DISTANCE = Decimal('1e9')
+MAX_PRICE = Decimal('1e12')
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'PRICING_CALCULATION_LOG', {})}
+
+
+class CalculationLogWriter:
+    def __init__(self, batch_size=500, flush_interval=1.0, max_queue=10000, sample_rate=1.0, autostart=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.autostart = autostart
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.queued = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+
+    def record(self, config_id, version_id, distance, duration, waiting_time, day_of_week, quote):
+        """Queue one calculation for logging. Never blocks and never raises."""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        entry = (timezone.now(), config_id, version_id, distance, duration, waiting_time, day_of_week, quote)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.queued += 1
+        if self.autostart and self._thread is None:
+            self.start()
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def _build(self, entry):
+        timestamp, config_id, version_id, distance, duration, waiting_time, day_of_week, quote = entry
+        try:
+            distance = Decimal(distance).quantize(Decimal('0.001'))
+            final_price = Decimal(str(quote['final_price'])).quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            return None
+        if abs(distance) >= MAX_DISTANCE or abs(final_price) >= MAX_PRICE:
+            return None
+        return PriceCalculationLog(
+            pricing_config_id=config_id,
+            version_id=version_id,
+            timestamp=timestamp,
+            distance=distance,
+            duration=duration,
+            waiting_time=waiting_time,
+            day_of_week=day_of_week,
+            final_price=final_price,
+            breakdown=quote,
+        )
+
+    def flush(self):
+        """Write everything queued so far. Returns the number of rows written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        entry = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    row = self._build(entry)
+                    if row is None:
+                        self.rejected += 1
+                    else:
+                        batch.append(row)
+                if not batch:
+                    return written
+                try:
+                    PriceCalculationLog.objects.bulk_create(batch)
+                except Exception:
+                    self.failed += len(batch)
+                    logger.exception('Could not write %d price calculation logs', len(batch))
+                else:
+                    self.written += len(batch)
+                    written += len(batch)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='price-calculation-log', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        """Stop the flusher thread and write whatever is still queued."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        return {
+            'queue_size': self._queue.qsize(),
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'rejected': self.rejected,
+            'failed': self.failed,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide CalculationLogWriter configured by PRICING_CALCULATION_LOG."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                options = get_options()
+                _writer = CalculationLogWriter(
+                    batch_size=options['BATCH_SIZE'],
+                    flush_interval=options['FLUSH_INTERVAL'],
+                    max_queue=options['MAX_QUEUE'],
+                    sample_rate=options['SAMPLE_RATE'],
+                )
+    return _writer
+
+
+def log_calculation(config_id, tariff, distance, duration, waiting_time, day_of_week, quote):
+    """Log a priced trip, off the quote's critical path."""
+    if not get_options()['ENABLED']:
+        return
+    get_writer().record(config_id, tariff.version_id, distance, duration, waiting_time, day_of_week, quote)
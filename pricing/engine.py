@@ -0,0 +1,172 @@
+"""
+Vectorised fare engine for bulk pricing.
+
+Evaluates the calculate_price formula ``(DBP + Dn * DAP) * TMF + WC`` for whole
+arrays of trips at once, in int64 with the fixed-point tables and rounding rules
+of CompiledTariff.quote (see pricing/tariff.py), so every trip is priced exactly
+as calculate_price would price it. Distances are rounded to whole metres in
+decimal, as calculate_price rounds them, not in binary floating point.
+
+Trips must lie within bounds that keep every intermediate amount inside
+int64: distances from 0 to MAX_DISTANCE_KM, or less under tariffs whose
+prices would overflow first, and durations and waiting times from 0 to
+MAX_MINUTES. Trips outside them are not priced.
+"""
+from decimal import Decimal
+from functools import lru_cache
+
+import numpy as np
+
+from .tariff import MAX_DISTANCE_KM, MAX_MINUTES, TariffError, to_fixed
+
+# Ceiling for the time adjusted fare in thousandths of a paisa. Half of
+# int64 leaves room for rounding and the waiting charge on top.
+_FARE_LIMIT = 2 ** 62
+
+# Index of the "no base price" slot in the weekday gather tables
+_NO_DAY = 7
+
+
+def _round_div(values, divisor):
+    """Divide non-negative int64 arrays, rounding halves up."""
+    return (values + divisor // 2) // divisor
+
+
+def _to_metres(distance):
+    distance = Decimal(distance)
+    if not distance.is_finite() or not 0 <= distance <= MAX_DISTANCE_KM:
+        return -1
+    return to_fixed(distance, 3)
+
+
+def to_metres(distances):
+    """
+    Distances in KM as an int64 array of whole metres, rounded as
+    CompiledTariff.quote rounds them, with -1 for distances out of range.
+    Floats are rounded from their exact binary value, as Decimal(float) does.
+    """
+    distances = np.asarray(distances)
+    if distances.dtype.kind not in 'iuf':
+        # Decimals and strings
+        return np.fromiter((_to_metres(d) for d in distances.tolist()), dtype=np.int64, count=len(distances))
+
+    km = distances.astype(np.float64)
+    in_range = (km >= 0) & (km <= MAX_DISTANCE_KM)
+    scaled = np.where(in_range, km, 0) * 1000
+    metres = np.floor(scaled + 0.5)
+    # The float product can land on the wrong side of half a metre; products
+    # that close to a half are rounded again in Decimal
+    for i in np.flatnonzero(in_range & (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)):
+        metres[i] = to_fixed(float(km[i]), 3)
+    return np.where(in_range, metres, -1).astype(np.int64)
+
+
+class VectorTariff:
+    """A CompiledTariff laid out as numpy lookup tables."""
+
+    def __init__(self, tariff):
+        self.tariff = tariff
+
+        # Weekday tables have an eighth slot for days without a base price
+        self.day_valid = np.zeros(8, dtype=bool)
+        self.day_base_distance_m = np.zeros(8, dtype=np.int64)
+        self.day_base_price_paise = np.zeros(8, dtype=np.int64)
+        for day, entry in enumerate(tariff.fixed_day_table):
+            if entry is not None:
+                self.day_valid[day] = True
+                self.day_base_distance_m[day], self.day_base_price_paise[day] = entry
+
+        # Slot 0 is the implicit 1x multiplier below the lowest threshold
+        self.thresholds = np.array(tariff.thresholds, dtype=np.int64)
+        self.multipliers_c = np.array([100, *tariff.fixed_multipliers], dtype=np.int64)
+
+        self.price_per_km_paise = tariff.price_per_km_paise
+
+        # The longest distance whose fare at the highest base price and
+        # multiplier stays under _FARE_LIMIT
+        fare_limit = _FARE_LIMIT // max(self.multipliers_c.max(), 1) - self.day_base_price_paise.max() * 1000
+        self.max_distance_m = min(
+            MAX_DISTANCE_KM * 1000, max(fare_limit // max(self.price_per_km_paise, 1), 0)
+        )
+
+        if tariff.fixed_waiting:
+            if tariff.fixed_waiting[2] <= 0:
+                raise TariffError('Waiting charge interval must be greater than 0')
+            self.waiting = tariff.fixed_waiting
+        else:
+            self.waiting = None
+
+
+@lru_cache(maxsize=32)
+def vectorize(tariff):
+    return VectorTariff(tariff)
+
+
+def price_trips(tariff, distances, durations, waiting_times, days_of_week):
+    """
+    Price arrays of trips under a CompiledTariff. Distances are in KM, as
+    floats, Decimals or strings; durations and waiting times in minutes.
+
+    Returns a dict of equally sized arrays. ``in_range`` is False for trips
+    outside the bounds in the module docstring, and ``valid`` is False for
+    those and for trips whose weekday has no base price; every other column
+    is zero for invalid trips. Money columns end in ``_paise``, the
+    multiplier is in hundredths and the additional distance is in metres.
+    """
+    vector = vectorize(tariff)
+    distances_m = to_metres(distances)
+    durations = np.asarray(durations, dtype=np.int64)
+    waiting_times = np.asarray(waiting_times, dtype=np.int64)
+    days_of_week = np.asarray(days_of_week, dtype=np.int64)
+
+    # Out of range trips are priced as zero-length trips, then zeroed below
+    in_range = (
+        (distances_m >= 0) & (distances_m <= vector.max_distance_m)
+        & (durations >= 0) & (durations <= MAX_MINUTES)
+        & (waiting_times >= 0) & (waiting_times <= MAX_MINUTES)
+    )
+    distances_m = np.where(in_range, distances_m, 0)
+    durations = np.where(in_range, durations, 0)
+    waiting_times = np.where(in_range, waiting_times, 0)
+
+    # 1. Distance Base Price (DBP), gathered by weekday
+    day_index = np.where((days_of_week >= 0) & (days_of_week < 7), days_of_week, _NO_DAY)
+    valid = vector.day_valid[day_index] & in_range
+    base_distance_m = vector.day_base_distance_m[day_index]
+    base_price = vector.day_base_price_paise[day_index]
+
+    # 2. Additional Distance Price (Dn * DAP), in thousandths of a paisa
+    additional_distance_m = np.clip(distances_m - base_distance_m, 0, None)
+    additional_price_mp = additional_distance_m * vector.price_per_km_paise
+    base_fare_mp = base_price * 1000 + additional_price_mp
+
+    # 3. Time Multiplier Factor (TMF), in hundredths
+    time_multiplier = vector.multipliers_c[np.searchsorted(vector.thresholds, durations, side='right')]
+    time_adjusted_fare = _round_div(base_fare_mp * time_multiplier, 100000)
+
+    # 4. Waiting Charges (WC), whole intervals rounding up
+    if vector.waiting:
+        initial_wait_time, charge_per_interval, interval_minutes = vector.waiting
+        chargeable = np.clip(waiting_times - initial_wait_time, 0, None)
+        intervals = (chargeable + interval_minutes - 1) // interval_minutes
+        waiting_charge = intervals * charge_per_interval
+    else:
+        intervals = np.zeros_like(waiting_times)
+        waiting_charge = np.zeros_like(waiting_times)
+
+    columns = {
+        'distance_base_price_paise': base_price,
+        'additional_distance_m': additional_distance_m,
+        'additional_distance_price_paise': _round_div(additional_price_mp, 1000),
+        'base_fare_paise': _round_div(base_fare_mp, 1000),
+        'time_multiplier_c': time_multiplier,
+        'time_adjusted_fare_paise': time_adjusted_fare,
+        'waiting_intervals': intervals,
+        'waiting_charge_paise': waiting_charge,
+        'final_price_paise': time_adjusted_fare + waiting_charge,
+    }
+    for name, column in columns.items():
+        columns[name] = np.where(valid, column, 0)
+    columns['valid'] = valid
+    columns['in_range'] = in_range
+    return columns
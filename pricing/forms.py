@@ -1,6 +1,9 @@
+from decimal import Decimal
+
 from django import forms
 from django.core.exceptions import ValidationError
-from django.forms import inlineformset_factory
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from django.utils.functional import cached_property
 from .models import (
     PricingConfig,
     DistanceBasePrice,
@@ -9,16 +12,53 @@ from .models import (
     WaitingCharge
 )
 
+# Validation rules shared by the forms and the bulk importer. Each takes a
+# value already converted to its field's type and returns it, or raises
+# ValidationError.
+
+def validate_config_name(name):
+    if len(name) < 3:
+        raise ValidationError('Name must be at least 3 characters long')
+    return name
+
+def validate_days_of_week(days):
+    if not days:
+        raise ValidationError('Please select at least one day')
+    try:
+        days = [int(day) for day in days]
+        if not all(0 <= day <= 6 for day in days):
+            raise ValidationError('Invalid day value. Days must be between 0 and 6')
+    except (TypeError, ValueError):
+        raise ValidationError('Invalid day value. Days must be integers between 0 and 6')
+    return days
+
+def _greater_than_zero(message):
+    def validate(value):
+        if value <= 0:
+            raise ValidationError(message)
+        return value
+    return validate
+
+validate_base_distance = _greater_than_zero('Base distance must be greater than 0')
+validate_base_price = _greater_than_zero('Base price must be greater than 0')
+validate_price_per_km = _greater_than_zero('Price per km must be greater than 0')
+validate_time_threshold = _greater_than_zero('Time threshold must be greater than 0')
+validate_multiplier = _greater_than_zero('Multiplier must be greater than 0')
+validate_charge_per_interval = _greater_than_zero('Charge per interval must be greater than 0')
+validate_interval_minutes = _greater_than_zero('Interval minutes must be greater than 0')
+
+def validate_initial_wait_time(time):
+    if time < 0:
+        raise ValidationError('Initial wait time cannot be negative')
+    return time
+
 class PricingConfigForm(forms.ModelForm):
     class Meta:
         model = PricingConfig
         fields = ['name', 'is_active']
 
     def clean_name(self):
-        name = self.cleaned_data.get('name')
-        if len(name) < 3:
-            raise ValidationError('Name must be at least 3 characters long')
-        return name
+        return validate_config_name(self.cleaned_data.get('name'))
 
 class DistanceBasePriceForm(forms.ModelForm):
     days_of_week = forms.MultipleChoiceField(
@@ -31,29 +71,25 @@ class DistanceBasePriceForm(forms.ModelForm):
         model = DistanceBasePrice
         fields = ['days_of_week', 'base_distance', 'base_price']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # days_of_week is backed by the days_mask field, so it is not part of
+        # the initial data Django builds from the instance
+        if self.instance.pk is not None and 'days_of_week' not in self.initial:
+            self.initial['days_of_week'] = self.instance.days_of_week
+
+    def save(self, commit=True):
+        self.instance.days_of_week = self.cleaned_data['days_of_week']
+        return super().save(commit=commit)
+
     def clean_days_of_week(self):
-        days = self.cleaned_data.get('days_of_week')
-        if not days:
-            raise ValidationError('Please select at least one day')
-        try:
-            days = [int(day) for day in days]
-            if not all(0 <= day <= 6 for day in days):
-                raise ValidationError('Invalid day value. Days must be between 0 and 6')
-        except ValueError:
-            raise ValidationError('Invalid day value. Days must be integers between 0 and 6')
-        return days
+        return validate_days_of_week(self.cleaned_data.get('days_of_week'))
 
     def clean_base_distance(self):
-        distance = self.cleaned_data.get('base_distance')
-        if distance <= 0:
-            raise ValidationError('Base distance must be greater than 0')
-        return distance
+        return validate_base_distance(self.cleaned_data.get('base_distance'))
 
     def clean_base_price(self):
-        price = self.cleaned_data.get('base_price')
-        if price <= 0:
-            raise ValidationError('Base price must be greater than 0')
-        return price
+        return validate_base_price(self.cleaned_data.get('base_price'))
 
 class DistanceAdditionalPriceForm(forms.ModelForm):
     class Meta:
@@ -61,10 +97,7 @@ class DistanceAdditionalPriceForm(forms.ModelForm):
         fields = ['price_per_km']
 
     def clean_price_per_km(self):
-        price = self.cleaned_data.get('price_per_km')
-        if price <= 0:
-            raise ValidationError('Price per km must be greater than 0')
-        return price
+        return validate_price_per_km(self.cleaned_data.get('price_per_km'))
 
 class TimeMultiplierFactorForm(forms.ModelForm):
     class Meta:
@@ -72,16 +105,10 @@ class TimeMultiplierFactorForm(forms.ModelForm):
         fields = ['time_threshold', 'multiplier']
 
     def clean_time_threshold(self):
-        threshold = self.cleaned_data.get('time_threshold')
-        if threshold <= 0:
-            raise ValidationError('Time threshold must be greater than 0')
-        return threshold
+        return validate_time_threshold(self.cleaned_data.get('time_threshold'))
 
     def clean_multiplier(self):
-        multiplier = self.cleaned_data.get('multiplier')
-        if multiplier <= 0:
-            raise ValidationError('Multiplier must be greater than 0')
-        return multiplier
+        return validate_multiplier(self.cleaned_data.get('multiplier'))
 
 class WaitingChargeForm(forms.ModelForm):
     class Meta:
@@ -89,28 +116,139 @@ class WaitingChargeForm(forms.ModelForm):
         fields = ['initial_wait_time', 'charge_per_interval', 'interval_minutes']
 
     def clean_initial_wait_time(self):
-        time = self.cleaned_data.get('initial_wait_time')
-        if time < 0:
-            raise ValidationError('Initial wait time cannot be negative')
-        return time
+        return validate_initial_wait_time(self.cleaned_data.get('initial_wait_time'))
 
     def clean_charge_per_interval(self):
-        charge = self.cleaned_data.get('charge_per_interval')
-        if charge <= 0:
-            raise ValidationError('Charge per interval must be greater than 0')
-        return charge
+        return validate_charge_per_interval(self.cleaned_data.get('charge_per_interval'))
 
     def clean_interval_minutes(self):
-        interval = self.cleaned_data.get('interval_minutes')
-        if interval <= 0:
-            raise ValidationError('Interval minutes must be greater than 0')
-        return interval
+        return validate_interval_minutes(self.cleaned_data.get('interval_minutes'))
+
+def _json_value(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+class ExistingRowChoiceField(forms.ModelChoiceField):
+    """Primary key field of a formset row, resolved against the rows the formset loaded."""
+
+    def __init__(self, formset, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.formset = formset
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            row = self.formset._existing_object(self.formset._pk_field.to_python(value))
+        except ValidationError:
+            row = None
+        if row is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value}
+            )
+        return row
+
+class ComponentFormSet(BaseInlineFormSet):
+    """
+    Inline formset of pricing components that writes only the rows that
+    changed, with one bulk query per kind of change, and records the changes
+    field by field in self.changes.
+    """
+
+    @cached_property
+    def row_fields(self):
+        """Model fields that make up a component row."""
+        return [
+            field.name for field in self.model._meta.concrete_fields
+            if not field.primary_key and field != self.fk
+        ]
+
+    def row_values(self, instance):
+        return {name: getattr(instance, name) for name in self.row_fields}
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        # Django looks up each posted primary key with a query of its own
+        field = form.fields[self._pk_field.name]
+        form.fields[self._pk_field.name] = ExistingRowChoiceField(
+            self, field.queryset, initial=field.initial, required=False, widget=field.widget
+        )
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        # Validation updates the instance in place, so keep its stored values
+        if i < self.initial_form_count() and form.instance.pk is not None:
+            form.stored_values = self.row_values(form.instance)
+        return form
+
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+
+        self.new_objects = []
+        self.changed_objects = []
+        self.deleted_objects = []
+        self.changes = []
+        for form in self.initial_forms:
+            instance = form.instance
+            if instance.pk is None:
+                continue
+            if self.can_delete and self._should_delete_form(form):
+                self.deleted_objects.append(instance)
+                self.changes.append({
+                    'action': 'deleted',
+                    'id': instance.pk,
+                    'values': {name: _json_value(value) for name, value in form.stored_values.items()},
+                })
+                continue
+            if not form.has_changed():
+                continue
+            form.save(commit=False)
+            values = self.row_values(instance)
+            # A form can change without its row changing, e.g. 80 for 80.00
+            changed = [name for name in self.row_fields if values[name] != form.stored_values[name]]
+            if changed:
+                self.changed_objects.append((instance, changed))
+                self.changes.append({
+                    'action': 'updated',
+                    'id': instance.pk,
+                    'fields': {
+                        name: [_json_value(form.stored_values[name]), _json_value(values[name])]
+                        for name in changed
+                    },
+                })
+        for form in self.extra_forms:
+            if form.has_changed() and not (self.can_delete and self._should_delete_form(form)):
+                self.new_objects.append(form.save(commit=False))
+
+        if self.deleted_objects:
+            self.model.objects.filter(pk__in=[instance.pk for instance in self.deleted_objects]).delete()
+        if self.changed_objects:
+            fields = [name for name in self.row_fields if any(name in changed for _, changed in self.changed_objects)]
+            self.model.objects.bulk_update([instance for instance, _ in self.changed_objects], fields)
+        if self.new_objects:
+            self.model.objects.bulk_create(self.new_objects)
+            self.changes.extend(
+                {
+                    'action': 'created',
+                    'id': instance.pk,
+                    'values': {name: _json_value(value) for name, value in self.row_values(instance).items()},
+                }
+                for instance in self.new_objects
+            )
+        return self.new_objects + [instance for instance, _ in self.changed_objects]
+
+    def saved_rows(self):
+        """The config's rows after save(), in primary key order, without querying them again."""
+        deleted = {instance.pk for instance in self.deleted_objects}
+        rows = [instance for instance in self.get_queryset() if instance.pk not in deleted]
+        return sorted(rows + self.new_objects, key=lambda instance: instance.pk)
 
 # Create formsets for inline editing
 DistanceBasePriceFormSet = inlineformset_factory(
     PricingConfig,
     DistanceBasePrice,
     form=DistanceBasePriceForm,
+    formset=ComponentFormSet,
     extra=1,
     can_delete=True
 )
@@ -119,6 +257,7 @@ DistanceAdditionalPriceFormSet = inlineformset_factory(
     PricingConfig,
     DistanceAdditionalPrice,
     form=DistanceAdditionalPriceForm,
+    formset=ComponentFormSet,
     extra=1,
     can_delete=True
 )
@@ -127,6 +266,7 @@ TimeMultiplierFactorFormSet = inlineformset_factory(
     PricingConfig,
     TimeMultiplierFactor,
     form=TimeMultiplierFactorForm,
+    formset=ComponentFormSet,
     extra=1,
     can_delete=True
 )
@@ -135,6 +275,7 @@ WaitingChargeFormSet = inlineformset_factory(
     PricingConfig,
     WaitingCharge,
     form=WaitingChargeForm,
+    formset=ComponentFormSet,
     extra=1,
     can_delete=True
 ) 
\ No newline at end of file
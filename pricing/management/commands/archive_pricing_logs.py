@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from pricing.models import PriceCalculationLog, PricingConfigLog
+
+MODELS = {
+    'config': PricingConfigLog,
+    'calculation': PriceCalculationLog,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Move log rows older than the retention period into gzipped NDJSON files, one per month '
+        '(e.g. pricingconfiglog-2024-01.ndjson.gz), deleting them from the database in chunks. '
+        'Each chunk is written and synced to its archive before it is deleted in a short '
+        'transaction of its own, so rows are never lost and locks are never held for long.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=settings.PRICING_LOG_RETENTION_DAYS,
+            help='Archive rows older than this many days (default: PRICING_LOG_RETENTION_DAYS)'
+        )
+        parser.add_argument(
+            '--output-dir', default=settings.PRICING_LOG_ARCHIVE_DIR,
+            help='Directory for the archive files (default: PRICING_LOG_ARCHIVE_DIR)'
+        )
+        parser.add_argument(
+            '--model', choices=MODELS, default='config',
+            help='config for PricingConfigLog, calculation for PriceCalculationLog'
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows archived and deleted at a time')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be archived, change nothing')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be greater than 0')
+        if options['older_than'] < 0:
+            raise CommandError('--older-than cannot be negative')
+
+        model = MODELS[options['model']]
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        output_dir = options['output_dir']
+        prefix = model._meta.model_name
+        fields = [field.attname for field in model._meta.concrete_fields]
+        if not options['dry_run']:
+            os.makedirs(output_dir, exist_ok=True)
+
+        archived = {}
+        position = None
+        while True:
+            # Oldest first, resuming after the last row seen so a dry run,
+            # which deletes nothing, still makes progress
+            rows = model.objects.filter(timestamp__lt=cutoff)
+            if position:
+                timestamp, pk = position
+                rows = rows.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk))
+            rows = list(rows.order_by('timestamp', 'pk').values(*fields)[:options['chunk_size']])
+            if not rows:
+                break
+            position = rows[-1]['timestamp'], rows[-1]['id']
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(row['timestamp'].strftime('%Y-%m'), []).append(row)
+            for month, month_rows in by_month.items():
+                if not options['dry_run']:
+                    self.append(os.path.join(output_dir, f'{prefix}-{month}.ndjson.gz'), month_rows)
+                archived[month] = archived.get(month, 0) + len(month_rows)
+
+            if not options['dry_run']:
+                with transaction.atomic():
+                    model.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        for month, count in sorted(archived.items()):
+            self.stdout.write(f'{verb} {count} {prefix} rows from {month}')
+        self.stdout.write(f'{verb} {sum(archived.values())} rows older than {cutoff:%Y-%m-%d %H:%M}')
+
+    def append(self, path, rows):
+        # Every chunk is a gzip member of its own; gzip readers read the
+        # concatenated members as one stream
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                for row in rows:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder).encode() + b'\n')
+            raw.flush()
+            os.fsync(raw.fileno())
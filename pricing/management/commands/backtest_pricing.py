@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from pricing.backtest import COMPONENTS, run_backtest_file, write_details
+from pricing.bulk import DEFAULT_CHUNK_SIZE, FORMATS
+from pricing.models import PricingConfig
+from pricing.tariff import tariff_for_config
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a CSV or NDJSON trip history against the current and a draft pricing configuration '
+        'and report how every fare component and the final prices would change. Chunks of trips are '
+        'priced in parallel worker processes with the same engine as bulk pricing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="Trip history to replay, or '-' to read from stdin")
+        parser.add_argument('current', type=int, help='PricingConfig ID of the current configuration')
+        parser.add_argument('draft', type=int, help='PricingConfig ID of the draft configuration')
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Trips priced per chunk')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes pricing chunks in parallel (default: one per CPU; 1 prices in process)'
+        )
+        parser.add_argument('--details', help='CSV file to write every trip under both configurations to')
+        parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be greater than 0')
+        if options['workers'] <= 0:
+            raise CommandError('--workers must be greater than 0')
+        fmt = options['format'] or self.guess_format(options['input'])
+
+        tariffs = []
+        for config_id in (options['current'], options['draft']):
+            try:
+                tariffs.append(tariff_for_config(config_id))
+            except PricingConfig.DoesNotExist:
+                raise CommandError(f'Pricing configuration {config_id} does not exist')
+
+        source = sys.stdin.buffer if options['input'] == '-' else open(options['input'], 'rb')
+        details = open(options['details'], 'w', newline='') if options['details'] else None
+        try:
+            summary = run_backtest_file(
+                *tariffs,
+                source,
+                fmt,
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                details=write_details(details) if details else None
+            )
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+            if details:
+                details.close()
+
+        report = summary.as_dict()
+        if options['json']:
+            self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder, indent=2))
+        else:
+            self.write_report(report)
+
+    def write_report(self, report):
+        self.stdout.write(
+            f"{report['trips']} trips: {report['compared']} compared, {report['invalid']} invalid, "
+            f"{report['unpriced_current']} unpriced under the current and "
+            f"{report['unpriced_draft']} under the draft configuration"
+        )
+        self.stdout.write('')
+        self.stdout.write(f"{'Component':<28}{'Current':>16}{'Draft':>16}{'Delta':>16}{'Mean':>10}{'Change':>10}")
+        for component in COMPONENTS:
+            row = report['components'][component]
+            change = f"{row['change_percent']}%" if row['change_percent'] is not None else '-'
+            self.stdout.write(
+                f"{component:<28}{row['current']:>16}{row['draft']:>16}{row['delta']:>16}"
+                f"{row['mean_delta'] if row['mean_delta'] is not None else '-':>10}{change:>10}"
+            )
+        self.stdout.write('')
+
+        final_price = report['final_price']
+        self.stdout.write(
+            f"Final price: {final_price['increased']} up, {final_price['decreased']} down, "
+            f"{final_price['unchanged']} unchanged"
+        )
+        if report['compared']:
+            self.stdout.write('Delta per trip: ' + ', '.join(
+                f'{name[:-len("_delta")]} {value}' for name, value in final_price.items() if name.endswith('_delta')
+            ))
+
+    def guess_format(self, path):
+        if path.lower().endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+        if path.lower().endswith('.csv'):
+            return 'csv'
+        raise CommandError('Cannot tell the input format from the file name, pass --format')
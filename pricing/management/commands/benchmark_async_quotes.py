@@ -0,0 +1,104 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from pricing.benchmarks import summarise
+from pricing.tariff import get_active_tariff
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare quote throughput and latency of the sync view under WSGI, the sync view under ASGI '
+        'and the native async view, at a given concurrency, against the active pricing configuration.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Quotes per mode')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not get_active_tariff():
+            raise CommandError('No active pricing configuration found')
+
+        rng = random.Random(options['seed'])
+        trips = [
+            {
+                'distance': round(rng.uniform(0.5, 30), 2),
+                'duration': rng.randint(5, 180),
+                'waiting_time': rng.randint(0, 20),
+                'day_of_week': rng.randint(0, 6),
+            }
+            for _ in range(options['requests'])
+        ]
+        concurrency = options['concurrency']
+        sync_url = reverse('calculate_price')
+        async_url = reverse('calculate_price_async')
+
+        # Logging is left out so only request handling is measured. The test
+        # clients address the site as 'testserver'.
+        with override_settings(
+            PRICING_CALCULATION_LOG={'ENABLED': False},
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            results = {
+                'sync_wsgi': self.run_wsgi(sync_url, trips, concurrency),
+                'sync_asgi': asyncio.run(self.run_asgi(sync_url, trips, concurrency)),
+                'native_async': asyncio.run(self.run_asgi(async_url, trips, concurrency)),
+            }
+
+        self.stdout.write(f"{'mode':<14}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<14}{result['throughput']:>10.0f}{result['p50_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['errors']:>8}"
+            )
+
+    def summarise(self, latencies, errors, elapsed):
+        return {**summarise(latencies, elapsed), 'errors': errors}
+
+    def run_wsgi(self, url, trips, concurrency):
+        local = threading.local()
+
+        def post(trip):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            started = time.perf_counter()
+            response = local.client.post(url, trip, content_type='application/json')
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(post, trips))
+        elapsed = time.perf_counter() - started
+        return self.summarise(
+            [latency for latency, _ in outcomes],
+            sum(1 for _, status in outcomes if status != 200),
+            elapsed
+        )
+
+    async def run_asgi(self, url, trips, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(trip):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(url, trip, content_type='application/json')
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(post(trip) for trip in trips))
+        elapsed = time.perf_counter() - started
+        return self.summarise(
+            [latency for latency, _ in outcomes],
+            sum(1 for _, status in outcomes if status != 200),
+            elapsed
+        )
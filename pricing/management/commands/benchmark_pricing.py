@@ -0,0 +1,175 @@
+import json
+import platform
+import random
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from pricing.benchmarks import edit_post_data, seed_config, summarise
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the pricing hot paths against seeded configs of varying size in a throwaway '
+        'test database. Reports throughput, p50/p99 latency and queries per request, writes the '
+        'results as JSON and optionally compares them with an earlier run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1,10,50',
+            help='Comma separated config sizes; a size of N seeds N configs, each with N base prices '
+                 'and multipliers and 10*N change log rows'
+        )
+        parser.add_argument('--iterations', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Relative p50 slowdown counted as a regression (default 0.2 = 20%%)'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of integers')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        self.rng = random.Random(options['seed'])
+        self.iterations = options['iterations']
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # Keep one persistent connection, as a production worker would, so that
+        # closing it between requests neither costs time nor loses query counts
+        connection.settings_dict['CONN_MAX_AGE'] = None
+        try:
+            # Logging writes from a background thread; keep it out of the measurements
+            with override_settings(PRICING_CALCULATION_LOG={'ENABLED': False}):
+                results = {}
+                for size in sizes:
+                    results.update(self.run_size(size))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': self.iterations,
+                'sizes': sizes,
+            },
+            'results': results,
+        }
+        self.print_results(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if baseline:
+            regressions = self.regressions(results, baseline['results'], options['threshold'])
+            if regressions:
+                raise CommandError('Regressions found:\n' + '\n'.join(regressions))
+
+    def run_size(self, size):
+        call_command('flush', interactive=False, verbosity=0)
+        user = User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+        configs = [
+            seed_config(f'Benchmark {size}-{i}', size, logs=10 * size, user=user, is_active=(i == 0))
+            for i in range(size)
+        ]
+        config = configs[0]
+        client = Client()
+        client.force_login(user)
+
+        def calculate_price():
+            return client.post(reverse('calculate_price'), {
+                'distance': round(self.rng.uniform(0.5, 30), 2),
+                'duration': self.rng.randint(5, 180),
+                'waiting_time': self.rng.randint(0, 20),
+                'day_of_week': self.rng.randint(0, 6),
+            }, content_type='application/json')
+
+        edit_data = edit_post_data(config)
+        edit_price_field = 'distance_base_prices-0-base_price'
+
+        def config_edit():
+            # Alternate a base price so every submission really changes the config
+            edit_data[edit_price_field] = '81.00' if edit_data[edit_price_field] != '81.00' else '80.00'
+            return client.post(reverse('pricing_config_edit', args=[config.pk]), edit_data)
+
+        scenarios = {
+            'calculate_price': calculate_price,
+            'pricing_config_detail': lambda: client.get(reverse('pricing_config_detail', args=[config.pk])),
+            'pricing_config_list': lambda: client.get(reverse('pricing_config_list')),
+            'pricing_config_edit': config_edit,
+        }
+        return {
+            f'{name}[size={size}]': self.measure(request)
+            for name, request in scenarios.items()
+        }
+
+    def measure(self, request):
+        # One untimed request warms caches and counts the queries a request runs.
+        # The query log is a bounded deque, so empty it first or a full log
+        # would make the count come out as zero.
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        if response.status_code >= 400:
+            raise CommandError(f'Benchmark request failed with status {response.status_code}')
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(self.iterations):
+            request_started = time.perf_counter()
+            request()
+            latencies.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+        return {**summarise(latencies, elapsed), 'queries': len(queries)}
+
+    def print_results(self, results, baseline):
+        previous = baseline['results'] if baseline else {}
+        self.stdout.write(f"{'scenario':<36}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}{'p50 vs base':>13}")
+        for name, result in results.items():
+            change = ''
+            if name in previous and previous[name]['p50_ms']:
+                change = f"{(result['p50_ms'] / previous[name]['p50_ms'] - 1) * 100:+.1f}%"
+            self.stdout.write(
+                f"{name:<36}{result['throughput']:>10.0f}{result['p50_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['queries']:>9}{change:>13}"
+            )
+
+    def regressions(self, results, previous, threshold):
+        found = []
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            before = previous[name]
+            if result['queries'] > before['queries']:
+                found.append(f"{name}: {before['queries']} -> {result['queries']} queries per request")
+            if before['p50_ms'] and result['p50_ms'] > before['p50_ms'] * (1 + threshold):
+                found.append(f"{name}: p50 {before['p50_ms']:.2f}ms -> {result['p50_ms']:.2f}ms")
+        return found
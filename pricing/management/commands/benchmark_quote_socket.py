@@ -0,0 +1,127 @@
+import http.client
+import json
+import os
+import random
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from pricing.benchmarks import summarise
+from pricing.quote_protocol import QuoteClient
+from pricing.quote_server import BackgroundServer
+from pricing.tariff import get_active_tariff
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare quote throughput of the quote socket, one request at a time and pipelined, with the '
+        'HTTP price calculation API, against the active pricing configuration. Latencies are per round '
+        'trip, so a pipelined round trip prices --pipeline trips.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help='Quotes per mode')
+        parser.add_argument('--pipeline', type=int, default=100, help='Requests per pipelined round trip')
+        parser.add_argument('--socket', help='Quote socket of a running server (default: start one in-process)')
+        parser.add_argument(
+            '--url', help='calculate_price URL of a running HTTP server (default: the in-process test client)'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['requests'] <= 0 or options['pipeline'] <= 0:
+            raise CommandError('--requests and --pipeline must be greater than 0')
+        if not get_active_tariff():
+            raise CommandError('No active pricing configuration found')
+
+        rng = random.Random(options['seed'])
+        trips = [
+            (round(rng.uniform(0.5, 30), 2), rng.randint(5, 180), rng.randint(0, 20), rng.randint(0, 6))
+            for _ in range(options['requests'])
+        ]
+
+        # Logging is left out so only request handling is measured. The test
+        # client addresses the site as 'testserver'.
+        with override_settings(
+            PRICING_CALCULATION_LOG={'ENABLED': False},
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            results = {}
+            if options['socket']:
+                results.update(self.run_socket_modes(options['socket'], trips, options['pipeline']))
+            else:
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, 'quotes.sock')
+                    with BackgroundServer(path):
+                        results.update(self.run_socket_modes(path, trips, options['pipeline']))
+            results['http'] = self.run_http(options['url'], trips)
+
+        self.stdout.write(f"{'mode':<18}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<18}{result['throughput']:>10.0f}{result['p50_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['errors']:>8}"
+            )
+
+    def summarise(self, latencies, requests, errors, elapsed):
+        # Throughput counts quotes, not round trips
+        return {
+            **summarise(latencies, elapsed),
+            'throughput': requests / elapsed if elapsed else 0.0,
+            'errors': errors,
+        }
+
+    def run_socket_modes(self, path, trips, pipeline):
+        return {
+            'socket': self.run_socket(path, trips, 1),
+            'socket_pipelined': self.run_socket(path, trips, pipeline),
+        }
+
+    def run_socket(self, path, trips, batch_size):
+        latencies = []
+        errors = 0
+        with QuoteClient(path) as client:
+            started = time.perf_counter()
+            for start in range(0, len(trips), batch_size):
+                sent = time.perf_counter()
+                results = client.quote_many(trips[start:start + batch_size])
+                latencies.append(time.perf_counter() - sent)
+                errors += sum(1 for result in results if 'error' in result)
+            elapsed = time.perf_counter() - started
+        return self.summarise(latencies, len(trips), errors, elapsed)
+
+    def run_http(self, url, trips):
+        if url:
+            parts = urlsplit(url)
+            connection = http.client.HTTPConnection(parts.netloc)
+
+            def post(body):
+                connection.request('POST', parts.path, body, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                return response.status
+        else:
+            client = Client()
+            path = reverse('calculate_price')
+
+            def post(body):
+                return client.post(path, body, content_type='application/json').status_code
+
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for distance, duration, waiting_time, day_of_week in trips:
+            body = json.dumps({
+                'distance': distance, 'duration': duration, 'waiting_time': waiting_time, 'day_of_week': day_of_week
+            })
+            sent = time.perf_counter()
+            if post(body) != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - started
+        return self.summarise(latencies, len(trips), errors, elapsed)
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pricing.models import PricingConfig
+from pricing.transfer import FORMATS, export_configs, write_csv, write_json
+
+
+class Command(BaseCommand):
+    help = 'Export pricing configurations with all their components as JSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--config', type=int, action='append', help='PricingConfig ID to export (repeatable; default: all)')
+        parser.add_argument('--format', choices=FORMATS, help='Output format (default: from the file extension, else json)')
+        parser.add_argument('--output', help='File to write to (default: stdout)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if (options['output'] or '').lower().endswith('.csv') else 'json')
+        configs = PricingConfig.objects.all()
+        if options['config']:
+            configs = configs.filter(pk__in=options['config'])
+            missing = set(options['config']) - set(configs.values_list('pk', flat=True))
+            if missing:
+                raise CommandError(f"Pricing configuration(s) {', '.join(map(str, sorted(missing)))} do not exist")
+
+        documents = export_configs(configs)
+        target = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            (write_csv if fmt == 'csv' else write_json)(documents, target)
+        finally:
+            if target is not sys.stdout:
+                target.close()
+        if options['output']:
+            self.stderr.write(f'Exported {len(documents)} configurations to {options["output"]}')
@@ -0,0 +1,43 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pricing.transfer import FORMATS, TransferError, clean_documents, import_configs, read_documents
+
+MAX_ERRORS_SHOWN = 50
+
+
+class Command(BaseCommand):
+    help = (
+        'Import pricing configurations with all their components from JSON or CSV, as written by '
+        'export_pricing_configs. Every row is validated with the edit form rules first; nothing is '
+        'imported unless the whole file is valid.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="File to import, or '-' to read from stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from the file extension, else json)')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, import nothing')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['input'].lower().endswith('.csv') else 'json')
+        started = time.perf_counter()
+        source = sys.stdin.buffer if options['input'] == '-' else open(options['input'], 'rb')
+        try:
+            cleaned = clean_documents(read_documents(source, fmt))
+        except TransferError as e:
+            shown = e.errors[:MAX_ERRORS_SHOWN]
+            more = len(e.errors) - len(shown)
+            raise CommandError('\n'.join(shown + ([f'... and {more} more'] if more else [])))
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(cleaned)} configurations are valid; nothing imported (dry run)')
+            return
+        configs = import_configs(cleaned)
+        self.stdout.write(
+            f'Imported {len(configs)} configurations in {time.perf_counter() - started:.2f}s'
+        )
@@ -0,0 +1,53 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pricing.bulk import DEFAULT_CHUNK_SIZE, FORMATS, price_stream
+from pricing.models import PricingConfig
+from pricing.tariff import get_active_tariff, tariff_for_config
+
+
+class Command(BaseCommand):
+    help = 'Price a CSV or NDJSON file of trips against a pricing configuration, streaming the results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="Trip file to price, or '-' to read from stdin")
+        parser.add_argument('--config', type=int, help='PricingConfig ID to price against (default: the active config)')
+        parser.add_argument('--format', choices=FORMATS, help='Input and output format (default: from the file extension)')
+        parser.add_argument('--output', help='File to write priced trips to (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Trips priced per chunk')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or self.guess_format(options['input'])
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be greater than 0')
+
+        if options['config']:
+            try:
+                tariff = tariff_for_config(options['config'])
+            except PricingConfig.DoesNotExist:
+                raise CommandError(f"Pricing configuration {options['config']} does not exist")
+        else:
+            tariff = get_active_tariff()
+            if not tariff:
+                raise CommandError('No active pricing configuration found')
+
+        source = sys.stdin.buffer if options['input'] == '-' else open(options['input'], 'rb')
+        target = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in price_stream(tariff, source, fmt, options['chunk_size']):
+                target.write(chunk)
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+            if target is not sys.stdout.buffer:
+                target.close()
+            else:
+                target.flush()
+
+    def guess_format(self, path):
+        if path.lower().endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+        if path.lower().endswith('.csv'):
+            return 'csv'
+        raise CommandError('Cannot tell the input format from the file name, pass --format')
@@ -0,0 +1,45 @@
+import asyncio
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pricing.quote_server import serve
+from pricing.tariff import get_active
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve price quotes over a Unix domain socket with the binary protocol of '
+        'pricing.quote_protocol, for services on the same host. Quotes come from the same tariff, '
+        'quote cache and calculation log as the HTTP API. Pipelined requests are answered in order.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket', default=settings.PRICING_QUOTE_SOCKET_PATH,
+            help='Path of the socket to listen on (default: PRICING_QUOTE_SOCKET_PATH)'
+        )
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError('Pass --socket or set PRICING_QUOTE_SOCKET_PATH')
+        path = str(options['socket'])
+        # Compile the tariff before the first connection
+        if not get_active():
+            self.stderr.write('No active pricing configuration; quotes fail until one is activated')
+        self.stdout.write(f'Serving quotes on {path}')
+        asyncio.run(self.serve(path))
+
+    async def serve(self, path):
+        # Stop cleanly, removing the socket, on Ctrl-C or when the supervisor stops us
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, task.cancel)
+        try:
+            await serve(path)
+        except asyncio.CancelledError:
+            self.stdout.write('Stopped')
+        except RuntimeError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pricing import snapshot
+from pricing.tariff import load_active
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile the active pricing configuration into a binary tariff snapshot that every worker '
+        'memory-maps. The file is replaced atomically, and workers pick up the new version within '
+        'PRICING_TARIFF_SNAPSHOT_CHECK_INTERVAL seconds. Run it again after changing pricing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.PRICING_TARIFF_SNAPSHOT_PATH,
+            help='Snapshot file to write (default: PRICING_TARIFF_SNAPSHOT_PATH)'
+        )
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Pass --output or set PRICING_TARIFF_SNAPSHOT_PATH')
+        # Always compiled from the database, never from the current snapshot
+        active = load_active()
+        snapshot.write(options['output'], active)
+        if active is None:
+            self.stdout.write(f"No active pricing configuration; wrote an empty snapshot to {options['output']}")
+        else:
+            config_id, compiled = active
+            self.stdout.write(
+                f"Wrote tariff version {compiled.version_id} of configuration {config_id} to {options['output']}"
+            )
@@ -0,0 +1,184 @@
+"""
+Per-request SQL profiling.
+
+QueryProfilingMiddleware installs a connection.execute_wrapper() for the
+length of each request, so it sees every query whatever the DEBUG setting.
+It counts the queries, the time spent in SQL and the queries repeated within
+the request: exact duplicates (same SQL and parameters) and similar queries
+(same SQL, other parameters, the usual sign of an N+1 loop). A warning is
+logged when a request runs more queries than its view's budget in
+PRICING_QUERY_PROFILING['BUDGETS'] or spends more than SLOW_REQUEST_MS in
+SQL. Per-view totals are kept in process, and the metrics endpoint lists the
+slowest views. The middleware is async-capable, so under ASGI it awaits
+async views directly instead of putting each request on a thread.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 200,
+    'BUDGETS': {},
+}
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'PRICING_QUERY_PROFILING', {})}
+
+
+class QueryProfile:
+    """Execute wrapper recording the queries of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+        self.executions = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+            self.executions[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        """Queries that repeat an earlier query with the same parameters."""
+        return sum(count - 1 for count in self.executions.values())
+
+    @property
+    def similar(self):
+        """Queries that repeat earlier SQL, whatever the parameters."""
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_repeated(self):
+        sql, count = self.statements.most_common(1)[0] if self.statements else ('', 0)
+        return sql, count
+
+
+class QueryProfileStats:
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, view_name, profile, over_budget):
+        with self._lock:
+            view = self._views.get(view_name)
+            if view is None:
+                view = self._views[view_name] = {
+                    'requests': 0, 'queries': 0, 'max_queries': 0, 'sql_ms': 0.0,
+                    'max_sql_ms': 0.0, 'duplicates': 0, 'over_budget': 0,
+                }
+            sql_ms = profile.time * 1000
+            view['requests'] += 1
+            view['queries'] += profile.count
+            view['max_queries'] = max(view['max_queries'], profile.count)
+            view['sql_ms'] += sql_ms
+            view['max_sql_ms'] = max(view['max_sql_ms'], sql_ms)
+            view['duplicates'] += profile.duplicates
+            view['over_budget'] += over_budget
+
+    def slowest(self, limit=10):
+        """Per-view query statistics, the views with the most SQL time per request first."""
+        with self._lock:
+            views = [
+                {
+                    'view': view_name,
+                    'requests': view['requests'],
+                    'mean_queries': view['queries'] / view['requests'],
+                    'max_queries': view['max_queries'],
+                    'mean_sql_ms': view['sql_ms'] / view['requests'],
+                    'max_sql_ms': view['max_sql_ms'],
+                    'duplicates': view['duplicates'],
+                    'over_budget': view['over_budget'],
+                }
+                for view_name, view in self._views.items()
+            ]
+        views.sort(key=lambda view: view['mean_sql_ms'], reverse=True)
+        return views[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+_stats = QueryProfileStats()
+
+
+def get_query_stats():
+    return _stats
+
+
+class QueryProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        options = get_options()
+        if not options['ENABLED']:
+            return self.get_response(request)
+
+        profile = QueryProfile()
+        with self.profiling(profile):
+            response = self.get_response(request)
+        self.report(request, profile, options)
+        return response
+
+    async def __acall__(self, request):
+        options = get_options()
+        if not options['ENABLED']:
+            return await self.get_response(request)
+
+        profile = QueryProfile()
+        with self.profiling(profile):
+            response = await self.get_response(request)
+        self.report(request, profile, options)
+        return response
+
+    def profiling(self, profile):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(profile))
+        return stack
+
+    def report(self, request, profile, options):
+        match = request.resolver_match
+        # Unresolved paths share one entry so stray URLs cannot grow the stats
+        view_name = match.view_name if match else '<unresolved>'
+        budget = options['BUDGETS'].get(view_name)
+        over_budget = budget is not None and profile.count > budget
+        _stats.record(view_name, profile, over_budget)
+
+        if over_budget:
+            sql, repeats = profile.most_repeated()
+            logger.warning(
+                '%s ran %d queries, over its budget of %d (%d similar, most repeated %dx: %s)',
+                view_name, profile.count, budget, profile.similar, repeats, sql[:200]
+            )
+        sql_ms = profile.time * 1000
+        if sql_ms > options['SLOW_REQUEST_MS']:
+            logger.warning(
+                '%s spent %.1fms in %d queries (%d duplicates)',
+                view_name, sql_ms, profile.count, profile.duplicates
+            )
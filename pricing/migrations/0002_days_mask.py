@@ -0,0 +1,51 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:56
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def days_to_mask(apps, schema_editor):
+    DistanceBasePrice = apps.get_model('pricing', 'DistanceBasePrice')
+    for base_price in DistanceBasePrice.objects.all().iterator():
+        mask = 0
+        for day in base_price.days_of_week or []:
+            mask |= 1 << int(day)
+        base_price.days_mask = mask
+        base_price.save(update_fields=['days_mask'])
+
+
+def mask_to_days(apps, schema_editor):
+    DistanceBasePrice = apps.get_model('pricing', 'DistanceBasePrice')
+    for base_price in DistanceBasePrice.objects.all().iterator():
+        base_price.days_of_week = [day for day in range(7) if base_price.days_mask & (1 << day)]
+        base_price.save(update_fields=['days_of_week'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distancebaseprice',
+            name='days_mask',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Bitmask of days this price applies to (bit 0 = Monday ... bit 6 = Sunday)', validators=[django.core.validators.MaxValueValidator(127)]),
+        ),
+        # Nullable while the data is copied, so the migration can be reversed
+        migrations.AlterField(
+            model_name='distancebaseprice',
+            name='days_of_week',
+            field=models.JSONField(help_text='List of days (0-6) this price applies to', null=True),
+        ),
+        migrations.RunPython(days_to_mask, mask_to_days),
+        migrations.RemoveField(
+            model_name='distancebaseprice',
+            name='days_of_week',
+        ),
+        migrations.AddIndex(
+            model_name='distancebaseprice',
+            index=models.Index(fields=['pricing_config', 'days_mask'], name='pricing_dbp_config_days_idx'),
+        ),
+    ]
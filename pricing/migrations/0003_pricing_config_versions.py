@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricing', '0002_days_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingConfigVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pricingconfig',
+            name='current_version',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Snapshot of the pricing components as last saved', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pricing.pricingconfigversion'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricing', '0003_pricing_config_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceCalculationLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('distance', models.DecimalField(decimal_places=3, help_text='Distance in kilometers', max_digits=12)),
+                ('duration', models.IntegerField(help_text='Duration in minutes')),
+                ('waiting_time', models.IntegerField(help_text='Waiting time in minutes')),
+                ('day_of_week', models.SmallIntegerField()),
+                ('final_price', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('breakdown', models.JSONField()),
+                ('pricing_config', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='calculation_logs', to='pricing.pricingconfig')),
+                ('version', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pricing.pricingconfigversion')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Concurrent index builds cannot run inside a transaction, and do not
+    # block writes to the log table while they run
+    atomic = False
+
+    dependencies = [
+        ('pricing', '0004_price_calculation_log'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='pricingconfiglog',
+            index=models.Index(fields=['pricing_config', 'timestamp'], name='pricing_log_config_ts_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='pricingconfiglog',
+            index=models.Index(fields=['timestamp'], name='pricing_log_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:51
+
+from django.db import migrations, models
+
+
+def create_stamp(apps, schema_editor):
+    PricingStamp = apps.get_model('pricing', 'PricingStamp')
+    PricingStamp.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricing', '0005_pricing_config_log_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingStamp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_stamp, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,112 @@
+from django.core.validators import MaxValueValidator
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.auth.models import User
 
+class PricingConfigVersion(models.Model):
+    """Immutable snapshot of a config's pricing components, addressed by content hash."""
+    content_hash = models.CharField(max_length=64, unique=True)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Version {self.pk} ({self.content_hash[:12]})"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Pricing config versions are immutable')
+        super().save(*args, **kwargs)
+
+def _per_config(queryset, aggregate):
+    """Correlated subquery computing an aggregate over a config's rows."""
+    return models.Subquery(
+        queryset.filter(pricing_config=models.OuterRef('pk'))
+        .order_by()
+        .values('pricing_config')
+        .annotate(value=aggregate)
+        .values('value')
+    )
+
+class PricingConfigQuerySet(models.QuerySet):
+    def with_summary(self):
+        """
+        Annotate component counts and the time of the last logged change.
+        Each annotation is a correlated subquery, so the row count is not
+        multiplied by joins and the whole page is one query.
+        """
+        counts = {
+            'base_price_count': DistanceBasePrice.objects,
+            'additional_price_count': DistanceAdditionalPrice.objects,
+            'time_multiplier_count': TimeMultiplierFactor.objects,
+            'waiting_charge_count': WaitingCharge.objects,
+        }
+        return self.annotate(
+            **{
+                name: Coalesce(_per_config(manager.all(), models.Count('pk')), 0)
+                for name, manager in counts.items()
+            },
+            last_change=_per_config(PricingConfigLog.objects.all(), models.Max('timestamp')),
+        )
+
+    def with_components(self):
+        """Select the current version and prefetch every pricing component, in primary key order."""
+        return self.select_related('current_version').prefetch_related(
+            models.Prefetch('distance_base_prices', DistanceBasePrice.objects.order_by('pk')),
+            models.Prefetch('distance_additional_prices', DistanceAdditionalPrice.objects.order_by('pk')),
+            models.Prefetch('time_multipliers', TimeMultiplierFactor.objects.order_by('pk')),
+            models.Prefetch('waiting_charges', WaitingCharge.objects.order_by('pk')),
+        )
+
+    def with_recent_logs(self, count=10):
+        """Prefetch the most recent change logs of each config as recent_logs."""
+        return self.prefetch_related(
+            models.Prefetch(
+                'pricingconfiglog_set',
+                PricingConfigLog.objects.select_related('user').order_by('-timestamp', '-pk')[:count],
+                to_attr='recent_logs'
+            ),
+        )
+
 class PricingConfig(models.Model):
     name = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    current_version = models.ForeignKey(
+        PricingConfigVersion,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        help_text="Snapshot of the pricing components as last saved"
+    )
+
+    objects = PricingConfigQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+def days_to_mask(days):
+    """Pack a list of days (0-6, Monday-Sunday) into a 7-bit mask."""
+    mask = 0
+    for day in days:
+        mask |= 1 << int(day)
+    return mask
+
+def masks_for_day(day):
+    """All 7-bit masks that include the given day."""
+    if not 0 <= day <= 6:
+        return []
+    return [mask for mask in range(1, 128) if mask & (1 << day)]
+
+class DistanceBasePriceQuerySet(models.QuerySet):
+    def for_day(self, day):
+        # Expressed as an IN over the masks containing the day so the lookup
+        # can use the (pricing_config, days_mask) index
+        return self.filter(days_mask__in=masks_for_day(day))
+
 class DistanceBasePrice(models.Model):
     DAYS_OF_WEEK = [
         (0, 'Monday'),
@@ -22,13 +119,33 @@ class DistanceBasePrice(models.Model):
     ]
 
     pricing_config = models.ForeignKey(PricingConfig, on_delete=models.CASCADE, related_name='distance_base_prices')
-    days_of_week = models.JSONField(help_text="List of days (0-6) this price applies to")
+    days_mask = models.PositiveSmallIntegerField(
+        default=0,
+        validators=[MaxValueValidator(127)],
+        help_text="Bitmask of days this price applies to (bit 0 = Monday ... bit 6 = Sunday)"
+    )
     base_distance = models.DecimalField(max_digits=5, decimal_places=2, help_text="Distance in kilometers")
     base_price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    objects = DistanceBasePriceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pricing_config', 'days_mask'], name='pricing_dbp_config_days_idx'),
+        ]
+
     def __str__(self):
         return f"{self.base_price} INR up to {self.base_distance}KM"
 
+    @property
+    def days_of_week(self):
+        """List of days (0-6) this price applies to."""
+        return [day for day in range(7) if self.days_mask & (1 << day)]
+
+    @days_of_week.setter
+    def days_of_week(self, days):
+        self.days_mask = days_to_mask(days)
+
     def get_day_names(self):
         day_dict = dict(self.DAYS_OF_WEEK)
         return [day_dict[int(day)] for day in self.days_of_week]
@@ -64,5 +181,41 @@ class PricingConfigLog(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     details = models.JSONField()
 
+    class Meta:
+        indexes = [
+            # Serve a config's history newest first, and the admin list, as
+            # index range scans rather than sorts of the whole table
+            models.Index(fields=['pricing_config', 'timestamp'], name='pricing_log_config_ts_idx'),
+            models.Index(fields=['timestamp'], name='pricing_log_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} by {self.user} at {self.timestamp}"
+
+class PriceCalculationLog(models.Model):
+    pricing_config = models.ForeignKey(PricingConfig, on_delete=models.SET_NULL, null=True, related_name='calculation_logs')
+    version = models.ForeignKey(PricingConfigVersion, on_delete=models.PROTECT, null=True, related_name='+')
+    # Set when the quote is made, not when the buffered row is written
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+    distance = models.DecimalField(max_digits=12, decimal_places=3, help_text="Distance in kilometers")
+    duration = models.IntegerField(help_text="Duration in minutes")
+    waiting_time = models.IntegerField(help_text="Waiting time in minutes")
+    day_of_week = models.SmallIntegerField()
+    final_price = models.DecimalField(max_digits=14, decimal_places=2)
+    breakdown = models.JSONField()
+
+    def __str__(self):
+        return f"{self.final_price} INR for {self.distance}KM at {self.timestamp}"
+
+class PricingStamp(models.Model):
+    """
+    Single-row counter of changes to pricing data, bumped in the same
+    transaction as each change so every process can tell its caches are stale.
+    """
+    SINGLETON_ID = 1
+
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
-        return f"{self.action} by {self.user} at {self.timestamp}" 
\ No newline at end of file
+        return f"Pricing stamp {self.version}"
@@ -0,0 +1,57 @@
+"""
+Pagination for the ever-growing log tables.
+
+keyset_page() pages through rows newest first by (timestamp, id), so that
+every page is an index range scan whatever its depth, instead of an OFFSET
+that has to skip all earlier rows. CappedCountPaginator serves the admin
+changelists, whose page links need a row count, without counting the whole
+table.
+"""
+from datetime import datetime, timedelta, timezone
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(row):
+    """URL-safe cursor of a row: its timestamp in microseconds and its id."""
+    return f'{(row.timestamp - EPOCH) // MICROSECOND}_{row.pk}'
+
+
+def decode_cursor(cursor):
+    """Return the (timestamp, id) of a cursor, or None if it is not valid."""
+    try:
+        microseconds, pk = cursor.split('_')
+        return EPOCH + int(microseconds) * MICROSECOND, int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def keyset_page(queryset, cursor=None, page_size=50):
+    """
+    Return (rows, next_cursor) for the page of queryset that starts after
+    cursor, newest first. next_cursor is None on the last page.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        timestamp, pk = position
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+    # One extra row tells whether there is a next page
+    rows = list(queryset.order_by('-timestamp', '-pk')[:page_size + 1])
+    if len(rows) > page_size:
+        return rows[:page_size], encode_cursor(rows[page_size - 1])
+    return rows, None
+
+
+class CappedCountPaginator(Paginator):
+    """Counts at most max_count rows, so deep tables cost a bounded COUNT."""
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[:self.max_count].count()
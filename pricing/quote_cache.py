@@ -0,0 +1,115 @@
+"""
+Bounded LRU memoisation of price quotes.
+
+Quotes are keyed on the tariff version, its content hash and the normalised
+trip inputs. Since tariff versions are immutable an entry can never price
+against the wrong tariff, even when a version ID is reused, but the cache is still cleared whenever a pricing model changes so
+entries for superseded versions do not linger.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import single_flight
+from .stage_timing import NULL_TIMER
+
+
+class QuoteCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        """Return the cached quote for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_quote_cache():
+    """Return the process-wide QuoteCache configured by PRICING_QUOTE_CACHE."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                options = getattr(settings, 'PRICING_QUOTE_CACHE', {})
+                _cache = QuoteCache(options.get('MAX_SIZE', 0), options.get('TTL', 0))
+    return _cache
+
+
+def clear():
+    if _cache is not None:
+        _cache.clear()
+
+
+def cached_quote(tariff, distance, duration, waiting_time, day_of_week, timer=NULL_TIMER):
+    """Price a trip under a tariff, reusing a cached quote when there is one."""
+    cache = get_quote_cache()
+    if not cache.enabled:
+        return tariff.quote(distance, duration, waiting_time, day_of_week, timer)
+
+    # Decimal('5.0') and Decimal('5') compare and hash equal, so the
+    # distance needs no further normalisation to share a key
+    key = (tariff.version_id, tariff.content_hash, distance, duration, waiting_time, day_of_week)
+    with timer.stage('cache'):
+        quote = cache.get(key)
+    if quote is None:
+        # Identical requests that miss together share one computation
+        quote = single_flight.quotes.do(key, tariff.quote, distance, duration, waiting_time, day_of_week, timer)
+        cache.set(key, quote)
+    return quote
@@ -0,0 +1,170 @@
+"""
+Binary protocol of the quote socket, and a blocking client for it.
+
+The quote socket (see pricing/quote_server.py) serves calculate_price over
+a Unix domain socket to services on the same host, without HTTP. Every
+message is a frame: a 4-byte big-endian payload length, then the payload.
+
+    request     request ID (u32), distance in metres (i64), duration and
+                waiting time in minutes (i32), day of week (u8)
+    response    request ID (u32), status (u8), then for status OK the
+                tariff version ID (i64) and the quote's exact amounts
+                (i64 each, in EXACT_FIELDS order); for status ERROR the
+                error message in UTF-8
+
+The server answers the frames of a connection in the order it receives
+them, so a client may pipeline: send many requests, then read the
+responses. Distances travel in whole metres, the precision quotes are
+computed in. This module needs nothing but the standard library, so client
+services can use it without Django.
+"""
+import socket
+import struct
+from decimal import Decimal, ROUND_HALF_UP
+
+LENGTH = struct.Struct('!I')
+REQUEST = struct.Struct('!IqiiB')
+REQUEST_ID = struct.Struct('!I')
+RESPONSE_HEADER = struct.Struct('!IB')
+
+# Amounts of a quote's 'exact' breakdown, in paise, metres or hundredths
+EXACT_FIELDS = (
+    'distance_base_price_paise',
+    'additional_distance_m',
+    'additional_distance_price_paise',
+    'base_fare_paise',
+    'time_multiplier_c',
+    'time_adjusted_fare_paise',
+    'waiting_charge_paise',
+    'final_price_paise',
+)
+RESULT = struct.Struct('!q' + 'q' * len(EXACT_FIELDS))
+
+OK = 0
+ERROR = 1
+
+MAX_FRAME_SIZE = 64 * 1024
+
+# Requests a client sends before reading their responses
+PIPELINE_WINDOW = 256
+
+
+class ProtocolError(Exception):
+    """Raised on a malformed frame."""
+
+
+class QuoteError(Exception):
+    """Raised by QuoteClient.quote() when the server cannot price a trip."""
+
+
+def frame(payload):
+    return LENGTH.pack(len(payload)) + payload
+
+
+def distance_to_metres(distance):
+    """A distance in KM, as the HTTP API takes it, in whole metres, halves rounded up."""
+    if not isinstance(distance, Decimal):
+        distance = Decimal(str(distance))
+    return int((distance * 1000).to_integral_value(ROUND_HALF_UP))
+
+
+def encode_request(request_id, distance, duration, waiting_time, day_of_week):
+    try:
+        return frame(REQUEST.pack(
+            request_id, distance_to_metres(distance), int(duration), int(waiting_time), int(day_of_week)
+        ))
+    except struct.error as e:
+        raise ValueError(f'Trip out of range: {e}')
+
+
+def encode_result(request_id, version_id, exact):
+    return frame(RESPONSE_HEADER.pack(request_id, OK) + RESULT.pack(version_id, *(exact[f] for f in EXACT_FIELDS)))
+
+
+def encode_error(request_id, message):
+    return frame(RESPONSE_HEADER.pack(request_id, ERROR) + message.encode('utf-8'))
+
+
+def decode_response(payload):
+    """Return (request ID, result) of a response payload; result is a quote dict or {'error': message}."""
+    if len(payload) < RESPONSE_HEADER.size:
+        raise ProtocolError('Response frame is too short')
+    request_id, status = RESPONSE_HEADER.unpack_from(payload)
+    if status == ERROR:
+        return request_id, {'error': payload[RESPONSE_HEADER.size:].decode('utf-8', 'replace')}
+    if status != OK or len(payload) != RESPONSE_HEADER.size + RESULT.size:
+        raise ProtocolError('Malformed response frame')
+    version_id, *amounts = RESULT.unpack_from(payload, RESPONSE_HEADER.size)
+    exact = dict(zip(EXACT_FIELDS, amounts))
+    return request_id, {
+        'final_price': exact['final_price_paise'] / 100,
+        'exact': exact,
+        'tariff_version': version_id,
+    }
+
+
+class QuoteClient:
+    """
+    Blocking client of the quote socket. A client holds one connection and
+    is not thread-safe; give each thread its own.
+    """
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rb')
+        self.next_id = 0
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def quote(self, distance, duration, waiting_time=0, day_of_week=0):
+        """Price one trip, raising QuoteError when it cannot be priced."""
+        result, = self.quote_many([(distance, duration, waiting_time, day_of_week)])
+        if 'error' in result:
+            raise QuoteError(result['error'])
+        return result
+
+    def quote_many(self, trips):
+        """
+        Price (distance, duration, waiting_time, day_of_week) trips, pipelined
+        PIPELINE_WINDOW requests per round trip. Returns a result per trip, in
+        order; trips that cannot be priced get {'error': message}.
+        """
+        trips = list(trips)
+        results = []
+        # The responses to a window fit in the socket buffers, so the server
+        # never blocks writing them while the client is still sending
+        for start in range(0, len(trips), PIPELINE_WINDOW):
+            ids = []
+            requests = []
+            for trip in trips[start:start + PIPELINE_WINDOW]:
+                ids.append(self.next_id)
+                requests.append(encode_request(self.next_id, *trip))
+                self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+            self.sock.sendall(b''.join(requests))
+            for expected in ids:
+                request_id, result = decode_response(self.read_frame())
+                if request_id != expected:
+                    raise ProtocolError(f'Expected response {expected}, got {request_id}')
+                results.append(result)
+        return results
+
+    def read_frame(self):
+        header = self.file.read(LENGTH.size)
+        if len(header) < LENGTH.size:
+            raise ConnectionError('Quote socket closed the connection')
+        length, = LENGTH.unpack(header)
+        payload = self.file.read(length)
+        if len(payload) < length:
+            raise ConnectionError('Quote socket closed the connection')
+        return payload
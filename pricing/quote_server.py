@@ -0,0 +1,210 @@
+"""
+Quote socket: calculate_price for services on the same host, without HTTP.
+
+An asyncio server, started with the serve_quote_socket command, answers the
+binary frames of pricing/quote_protocol.py on a Unix domain socket. Quotes
+come from the same compiled tariff, quote cache and calculation log as the
+HTTP API, so both price a trip identically. Each read from a connection is
+answered as a whole: every complete request frame in it is priced and the
+responses are written back together, so pipelined requests cost one write
+per read. Caches are dropped when the pricing stamp moves, as in the HTTP
+workers (see pricing/stamp.py).
+"""
+import asyncio
+import logging
+import os
+import socket
+import stat
+import threading
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import quote_protocol as protocol
+from .calculation_log import log_calculation
+from .quote_cache import cached_quote
+from .signals import check_pricing_stamp
+from .tariff import aget_active, check_trip
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+# The stamp is polled rather than checked per request, at least this far apart
+MIN_STAMP_POLL = 0.1
+
+
+def answer(active, payload):
+    """Price the trip of one request payload and return the response frame."""
+    if len(payload) != protocol.REQUEST.size:
+        if len(payload) < protocol.REQUEST_ID.size:
+            raise protocol.ProtocolError('Request frame is too short')
+        request_id, = protocol.REQUEST_ID.unpack_from(payload)
+        return protocol.encode_error(request_id, 'Malformed request')
+
+    request_id, distance_m, duration, waiting_time, day_of_week = protocol.REQUEST.unpack(payload)
+    if not active:
+        return protocol.encode_error(request_id, 'No active pricing configuration found')
+    config_id, tariff = active
+    trip = (Decimal(distance_m).scaleb(-3), duration, waiting_time, day_of_week)
+    try:
+        check_trip(*trip[:3])
+        quote = cached_quote(tariff, *trip)
+        # Amounts too large for the frame fail this request only
+        response = protocol.encode_result(request_id, quote['tariff_version'], quote['exact'])
+    except Exception as e:
+        return protocol.encode_error(request_id, str(e))
+    log_calculation(config_id, tariff, *trip, quote)
+    return response
+
+
+async def answer_frames(buffer):
+    """Answer every complete frame at the start of buffer; return (responses, bytes consumed)."""
+    responses = []
+    active = None
+    offset = 0
+    while len(buffer) - offset >= protocol.LENGTH.size:
+        length, = protocol.LENGTH.unpack_from(buffer, offset)
+        if length > protocol.MAX_FRAME_SIZE:
+            raise protocol.ProtocolError(f'Frame of {length} bytes is too large')
+        end = offset + protocol.LENGTH.size + length
+        if end > len(buffer):
+            break
+        if active is None:
+            # One tariff for all the frames of a read
+            active = await aget_active() or False
+        responses.append(answer(active, bytes(buffer[offset + protocol.LENGTH.size:end])))
+        offset = end
+    return b''.join(responses), offset
+
+
+async def handle_connection(reader, writer):
+    buffer = bytearray()
+    try:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            buffer += data
+            responses, consumed = await answer_frames(buffer)
+            del buffer[:consumed]
+            if responses:
+                writer.write(responses)
+                await writer.drain()
+    except protocol.ProtocolError as e:
+        logger.warning('Closing quote socket connection: %s', e)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def _check_stamp():
+    # What request_started does for the HTTP workers
+    close_old_connections()
+    check_pricing_stamp()
+
+
+async def watch_stamp():
+    """Drop the pricing caches whenever another process changes pricing data."""
+    interval = settings.PRICING_STAMP_CHECK_INTERVAL
+    if interval is None:
+        return
+    while True:
+        await sync_to_async(_check_stamp)()
+        await asyncio.sleep(max(interval, MIN_STAMP_POLL))
+
+
+def _remove_stale_socket(path):
+    """Remove a socket left at path by a server that is gone; raise if a server still answers on it."""
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            pass
+        else:
+            raise RuntimeError(f'Another quote server is listening on {path}')
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def serve(path, ready=None):
+    """Serve quotes on a Unix socket at path until cancelled. ready, if given, is set once it accepts connections."""
+    connections = {}
+
+    async def handle(reader, writer):
+        task = asyncio.current_task()
+        connections[task] = writer
+        try:
+            await handle_connection(reader, writer)
+        finally:
+            del connections[task]
+
+    _remove_stale_socket(path)
+    server = await asyncio.start_unix_server(handle, path=path)
+    watcher = asyncio.create_task(watch_stamp())
+    try:
+        async with server:
+            if ready is not None:
+                ready.set()
+            await server.serve_forever()
+    finally:
+        watcher.cancel()
+        # Closing a connection ends its handler at the next read, after the
+        # responses already being written
+        for writer in connections.values():
+            writer.close()
+        await asyncio.gather(*connections, return_exceptions=True)
+        _remove_stale_socket(path)
+
+
+class BackgroundServer:
+    """Runs serve() on its own event loop in a daemon thread, for benchmarks and tests."""
+
+    def __init__(self, path):
+        self.path = path
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='quote-socket', daemon=True)
+        self.task = None
+        self.error = None
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(serve(self.path, self.ready))
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Handed to __enter__ when the server fails to start
+            self.error = e
+            self.ready.set()
+        finally:
+            self.loop.close()
+
+    def __enter__(self):
+        self.thread.start()
+        if not self.ready.wait(10):
+            raise RuntimeError('Quote socket did not start')
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+        return self
+
+    def __exit__(self, *exc_info):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
@@ -0,0 +1,94 @@
+"""
+Quote endpoints that need nothing but the pricing engine.
+
+These views use plain Django requests and responses, so they can be served
+by the lean quote-only profile (config.settings_quote), which loads no DRF,
+admin, sessions or templates. The full site serves calculate_price_async
+from here as well.
+"""
+import json
+from decimal import Decimal
+
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .calculation_log import log_calculation
+from .quote_cache import cached_quote
+from .stage_timing import NULL_TIMER, start_timer
+from .tariff import aget_active, check_trip, get_active
+
+
+def _parse_trip(data):
+    """Read the quote inputs of one trip from request data."""
+    distance = Decimal(data.get('distance', 0))  # Total distance in KM
+    duration = int(data.get('duration', 0))      # Total duration in minutes
+    waiting_time = int(data.get('waiting_time', 0))  # Total waiting time in minutes
+    day_of_week = int(data.get('day_of_week', 0))   # Day of week (0-6, Monday-Sunday)
+    check_trip(distance, duration, waiting_time)
+    return distance, duration, waiting_time, day_of_week
+
+
+def _quote(active, data, timer=NULL_TIMER):
+    """Price one trip from request data, returning (response body, status)."""
+    try:
+        # Get input parameters
+        with timer.stage('parse'):
+            trip = _parse_trip(data)
+
+        # Get the compiled tariff of the active pricing config
+        if not active:
+            return {'error': 'No active pricing configuration found'}, 400
+        config_id, tariff = active
+
+        quote = cached_quote(tariff, *trip, timer=timer)
+        with timer.stage('log'):
+            log_calculation(config_id, tariff, *trip, quote)
+        return quote, 200
+
+    except Exception as e:
+        return {'error': str(e)}, 400
+
+
+def _read_json(request):
+    data = json.loads(request.body or b'{}')
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    return data
+
+
+@csrf_exempt
+@require_POST
+def calculate_price(request):
+    # The quote-only counterpart of views.calculate_price: JSON bodies only
+    timer = start_timer()
+    try:
+        with timer.stage('parse'):
+            data = _read_json(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    with timer.stage('config'):
+        active = get_active()
+    body, status = _quote(active, data, timer)
+    with timer.stage('serialize'):
+        response = JsonResponse(body, status=status)
+    return timer.finish(response)
+
+
+@csrf_exempt
+@require_POST
+async def calculate_price_async(request):
+    # Native async variant for ASGI servers: once the tariff is compiled a
+    # quote never leaves the event loop
+    timer = start_timer()
+    try:
+        with timer.stage('parse'):
+            data = _read_json(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    with timer.stage('config'):
+        active = await aget_active()
+    body, status = _quote(active, data, timer)
+    with timer.stage('serialize'):
+        response = JsonResponse(body, status=status)
+    return timer.finish(response)
@@ -0,0 +1,56 @@
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import quote_cache, stamp, tariff
+from .models import (
+    PricingConfig,
+    DistanceBasePrice,
+    DistanceAdditionalPrice,
+    TimeMultiplierFactor,
+    WaitingCharge
+)
+
+# Models whose rows make up a compiled tariff. Saving or deleting any of them
+# invalidates every in-process pricing cache.
+TARIFF_MODELS = (
+    PricingConfig,
+    DistanceBasePrice,
+    DistanceAdditionalPrice,
+    TimeMultiplierFactor,
+    WaitingCharge,
+)
+
+
+def invalidate_pricing_caches():
+    tariff.invalidate()
+    quote_cache.clear()
+
+
+def pricing_data_changed(using=None):
+    """
+    Record a write to pricing data. Call it inside the writing transaction:
+    it bumps the cross-process stamp there and drops this process's caches.
+    """
+    stamp.bump(using)
+    invalidate_pricing_caches()
+    # Invalidate again once the transaction commits, so a quote compiled from
+    # the pre-commit state in another thread is not kept around.
+    transaction.on_commit(invalidate_pricing_caches, using=using)
+
+
+def tariff_changed(sender, using=None, **kwargs):
+    pricing_data_changed(using)
+
+
+def check_pricing_stamp(**kwargs):
+    # Picks up changes saved by other processes
+    checker = stamp.get_checker()
+    if checker is not None and checker.is_stale():
+        invalidate_pricing_caches()
+
+
+for model in TARIFF_MODELS:
+    post_save.connect(tariff_changed, sender=model, dispatch_uid=f'pricing_tariff_saved_{model.__name__}')
+    post_delete.connect(tariff_changed, sender=model, dispatch_uid=f'pricing_tariff_deleted_{model.__name__}')
+request_started.connect(check_pricing_stamp, dispatch_uid='pricing_check_stamp')
@@ -0,0 +1,124 @@
+"""
+Single-flight coalescing of identical concurrent work.
+
+During a surge many identical requests arrive together. A SingleFlight
+lets the first caller for a key compute the result while callers that
+arrive for the same key before it finishes wait and share it, result or
+exception, instead of repeating the work. Nothing is kept once the
+computation finishes; reuse across time is the quote cache's job.
+
+The quote path coalesces two things:
+- quote computations on a quote cache miss, keyed like the cache, for
+  requests handled by threads
+- tariff loads after an invalidation, keyed on the tariff generation, for
+  threads and, with AsyncSingleFlight, for coroutines
+
+On the event loop a quote is computed without yielding, so identical async
+requests never overlap there; the tariff load is where they wait together.
+Each group counts its calls and how many of them shared another call's
+result, shown under 'coalescing' at /pricing/api/metrics/.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        # Created by the first caller to wait, held until the result is in
+        self.done = None
+        self.result = None
+        self.error = None
+
+
+class _Counters:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+
+    def stats(self):
+        calls, shared = self.calls, self.shared
+        return {
+            'calls': calls,
+            'computed': calls - shared,
+            'shared': shared,
+            'coalescing_ratio': shared / calls if calls else 0.0,
+        }
+
+
+class SingleFlight(_Counters):
+    """Coalesces concurrent calls for the same key made from threads."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        """Return fn(*args), or the result of the call for key already in flight."""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                done = None
+            else:
+                self.shared += 1
+                if call.done is None:
+                    call.done = threading.Lock()
+                    call.done.acquire()
+                done = call.done
+
+        if done is not None:
+            # Each waiter passes the released lock on to the next
+            done.acquire()
+            done.release()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                done = call.done
+            if done is not None:
+                done.release()
+        return call.result
+
+
+class AsyncSingleFlight(_Counters):
+    """Coalesces concurrent awaits for the same key on an event loop."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._tasks = {}
+
+    async def do(self, key, fn, *args):
+        """Return await fn(*args), or the result of the call for key already in flight."""
+        self.calls += 1
+        # Tasks belong to one loop, and a process may run several
+        key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+        # A cancelled caller leaves the computation running for the others
+        return await asyncio.shield(task)
+
+
+quotes = SingleFlight('quotes')
+tariff_loads = SingleFlight('tariff_loads')
+async_tariff_loads = AsyncSingleFlight('async_tariff_loads')
+
+
+def stats():
+    return {group.name: group.stats() for group in (quotes, tariff_loads, async_tariff_loads)}
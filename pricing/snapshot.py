@@ -0,0 +1,248 @@
+"""
+Binary snapshots of the active tariff, shared by every worker on a host.
+
+The snapshot_tariff command compiles the active PricingConfig into a small
+binary file at PRICING_TARIFF_SNAPSHOT_PATH, writing a temporary file and
+renaming it over the old one so readers never see a partial file. When the
+setting is set, get_active() serves the tariff from this file instead of the
+database: each worker memory-maps the file, so all workers read the same
+pages from the page cache, and decodes it once per version. The file is
+re-checked at most every PRICING_TARIFF_SNAPSHOT_CHECK_INTERVAL seconds and
+reloaded when its version stamp changes. A worker keeps serving its last
+good snapshot when the file is missing or damaged, and quotes keep working
+while the database is unavailable.
+
+Layout, little-endian, fixed point as in CompiledTariff (metres, paise,
+hundredths):
+
+    header      magic, format, flags, stamp, config ID, version ID,
+                content hash, threshold count
+    7 days      has base price, base distance, base price
+    rates       price per KM, initial wait time, charge per interval,
+                interval minutes
+    thresholds  time threshold, multiplier, for each threshold
+    trailer     CRC32 of everything before it
+"""
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.core.signals import setting_changed
+
+from . import tariff
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PRTARIFF'
+FORMAT_VERSION = 1
+
+HAS_CONFIG = 1
+HAS_PRICE_PER_KM = 2
+HAS_WAITING = 4
+
+_HEADER = struct.Struct('<8sHHqqq32sI')
+_DAY = struct.Struct('<?qq')
+_RATES = struct.Struct('<qqqq')
+_THRESHOLD = struct.Struct('<qq')
+_TRAILER = struct.Struct('<I')
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file cannot be read."""
+
+
+def encode(active, stamp=None):
+    """Encode (config_id, CompiledTariff), or None for no active config, as snapshot bytes."""
+    stamp = time.time_ns() if stamp is None else stamp
+    if active is None:
+        body = _HEADER.pack(MAGIC, FORMAT_VERSION, 0, stamp, 0, 0, bytes(32), 0)
+        body += b''.join(_DAY.pack(False, 0, 0) for _ in range(7)) + _RATES.pack(0, 0, 0, 0)
+        return body + _TRAILER.pack(zlib.crc32(body))
+
+    config_id, compiled = active
+    flags = HAS_CONFIG
+    if compiled.price_per_km is not None:
+        flags |= HAS_PRICE_PER_KM
+    if compiled.fixed_waiting:
+        flags |= HAS_WAITING
+    parts = [_HEADER.pack(
+        MAGIC, FORMAT_VERSION, flags, stamp, config_id, compiled.version_id,
+        bytes.fromhex(compiled.content_hash), len(compiled.thresholds)
+    )]
+    for entry in compiled.fixed_day_table:
+        parts.append(_DAY.pack(True, *entry) if entry is not None else _DAY.pack(False, 0, 0))
+    parts.append(_RATES.pack(compiled.price_per_km_paise, *(compiled.fixed_waiting or (0, 0, 0))))
+    for threshold, multiplier in zip(compiled.thresholds, compiled.fixed_multipliers):
+        parts.append(_THRESHOLD.pack(threshold, multiplier))
+    body = b''.join(parts)
+    return body + _TRAILER.pack(zlib.crc32(body))
+
+
+def decode(buffer):
+    """Return (stamp, active) from snapshot bytes; active is None when no config was active."""
+    if len(buffer) < _HEADER.size + _TRAILER.size:
+        raise SnapshotError('Snapshot is truncated')
+    magic, fmt, flags, stamp, config_id, version_id, digest, count = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotError('Not a tariff snapshot')
+    if fmt != FORMAT_VERSION:
+        raise SnapshotError(f'Unsupported snapshot format {fmt}')
+    size = _HEADER.size + 7 * _DAY.size + _RATES.size + count * _THRESHOLD.size
+    if len(buffer) != size + _TRAILER.size:
+        raise SnapshotError('Snapshot is truncated')
+    crc, = _TRAILER.unpack_from(buffer, size)
+    if crc != zlib.crc32(buffer[:size]):
+        raise SnapshotError('Snapshot checksum mismatch')
+    if not flags & HAS_CONFIG:
+        return stamp, None
+
+    offset = _HEADER.size
+    day_table = []
+    for _ in range(7):
+        valid, base_distance_m, base_price_paise = _DAY.unpack_from(buffer, offset)
+        offset += _DAY.size
+        day_table.append(
+            (Decimal(base_distance_m).scaleb(-3), Decimal(base_price_paise).scaleb(-2)) if valid else None
+        )
+    price_per_km_paise, initial_wait_time, charge_paise, interval_minutes = _RATES.unpack_from(buffer, offset)
+    offset += _RATES.size
+    thresholds = []
+    multipliers = []
+    for _ in range(count):
+        threshold, multiplier = _THRESHOLD.unpack_from(buffer, offset)
+        offset += _THRESHOLD.size
+        thresholds.append(threshold)
+        multipliers.append(Decimal(multiplier).scaleb(-2))
+
+    compiled = tariff.CompiledTariff(
+        version_id=version_id,
+        content_hash=digest.hex(),
+        day_table=tuple(day_table),
+        thresholds=tuple(thresholds),
+        multipliers=tuple(multipliers),
+        price_per_km=Decimal(price_per_km_paise).scaleb(-2) if flags & HAS_PRICE_PER_KM else None,
+        waiting=(
+            (initial_wait_time, Decimal(charge_paise).scaleb(-2), interval_minutes)
+            if flags & HAS_WAITING else None
+        ),
+    )
+    return stamp, (config_id, compiled)
+
+
+def write(path, active):
+    """Write a snapshot atomically: to a temporary file in the same directory, then renamed over path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.tariff-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encode(active))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read(path):
+    """Memory-map a snapshot file and decode it, returning (stamp, active)."""
+    with open(path, 'rb') as f:
+        # An empty file cannot be mapped
+        if not os.fstat(f.fileno()).st_size:
+            raise SnapshotError('Snapshot is empty')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return decode(mapped)
+
+
+# Returned while no snapshot has been loaded, so the database is used instead
+NOT_LOADED = object()
+
+
+class SnapshotReader:
+    """Serves the active tariff of one snapshot file, reloading it when it is replaced."""
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self._active = NOT_LOADED
+        self._stamp = None
+        self._file = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return (config_id, CompiledTariff), or None when the snapshot has no
+        active config. Returns NOT_LOADED until a snapshot has been loaded.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return self._active
+        with self._lock:
+            if now >= self._next_check:
+                self._next_check = now + self.check_interval
+                self._check()
+        return self._active
+
+    def _check(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            if self._active is NOT_LOADED:
+                logger.warning('Tariff snapshot %s is not readable: %s', self.path, e)
+            return
+        # A rename gives the path a new inode, so unchanged files are not reopened
+        file = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file == self._file:
+            return
+        try:
+            stamp, active = read(self.path)
+        except (OSError, SnapshotError) as e:
+            logger.warning('Keeping the previous tariff, snapshot %s could not be read: %s', self.path, e)
+            return
+        self._file = file
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._active = active
+
+
+_UNSET = object()
+_reader = _UNSET
+_reader_lock = threading.Lock()
+
+
+def get_reader():
+    """The SnapshotReader of PRICING_TARIFF_SNAPSHOT_PATH, or None when snapshots are not used."""
+    global _reader
+    reader = _reader
+    if reader is _UNSET:
+        with _reader_lock:
+            if _reader is _UNSET:
+                path = settings.PRICING_TARIFF_SNAPSHOT_PATH
+                _reader = SnapshotReader(str(path), settings.PRICING_TARIFF_SNAPSHOT_CHECK_INTERVAL) if path else None
+            reader = _reader
+    return reader
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    # Settings are read once per process, on the hot path; tests change them
+    global _reader
+    if setting.startswith('PRICING_TARIFF_SNAPSHOT'):
+        with _reader_lock:
+            _reader = _UNSET
+
+
+def get_active():
+    """The snapshot's (config_id, CompiledTariff) or None, or NOT_LOADED when there is no snapshot to serve."""
+    reader = get_reader()
+    return reader.get() if reader is not None else NOT_LOADED
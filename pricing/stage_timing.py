@@ -0,0 +1,160 @@
+"""
+Opt-in timing of the stages of a quote request.
+
+With PRICING_STAGE_TIMING enabled every quote request gets a StageTimer. The
+timer measures the config lookup, input parsing, quote cache lookup,
+base-price resolution, multiplier scan, waiting-charge math, logging and
+serialization. Each quote response then carries a Server-Timing header with
+those durations, and the durations are added to per-stage histograms kept in
+the process and shown by the metrics endpoint. When the setting is off the
+views get NULL_TIMER, whose stages are a shared do-nothing context manager.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Histogram bucket upper bounds in milliseconds; anything slower lands in +Inf
+BUCKETS_MS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullTimer:
+    """Stands in for StageTimer when stage timing is off."""
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def finish(self, response):
+        return response
+
+    def finish_on_render(self, response):
+        return response
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer:
+    enabled = True
+
+    def __init__(self, histograms):
+        self.histograms = histograms
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def header(self):
+        return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.stages.items())
+
+    def finish(self, response):
+        """Record the request's stages and attach them as a Server-Timing header."""
+        self.stages['total'] = time.perf_counter() - self.started
+        self.histograms.record(self.stages)
+        response['Server-Timing'] = self.header()
+        return response
+
+    def finish_on_render(self, response):
+        """
+        Like finish, for DRF and template responses that are only rendered
+        after the view returns; the rendering is timed as 'serialize'.
+        """
+        rendering_from = time.perf_counter()
+
+        def rendered(response):
+            self.stages['serialize'] = time.perf_counter() - rendering_from
+            self.finish(response)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class StageHistograms:
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stages):
+        with self._lock:
+            for name, seconds in stages.items():
+                histogram = self._stages.get(name)
+                if histogram is None:
+                    histogram = self._stages[name] = {
+                        'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(self.buckets) + 1)
+                    }
+                ms = seconds * 1000
+                histogram['count'] += 1
+                histogram['sum'] += ms
+                histogram['max'] = max(histogram['max'], ms)
+                histogram['buckets'][bisect_left(self.buckets, ms)] += 1
+
+    def _percentile(self, histogram, fraction):
+        # Upper bound of the bucket holding the requested rank
+        rank = fraction * histogram['count']
+        seen = 0
+        for bound, count in zip(self.buckets, histogram['buckets']):
+            seen += count
+            if seen >= rank:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'count': histogram['count'],
+                    'mean_ms': histogram['sum'] / histogram['count'],
+                    'max_ms': histogram['max'],
+                    'p50_ms': self._percentile(histogram, 0.50),
+                    'p99_ms': self._percentile(histogram, 0.99),
+                    'buckets_ms': dict(zip(
+                        [str(bound) for bound in self.buckets] + ['+Inf'], histogram['buckets']
+                    )),
+                }
+                for name, histogram in self._stages.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+_histograms = StageHistograms()
+
+
+def get_histograms():
+    return _histograms
+
+
+def is_enabled():
+    return getattr(settings, 'PRICING_STAGE_TIMING', False)
+
+
+def start_timer():
+    """Return a StageTimer for this request, or NULL_TIMER when stage timing is off."""
+    if is_enabled():
+        return StageTimer(_histograms)
+    return NULL_TIMER
@@ -0,0 +1,106 @@
+"""
+Cross-process invalidation of the in-process pricing caches.
+
+Compiled tariffs and quotes are cached in each process. A change saved in one
+process drops that process's caches (see pricing/signals.py) and bumps the
+PricingStamp counter in the same transaction. When a request starts, every
+process compares the counter with the value its caches were built at, at most
+once every PRICING_STAMP_CHECK_INTERVAL seconds, and drops its caches when it
+has moved. A committed change therefore reaches every worker within that
+interval, at the cost of one primary key lookup per interval per process.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import PricingStamp
+
+logger = logging.getLogger(__name__)
+
+
+def _bumped():
+    """on_commit marker of a transaction that has already bumped the stamp."""
+
+
+def bump(using=None):
+    """Advance the stamp in the current transaction, once per transaction."""
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block:
+        # A transaction needs one bump however many rows it changes. The
+        # marker is discarded with a rolled back transaction or savepoint,
+        # together with the bump it stands for.
+        if any(hook[1] is _bumped for hook in connection.run_on_commit):
+            return
+        transaction.on_commit(_bumped, using=using)
+    stamps = PricingStamp.objects.using(using).filter(pk=PricingStamp.SINGLETON_ID)
+    if not stamps.update(version=F('version') + 1, updated_at=timezone.now()):
+        PricingStamp.objects.using(using).get_or_create(pk=PricingStamp.SINGLETON_ID, defaults={'version': 1})
+
+
+def current():
+    """The stamp's version as stored in the database."""
+    version = PricingStamp.objects.filter(pk=PricingStamp.SINGLETON_ID).values_list('version', flat=True).first()
+    return version or 0
+
+
+class StampChecker:
+    """Tells one process when the stamp has moved since its last check."""
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._seen = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        """True when the stamp moved since the previous check, checking at most once per interval."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        with self._lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.check_interval
+            try:
+                version = current()
+            except DatabaseError as e:
+                logger.warning('Could not read the pricing stamp: %s', e)
+                return False
+            # The first check also counts as a change: caches may have been
+            # filled before it
+            stale = version != self._seen
+            self._seen = version
+        return stale
+
+
+_UNSET = object()
+_checker = _UNSET
+_checker_lock = threading.Lock()
+
+
+def get_checker():
+    """The process's StampChecker, or None when PRICING_STAMP_CHECK_INTERVAL is None."""
+    global _checker
+    checker = _checker
+    if checker is _UNSET:
+        with _checker_lock:
+            if _checker is _UNSET:
+                interval = settings.PRICING_STAMP_CHECK_INTERVAL
+                _checker = StampChecker(interval) if interval is not None else None
+            checker = _checker
+    return checker
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    global _checker
+    if setting == 'PRICING_STAMP_CHECK_INTERVAL':
+        with _checker_lock:
+            _checker = _UNSET
@@ -0,0 +1,483 @@
+"""
+Versioned, compiled tariffs for the quote path.
+
+The pricing components of a PricingConfig are snapshotted into an immutable,
+content-hashed PricingConfigVersion whenever they are saved. A CompiledTariff
+is a version laid out so that pricing a trip needs no database access.
+Compiled tariffs are cached by version ID for the life of the process, since
+a version never changes; only the pointers from configs to their versions,
+for the active config and for configs priced by ID, are dropped when a
+pricing model is saved or deleted (see pricing/signals.py).
+
+Quotes are computed in integers. Distances are rounded to whole metres,
+halves up; prices are held in paise and multipliers in hundredths. The
+additional distance price is exact in thousandths of a paisa, and the base
+fare times the multiplier is rounded to the nearest paisa, halves up. The
+waiting charge is a whole number of paise, and the final price is the
+rounded time adjusted fare plus the waiting charge. Amounts reported on
+their own, such as the additional distance price and base fare, are
+rounded to the paisa the same way.
+"""
+import hashlib
+import json
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from decimal import Decimal, ROUND_HALF_UP
+
+from asgiref.sync import sync_to_async
+
+from . import single_flight, snapshot
+from .models import PricingConfig, PricingConfigVersion
+from .stage_timing import NULL_TIMER
+
+
+# Longest trip a quote accepts. Larger distances are input errors, and a huge
+# exponent would make the fixed-point conversion below very slow.
+MAX_DISTANCE_KM = 10000
+
+# Longest duration or waiting time a quote accepts, in minutes (about two years)
+MAX_MINUTES = 10 ** 6
+
+
+def check_trip(distance, duration, waiting_time):
+    """Raise ValueError for a trip outside the bounds every quote path accepts."""
+    if not distance.is_finite() or not 0 <= distance <= MAX_DISTANCE_KM:
+        raise ValueError(f'Distance must be between 0 and {MAX_DISTANCE_KM} km')
+    if not (0 <= duration <= MAX_MINUTES and 0 <= waiting_time <= MAX_MINUTES):
+        raise ValueError(f'Duration and waiting time must be between 0 and {MAX_MINUTES} minutes')
+
+
+class TariffError(Exception):
+    """Raised when a trip cannot be priced under a tariff."""
+
+
+def to_fixed(value, places):
+    """Scale a Decimal to an integer number of 10**-places units, halves rounded up."""
+    return int(Decimal(value).scaleb(places).to_integral_value(ROUND_HALF_UP))
+
+
+def _round_div(value, divisor):
+    """Divide non-negative integers, rounding halves up."""
+    return (value + divisor // 2) // divisor
+
+
+@dataclass(frozen=True)
+class CompiledTariff:
+    version_id: int
+    content_hash: str
+    # One slot per weekday (0-6, Monday-Sunday): (base_distance, base_price) or None
+    day_table: tuple
+    # Time thresholds in minutes, ascending, and the multiplier for each one
+    thresholds: tuple
+    multipliers: tuple
+    # Price per additional KM, or None when no additional price is configured
+    price_per_km: Decimal = None
+    # (initial_wait_time, charge_per_interval, interval_minutes) or None
+    waiting: tuple = None
+
+    # The same tables in fixed point: metres, paise and hundredths
+    fixed_day_table: tuple = field(init=False, repr=False, compare=False)
+    fixed_multipliers: tuple = field(init=False, repr=False, compare=False)
+    price_per_km_paise: int = field(init=False, repr=False, compare=False)
+    fixed_waiting: tuple = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        fixed = {
+            'fixed_day_table': tuple(
+                (to_fixed(entry[0], 3), to_fixed(entry[1], 2)) if entry is not None else None
+                for entry in self.day_table
+            ),
+            'fixed_multipliers': tuple(to_fixed(multiplier, 2) for multiplier in self.multipliers),
+            'price_per_km_paise': to_fixed(self.price_per_km, 2) if self.price_per_km is not None else 0,
+            'fixed_waiting': (
+                (self.waiting[0], to_fixed(self.waiting[1], 2), self.waiting[2]) if self.waiting else None
+            ),
+        }
+        for name, value in fixed.items():
+            object.__setattr__(self, name, value)
+
+    def base_price_for_day(self, day_of_week):
+        if 0 <= day_of_week < len(self.day_table):
+            return self.day_table[day_of_week]
+        return None
+
+    def time_multiplier(self, duration):
+        index = bisect_right(self.thresholds, duration) - 1
+        if index < 0:
+            return Decimal('1.0')
+        return self.multipliers[index]
+
+    def quote(self, distance, duration, waiting_time, day_of_week, timer=NULL_TIMER):
+        """
+        Price one trip, returning the calculate_price response body. A
+        StageTimer passed as timer records how long each step took.
+
+        The arithmetic is done in integers (see the module docstring for the
+        rounding rules). exact holds every amount as an integer, in paise,
+        metres or hundredths; the float fields are kept for existing clients.
+        """
+        with timer.stage('base'):
+            # 1. Distance Base Price (DBP)
+            if not 0 <= day_of_week < len(self.fixed_day_table) or self.fixed_day_table[day_of_week] is None:
+                raise TariffError(f'No base price configuration found for day {day_of_week}')
+            base_distance_m, dbp = self.fixed_day_table[day_of_week]
+
+            # 2. Additional Distance Price (Dn * DAP), in thousandths of a paisa
+            additional_distance_m = max(to_fixed(distance, 3) - base_distance_m, 0)
+            additional_price_mp = additional_distance_m * self.price_per_km_paise
+            base_fare_mp = dbp * 1000 + additional_price_mp
+
+        with timer.stage('multiplier'):
+            # 3. Time Multiplier Factor (TMF), in hundredths
+            index = bisect_right(self.thresholds, duration) - 1
+            time_multiplier = self.fixed_multipliers[index] if index >= 0 else 100
+            time_adjusted_fare = _round_div(base_fare_mp * time_multiplier, 100000)
+
+        with timer.stage('waiting'):
+            # 4. Waiting Charges (WC), whole intervals rounding up
+            waiting_charge = 0
+            chargeable_waiting_time = 0
+            intervals = 0
+            initial_wait_time, charge_per_interval, interval_minutes = self.fixed_waiting or (0, 0, 0)
+            if self.fixed_waiting and waiting_time > initial_wait_time:
+                chargeable_waiting_time = waiting_time - initial_wait_time
+                intervals = (chargeable_waiting_time + interval_minutes - 1) // interval_minutes
+                waiting_charge = intervals * charge_per_interval
+
+        # Final price: (DBP + (Dn * DAP)) * TMF + WC
+        final_price = time_adjusted_fare + waiting_charge
+        additional_price = _round_div(additional_price_mp, 1000)
+        base_fare = _round_div(base_fare_mp, 1000)
+
+        return {
+            'breakdown': {
+                'distance_base_price': dbp / 100,
+                'additional_distance': additional_distance_m / 1000,
+                'additional_distance_price': additional_price / 100,
+                'time_multiplier': time_multiplier / 100,
+                'waiting_charge': waiting_charge / 100,
+                'waiting_time_details': {
+                    'total_waiting_time': waiting_time,
+                    'initial_free_time': initial_wait_time,
+                    'chargeable_time': chargeable_waiting_time,
+                    'charge_per_interval': charge_per_interval / 100,
+                    'interval_minutes': interval_minutes,
+                    'intervals_charged': intervals,
+                }
+            },
+            'base_fare': base_fare / 100,
+            'time_adjusted_fare': time_adjusted_fare / 100,
+            'final_price': final_price / 100,
+            'exact': {
+                'distance_base_price_paise': dbp,
+                'additional_distance_m': additional_distance_m,
+                'additional_distance_price_paise': additional_price,
+                'base_fare_paise': base_fare,
+                'time_multiplier_c': time_multiplier,
+                'time_adjusted_fare_paise': time_adjusted_fare,
+                'waiting_charge_paise': waiting_charge,
+                'final_price_paise': final_price,
+            },
+            'tariff_version': self.version_id
+        }
+
+
+def _amount(value):
+    return str(Decimal(value).quantize(Decimal('0.01')))
+
+
+def build_payload(config):
+    """Serialise the pricing components of a config into a version payload."""
+    # Rows are kept in primary key order so that the first matching row wins,
+    # exactly like the .first() lookups calculate_price used to run.
+    return payload_from_rows(
+        config.distance_base_prices.order_by('pk'),
+        config.distance_additional_prices.order_by('pk'),
+        config.time_multipliers.order_by('pk'),
+        config.waiting_charges.order_by('pk'),
+    )
+
+
+def payload_from_rows(base_prices, additional_prices, time_multipliers, waiting_charges):
+    """Version payload of component rows given in primary key order."""
+    return {
+        'base_prices': [
+            [base_price.days_mask, _amount(base_price.base_distance), _amount(base_price.base_price)]
+            for base_price in base_prices
+        ],
+        'additional_prices': [
+            _amount(additional_price.price_per_km)
+            for additional_price in additional_prices
+        ],
+        'time_multipliers': [
+            [factor.time_threshold, _amount(factor.multiplier)]
+            for factor in time_multipliers
+        ],
+        'waiting_charges': [
+            [charge.initial_wait_time, _amount(charge.charge_per_interval), charge.interval_minutes]
+            for charge in waiting_charges
+        ],
+    }
+
+
+def content_hash(payload):
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def snapshot_config(config, payload=None):
+    """
+    Record the current pricing components of a config as a version.
+
+    Returns the (possibly pre-existing) PricingConfigVersion and points
+    config.current_version at it. payload, if given, is the config's payload
+    as already built from rows in memory, and the rows are not queried.
+    """
+    if payload is None:
+        payload = build_payload(config)
+    digest = content_hash(payload)
+    version = config.current_version
+    if version is not None and version.content_hash == digest:
+        return version
+
+    version, _ = PricingConfigVersion.objects.get_or_create(
+        content_hash=digest,
+        defaults={'payload': payload}
+    )
+    if config.current_version_id != version.pk:
+        # A plain UPDATE: moving the pointer is not a tariff change of its own
+        PricingConfig.objects.filter(pk=config.pk).update(current_version=version)
+        config.current_version = version
+    return version
+
+
+def snapshot_configs(configs, payloads):
+    """
+    Bulk counterpart of snapshot_config for configs whose payloads are
+    already known: finds or creates every version in a few queries and
+    points each config at its version.
+    """
+    digests = [content_hash(payload) for payload in payloads]
+    versions = PricingConfigVersion.objects.in_bulk(set(digests), field_name='content_hash')
+    missing = {}
+    for digest, payload in zip(digests, payloads):
+        if digest not in versions:
+            missing.setdefault(digest, payload)
+    if missing:
+        # Another import may create the same versions concurrently
+        PricingConfigVersion.objects.bulk_create(
+            [PricingConfigVersion(content_hash=digest, payload=payload) for digest, payload in missing.items()],
+            ignore_conflicts=True
+        )
+        versions.update(PricingConfigVersion.objects.in_bulk(list(missing), field_name='content_hash'))
+
+    for config, digest in zip(configs, digests):
+        config.current_version = versions[digest]
+    PricingConfig.objects.bulk_update(configs, ['current_version'], batch_size=1000)
+    return [config.current_version for config in configs]
+
+
+def compile_version(version):
+    """Build a CompiledTariff from a PricingConfigVersion."""
+    payload = version.payload
+
+    day_table = [None] * 7
+    for days_mask, base_distance, base_price in payload['base_prices']:
+        for day in range(7):
+            if days_mask & (1 << day) and day_table[day] is None:
+                day_table[day] = (Decimal(base_distance), Decimal(base_price))
+
+    multipliers = {}
+    for time_threshold, multiplier in payload['time_multipliers']:
+        multipliers.setdefault(time_threshold, Decimal(multiplier))
+    thresholds = tuple(sorted(multipliers))
+
+    additional_prices = payload['additional_prices']
+    waiting_charges = payload['waiting_charges']
+    if waiting_charges:
+        initial_wait_time, charge_per_interval, interval_minutes = waiting_charges[0]
+        waiting = (initial_wait_time, Decimal(charge_per_interval), interval_minutes)
+    else:
+        waiting = None
+
+    return CompiledTariff(
+        version_id=version.pk,
+        content_hash=version.content_hash,
+        day_table=tuple(day_table),
+        thresholds=thresholds,
+        multipliers=tuple(multipliers[threshold] for threshold in thresholds),
+        price_per_km=Decimal(additional_prices[0]) if additional_prices else None,
+        waiting=waiting,
+    )
+
+
+_MISSING = object()
+_lock = threading.Lock()
+_active = _MISSING
+_generation = 0
+# Compiled tariffs by (version ID, content hash). Versions are immutable, and
+# the hash keeps an ID reused after a rolled back insert from matching.
+_versions = {}
+# ConfigTariffs by config ID, and the IDs of every config once listed. Both
+# are dropped with the active tariff.
+_configs = {}
+_config_ids = None
+
+
+def get_version_tariff(version):
+    """Return the CompiledTariff of a PricingConfigVersion, compiling it at most once."""
+    key = (version.pk, version.content_hash)
+    tariff = _versions.get(key)
+    if tariff is None:
+        tariff = compile_version(version)
+        with _lock:
+            tariff = _versions.setdefault(key, tariff)
+    return tariff
+
+
+def compile_tariff(config):
+    """Snapshot a config if needed and return its CompiledTariff."""
+    return get_version_tariff(snapshot_config(config))
+
+
+def load_active():
+    """Compile the active config from the database: (config_id, CompiledTariff), or None."""
+    config = PricingConfig.objects.filter(is_active=True).select_related('current_version').first()
+    return (config.pk, compile_tariff(config)) if config else None
+
+
+def get_active():
+    """
+    Return (config_id, CompiledTariff) for the active config, or None if there
+    is none. Served from the tariff snapshot file when one is configured and
+    readable (see pricing/snapshot.py), otherwise from the database.
+    """
+    global _active
+    active = snapshot.get_active()
+    if active is not snapshot.NOT_LOADED:
+        return active
+    active = _active
+    if active is not _MISSING:
+        return active
+
+    with _lock:
+        if _active is not _MISSING:
+            return _active
+        generation = _generation
+
+    # Threads that miss together wait for one load
+    return single_flight.tariff_loads.do(generation, _load_and_publish, generation)
+
+
+def _load_and_publish(generation):
+    global _active
+    active = load_active()
+
+    with _lock:
+        # Only publish the result if nothing changed while we were compiling,
+        # otherwise the next caller compiles again from fresh data.
+        if generation == _generation:
+            _active = active
+    return active
+
+
+async def aget_active():
+    """Async get_active(): returns the cached tariff without leaving the event loop."""
+    active = snapshot.get_active()
+    if active is not snapshot.NOT_LOADED:
+        return active
+    active = _active
+    if active is not _MISSING:
+        return active
+    # Compiling may snapshot the config, which writes; that rare cold path
+    # runs the sync code in a worker thread, once for all coroutines waiting
+    return await single_flight.async_tariff_loads.do(_generation, sync_to_async(get_active))
+
+
+def get_active_tariff():
+    """Return the CompiledTariff of the active config, or None if there is none."""
+    active = get_active()
+    return active[1] if active else None
+
+
+def invalidate():
+    """Drop the active tariff and the per-config tariffs; the next quote resolves them again."""
+    global _active, _generation, _configs, _config_ids
+    with _lock:
+        _generation += 1
+        _active = _MISSING
+        _configs = {}
+        _config_ids = None
+
+
+@dataclass(frozen=True)
+class ConfigTariff:
+    config_id: int
+    name: str
+    is_active: bool
+    tariff: CompiledTariff
+
+
+def _load_config_tariffs(config_ids):
+    configs = list(PricingConfig.objects.with_components().filter(pk__in=config_ids))
+    stale = []
+    payloads = []
+    for config in configs:
+        payload = payload_from_rows(
+            config.distance_base_prices.all(),
+            config.distance_additional_prices.all(),
+            config.time_multipliers.all(),
+            config.waiting_charges.all(),
+        )
+        version = config.current_version
+        if version is None or version.content_hash != content_hash(payload):
+            stale.append(config)
+            payloads.append(payload)
+    if stale:
+        snapshot_configs(stale, payloads)
+    return {
+        config.pk: ConfigTariff(config.pk, config.name, config.is_active, get_version_tariff(config.current_version))
+        for config in configs
+    }
+
+
+def get_config_tariffs(config_ids=None):
+    """
+    Return the ConfigTariffs of the given config IDs in the order given, or of
+    every config in primary key order. IDs without a config are left out.
+    Every config is compiled at most once until a pricing model changes, and
+    a batch of configs is loaded in a fixed number of queries.
+    """
+    global _configs, _config_ids
+    with _lock:
+        generation = _generation
+        configs = _configs
+        all_ids = _config_ids
+
+    listed = None
+    if config_ids is None:
+        if all_ids is None:
+            all_ids = listed = list(PricingConfig.objects.order_by('pk').values_list('pk', flat=True))
+        config_ids = all_ids
+
+    missing = [config_id for config_id in dict.fromkeys(config_ids) if config_id not in configs]
+    if missing:
+        configs = {**configs, **_load_config_tariffs(missing)}
+    if missing or listed is not None:
+        with _lock:
+            # As in get_active(), results compiled from data that changed
+            # meanwhile are returned but not kept
+            if generation == _generation:
+                _configs = {**_configs, **configs}
+                if listed is not None:
+                    _config_ids = listed
+    return [configs[config_id] for config_id in config_ids if config_id in configs]
+
+
+def tariff_for_config(config_id):
+    """Return the CompiledTariff of a specific PricingConfig, active or not."""
+    found = get_config_tariffs([config_id])
+    if not found:
+        raise PricingConfig.DoesNotExist(f'PricingConfig {config_id} does not exist')
+    return found[0].tariff
@@ -0,0 +1,271 @@
+"""
+Query budget regression tests.
+
+Every route in pricing/urls.py and every pricing changelist in the admin is
+requested twice: once against a small config (or a near-empty table) and once
+against a large config with many base prices, multipliers and hundreds of log
+rows. Both requests must stay within the view's budget and run the same
+number of queries, so a change that makes a view issue a query per row fails
+here instead of slowing down in production. Requests are measured warm, after
+one untimed request has compiled tariffs and filled caches.
+
+Budgets are those of the query profiling middleware, keyed by URL name in
+PRICING_QUERY_PROFILING['BUDGETS'], so production warnings and these tests
+hold views to the same numbers.
+
+Run with: python manage.py test pricing.test_query_budgets
+"""
+import json
+import random
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+
+from .benchmarks import edit_post_data, seed_config
+from .middleware import get_options
+from .models import PricingConfig, PriceCalculationLog
+from .tariff import invalidate
+from .transfer import export_configs
+
+LARGE_SIZE = 50
+LARGE_LOGS = 300
+
+
+# The stamp check runs on whichever request falls due, outside any budget
+@override_settings(PRICING_CALCULATION_LOG={'ENABLED': False}, PRICING_STAMP_CHECK_INTERVAL=None)
+class QueryBudgetTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'adminpass123')
+        self.client.force_login(self.user)
+        self.rng = random.Random(0)
+        self.small = seed_config('Small', 2, logs=3, user=self.user, is_active=False)
+        self.large = seed_config('Large', LARGE_SIZE, logs=LARGE_LOGS, user=self.user)
+
+    def grow(self):
+        """Add many more configs, change logs and calculation logs."""
+        for i in range(20):
+            seed_config(f'Extra {i}', 5, logs=20, user=self.user, is_active=False)
+        self.add_calculation_logs(LARGE_LOGS)
+
+    def add_calculation_logs(self, count):
+        PriceCalculationLog.objects.bulk_create([
+            PriceCalculationLog(
+                pricing_config=self.large,
+                version=self.large.current_version,
+                distance=Decimal('5.000'),
+                duration=30,
+                waiting_time=2,
+                day_of_week=i % 7,
+                final_price=Decimal('140.00'),
+                breakdown={},
+            )
+            for i in range(count)
+        ])
+
+    def trip(self):
+        return {
+            'distance': round(self.rng.uniform(0.5, 30), 2),
+            'duration': self.rng.randint(5, 180),
+            'waiting_time': self.rng.randint(0, 20),
+            'day_of_week': self.rng.randint(0, 6),
+        }
+
+    def count_queries(self, request, warm=True):
+        if warm:
+            request()
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            self.fail(f'Request failed with status {response.status_code}')
+        return len(queries)
+
+    def assertQueriesWithinBudget(self, name, small, large):
+        budget = get_options()['BUDGETS'][name]
+        self.assertLessEqual(large, budget, f'{name} ran {large} queries, over its budget of {budget}')
+        self.assertEqual(
+            small, large,
+            f'{name} ran {small} queries on a small config but {large} on a large one'
+        )
+
+    def assertConfigViewScales(self, name, request_for, warm=True):
+        """Compare a view requested for the small and for the large config."""
+        small = self.count_queries(request_for(self.small), warm)
+        large = self.count_queries(request_for(self.large), warm)
+        self.assertQueriesWithinBudget(name, small, large)
+
+    def assertTableViewScales(self, name, request):
+        """Compare a view requested before and after the tables grow."""
+        small = self.count_queries(request)
+        self.grow()
+        large = self.count_queries(request)
+        self.assertQueriesWithinBudget(name, small, large)
+
+
+class ConfigPageQueryBudgetTest(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertTableViewScales(
+            'pricing_config_list', lambda: self.client.get(reverse('pricing_config_list'))
+        )
+
+    def test_create_form(self):
+        self.assertTableViewScales(
+            'pricing_config_create', lambda: self.client.get(reverse('pricing_config_create'))
+        )
+
+    def test_detail(self):
+        self.assertConfigViewScales(
+            'pricing_config_detail',
+            lambda config: lambda: self.client.get(reverse('pricing_config_detail', args=[config.pk]))
+        )
+
+    def test_change_history(self):
+        def request_for(config):
+            # The second page of the history, reached through its cursor
+            url = reverse('pricing_config_logs', args=[config.pk])
+            cursor = self.client.get(url).context['next_cursor']
+            return lambda: self.client.get(url, {'after': cursor} if cursor else {})
+
+        self.assertConfigViewScales('pricing_config_logs', request_for)
+
+    def test_edit_form(self):
+        self.assertConfigViewScales(
+            'pricing_config_edit',
+            lambda config: lambda: self.client.get(reverse('pricing_config_edit', args=[config.pk]))
+        )
+
+    def test_edit_submission(self):
+        def request_for(config):
+            data = edit_post_data(config)
+            field = 'distance_base_prices-0-base_price'
+
+            def submit():
+                # Alternate a base price so every submission changes the config
+                data[field] = '81.00' if data[field] != '81.00' else '80.00'
+                return self.client.post(reverse('pricing_config_edit', args=[config.pk]), data)
+            return submit
+
+        self.assertConfigViewScales('pricing_config_edit', request_for)
+
+    def test_delete_confirmation(self):
+        self.assertConfigViewScales(
+            'pricing_config_delete',
+            lambda config: lambda: self.client.get(reverse('pricing_config_delete', args=[config.pk]))
+        )
+
+    def test_price_calculator(self):
+        self.assertTableViewScales(
+            'price_calculator', lambda: self.client.get(reverse('price_calculator'))
+        )
+
+
+class QueryBudgetTableTest(SimpleTestCase):
+    def test_every_route_has_a_budget(self):
+        """Test that every pricing route has an entry in the budget table"""
+        names = {pattern.name for pattern in get_resolver('pricing.urls').url_patterns}
+        self.assertLessEqual(names, set(get_options()['BUDGETS']))
+
+
+class QuoteQueryBudgetTest(QueryBudgetTestCase):
+    def activate(self, config):
+        PricingConfig.objects.filter(pk=config.pk).update(is_active=True)
+        PricingConfig.objects.exclude(pk=config.pk).update(is_active=False)
+        invalidate()
+
+    def test_calculate_price(self):
+        self.assertTableViewScales(
+            'calculate_price',
+            lambda: self.client.post(reverse('calculate_price'), self.trip(), content_type='application/json')
+        )
+
+    def test_calculate_price_cold(self):
+        # The first quote after a change compiles the tariff of the active config
+        def cold_quote_queries(config):
+            self.activate(config)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('calculate_price'), self.trip(), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        small = cold_quote_queries(self.small)
+        large = cold_quote_queries(self.large)
+        self.assertQueriesWithinBudget('calculate_price', small, large)
+
+    def test_calculate_price_async(self):
+        self.assertTableViewScales(
+            'calculate_price_async',
+            lambda: self.client.post(reverse('calculate_price_async'), self.trip(), content_type='application/json')
+        )
+
+    def test_calculate_price_batch(self):
+        def batch_of(size):
+            trips = [self.trip() for _ in range(size)]
+            return lambda: self.client.post(reverse('calculate_price_batch'), trips, content_type='application/json')
+
+        small = self.count_queries(batch_of(1))
+        large = self.count_queries(batch_of(500))
+        self.assertQueriesWithinBudget('calculate_price_batch', small, large)
+
+    def test_calculate_price_compare(self):
+        self.assertTableViewScales(
+            'calculate_price_compare',
+            lambda: self.client.post(reverse('calculate_price_compare'), self.trip(), content_type='application/json')
+        )
+
+    def test_price_trips_stream(self):
+        def stream_of(size):
+            body = '\n'.join(json.dumps(self.trip()) for _ in range(size))
+            return lambda: self.client.post(
+                f"{reverse('price_trips_stream')}?config={self.large.pk}",
+                body, content_type='application/x-ndjson'
+            )
+
+        small = self.count_queries(stream_of(1))
+        large = self.count_queries(stream_of(2000))
+        self.assertQueriesWithinBudget('price_trips_stream', small, large)
+
+    def test_export(self):
+        self.assertConfigViewScales(
+            'export_pricing_configs',
+            lambda config: lambda: self.client.get(reverse('export_pricing_configs'), {'config': config.pk})
+        )
+
+    def test_import(self):
+        def import_of(config, copies):
+            document, = export_configs(PricingConfig.objects.filter(pk=config.pk))
+            body = {'configs': [dict(document, name=f'Copy {i}') for i in range(copies)]}
+            return lambda: self.client.post(reverse('import_pricing_configs'), body, content_type='application/json')
+
+        small = self.count_queries(import_of(self.small, 1))
+        large = self.count_queries(import_of(self.large, 20))
+        self.assertQueriesWithinBudget('import_pricing_configs', small, large)
+
+    def test_metrics(self):
+        self.assertTableViewScales('pricing_metrics', lambda: self.client.get(reverse('pricing_metrics')))
+
+
+class AdminQueryBudgetTest(QueryBudgetTestCase):
+    def changelist(self, model_name):
+        url = reverse(f'admin:pricing_{model_name}_changelist')
+        return lambda: self.client.get(url)
+
+    def test_pricing_config_changelist(self):
+        self.assertTableViewScales(
+            'admin:pricing_pricingconfig_changelist', self.changelist('pricingconfig')
+        )
+
+    def test_pricing_config_log_changelist(self):
+        self.assertTableViewScales(
+            'admin:pricing_pricingconfiglog_changelist', self.changelist('pricingconfiglog')
+        )
+
+    def test_price_calculation_log_changelist(self):
+        self.add_calculation_logs(3)
+        self.assertTableViewScales(
+            'admin:pricing_pricecalculationlog_changelist', self.changelist('pricecalculationlog')
+        )
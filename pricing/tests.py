@@ -1,16 +1,59 @@
-from decimal import Decimal
-from django.test import TestCase, Client
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.core.management import call_command, CommandError
+from django.db import OperationalError, transaction
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
+from rest_framework.parsers import JSONParser
 from .models import (
     PricingConfig,
+    PricingConfigLog,
     DistanceBasePrice,
     DistanceAdditionalPrice,
     TimeMultiplierFactor,
-    WaitingCharge
+    WaitingCharge,
+    PricingConfigVersion,
+    PriceCalculationLog
 )
+from .backtest import run_backtest, run_backtest_file
+from .benchmarks import edit_post_data
+from .bulk import price_rows
+from .engine import price_trips, to_metres, vectorize
+from .calculation_log import CalculationLogWriter
+from .forms import DistanceBasePriceForm
+from .management.commands.benchmark_pricing import Command as BenchmarkPricingCommand
+from .middleware import QueryProfile, QueryProfilingMiddleware, get_query_stats
+from .quote_cache import QuoteCache, cached_quote, get_quote_cache
+from .quote_protocol import QuoteClient, QuoteError
+from .quote_server import BackgroundServer, answer, answer_frames
+from .stage_timing import StageHistograms, get_histograms
+from . import quote_protocol, single_flight, snapshot as tariff_snapshot, stamp
+from .tariff import MAX_DISTANCE_KM, MAX_MINUTES, CompiledTariff, build_payload, content_hash, get_version_tariff, get_active, get_active_tariff, get_config_tariffs, snapshot_config, tariff_for_config, invalidate, TariffError
+from .transfer import TransferError, clean_documents, export_configs
 
-class PriceCalculationTest(TestCase):
+# The background log flusher writes outside the test transaction, so tests
+# leave calculation logging off unless they drive a writer themselves. The
+# per-request stamp check is off too, it would run on whichever request is due
+@override_settings(PRICING_CALCULATION_LOG={'ENABLED': False}, PRICING_STAMP_CHECK_INTERVAL=None)
+class PricingTestCase(TestCase):
     def setUp(self):
         # Create test user
         self.user = User.objects.create_user(username='testuser', password='testpass123')
@@ -83,6 +126,8 @@ class PriceCalculationTest(TestCase):
             interval_minutes=3
         )
 
+
+class PriceCalculationTest(PricingTestCase):
     def test_basic_price_calculation(self):
         """Test basic price calculation for a weekday with no additional charges"""
         response = self.client.post(reverse('calculate_price'), {
@@ -245,4 +290,1511 @@ class PriceCalculationTest(TestCase):
             response = self.client.post(reverse('calculate_price'), 
                 test_case, content_type='application/json')
             self.assertEqual(response.status_code, 400)
-            self.assertIn('error', response.json()) 
\ No newline at end of file
+            self.assertIn('error', response.json()) 
+
+    def test_out_of_range_distances(self):
+        """Test that distances outside 0 to MAX_DISTANCE_KM are rejected before pricing"""
+        for distance in ['1e999990', '-1e999990', 'NaN', 'Infinity', '-0.5', '10000.001']:
+            started = time.perf_counter()
+            response = self.client.post(reverse('calculate_price'), {
+                'distance': distance,
+                'duration': 30,
+                'waiting_time': 2,
+                'day_of_week': 2
+            }, content_type='application/json')
+            self.assertLess(time.perf_counter() - started, 1, distance)
+            self.assertEqual(response.status_code, 400, distance)
+            self.assertIn('Distance must be between', response.json()['error'])
+
+        response = self.client.post(reverse('calculate_price'), {
+            'distance': '10000', 'duration': 30, 'waiting_time': 2, 'day_of_week': 2
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+class CompiledTariffTest(PricingTestCase):
+    def quote(self, client=None, **data):
+        payload = {'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 2}
+        payload.update(data)
+        return (client or self.client).post(reverse('calculate_price'), payload, content_type='application/json')
+
+    def test_steady_state_quote_runs_no_queries(self):
+        """Test that a warm compiled tariff prices without touching the database"""
+        anonymous = Client()
+        self.quote(anonymous)
+        with self.assertNumQueries(0):
+            response = self.quote(anonymous)
+        self.assertEqual(response.json()['final_price'], 140.0)
+
+    def test_tariff_recompiled_after_component_change(self):
+        """Test that saving a component invalidates the compiled tariff"""
+        self.assertEqual(self.quote().json()['final_price'], 140.0)
+        additional_price = self.config.distance_additional_prices.get()
+        additional_price.price_per_km = Decimal('40')
+        additional_price.save()
+        # Base price (80) + Additional 2 KM * 40 = 160
+        self.assertEqual(self.quote().json()['final_price'], 160.0)
+
+    def test_tariff_recompiled_after_config_deactivated(self):
+        """Test that deactivating the config is seen by the next quote"""
+        self.assertEqual(self.quote().status_code, 200)
+        self.config.is_active = False
+        self.config.save()
+        response = self.quote()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'No active pricing configuration found')
+
+
+class BatchPriceCalculationTest(PricingTestCase):
+    def test_batch_matches_single_quotes(self):
+        """Test that each batch result equals the single-trip breakdown"""
+        trips = [
+            {'distance': 3.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 2},
+            {'distance': 5.0, 'duration': 90, 'waiting_time': 10, 'day_of_week': 2},
+            {'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 6},
+        ]
+        response = self.client.post(reverse('calculate_price_batch'), trips, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['final_price'] for result in results], [80.0, 190.0, 140.0])
+        single = self.client.post(reverse('calculate_price'), trips[1], content_type='application/json')
+        self.assertEqual(results[1], single.json())
+
+    def test_batch_reports_per_item_errors(self):
+        """Test that invalid trips fail individually without failing the batch"""
+        trips = [
+            {'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 4},  # Friday - not configured
+            {'distance': 'invalid', 'duration': 30, 'waiting_time': 2, 'day_of_week': 2},
+            'not a trip',
+            {'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 2},
+        ]
+        response = self.client.post(reverse('calculate_price_batch'), {'trips': trips}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertIn('No base price configuration found for day', results[0]['error'])
+        self.assertIn('error', results[1])
+        self.assertIn('error', results[2])
+        self.assertEqual(results[3]['final_price'], 140.0)
+
+    def test_batch_requires_a_list(self):
+        """Test that a body without a list of trips is rejected"""
+        response = self.client.post(reverse('calculate_price_batch'), {'distance': 5.0}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+
+class VectorEngineTest(PricingTestCase):
+    def test_engine_matches_scalar_quotes(self):
+        """Test that the vectorised engine agrees with calculate_price to the paisa"""
+        tariff = get_active_tariff()
+        rng = random.Random(42)
+        distances = (
+            # Whole metres, finer than a metre and exactly half a metre
+            [Decimal(rng.randint(0, 30000)) / 1000 for _ in range(500)]
+            + [Decimal(rng.randint(0, 30000000)) / 1000000 for _ in range(500)]
+            + [Decimal(rng.randint(0, 30000)) / 1000 + Decimal('0.0005') for _ in range(500)]
+        )
+        trips = [
+            (distance, rng.randint(0, 240), rng.randint(0, 40), rng.randint(-1, 7))
+            for distance in distances
+        ]
+        # Floats are quoted from their binary value, so their expected quotes use the same float
+        float_trips = [(float(trip[0]), *trip[1:]) for trip in trips]
+        for trips in (trips, float_trips):
+            self.assert_matches_scalar_quotes(tariff, trips)
+
+        distances = ['0.5005', Decimal('3.0005'), 0.5005, 2.0005, '-0.001', float('nan'), '1e999990']
+        self.assertEqual(to_metres(distances).tolist(), [501, 3001, 500, 2001, -1, -1, -1])
+
+    def assert_matches_scalar_quotes(self, tariff, trips):
+        distances, durations, waiting_times, days = zip(*trips)
+        result = price_trips(tariff, distances, durations, waiting_times, days)
+
+        for i, trip in enumerate(trips):
+            try:
+                expected = tariff.quote(*trip)
+            except TariffError:
+                self.assertFalse(result['valid'][i])
+                continue
+            self.assertTrue(result['valid'][i])
+            final_price = Decimal(str(expected['final_price'])).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            self.assertEqual(int(result['final_price_paise'][i]), int(final_price * 100), trip)
+            self.assertEqual(
+                int(result['waiting_intervals'][i]),
+                expected['breakdown']['waiting_time_details']['intervals_charged']
+            )
+
+    def test_engine_components(self):
+        """Test the per-component columns for the complete calculation example"""
+        result = price_trips(get_active_tariff(), [5.0], [90], [10], [2])
+        self.assertEqual(int(result['distance_base_price_paise'][0]), 8000)
+        self.assertEqual(int(result['additional_distance_m'][0]), 2000)
+        self.assertEqual(int(result['additional_distance_price_paise'][0]), 6000)
+        self.assertEqual(int(result['time_multiplier_c'][0]), 125)
+        self.assertEqual(int(result['waiting_charge_paise'][0]), 1500)
+        self.assertEqual(int(result['final_price_paise'][0]), 19000)
+
+    def test_engine_matches_scalar_quotes_at_bounds(self):
+        """Test that trips at the bounds price exactly as calculate_price and trips beyond them are invalid"""
+        tariff = get_active_tariff()
+        trip = (Decimal(MAX_DISTANCE_KM), MAX_MINUTES, MAX_MINUTES, 2)
+        result = price_trips(tariff, [float(trip[0])], [trip[1]], [trip[2]], [trip[3]])
+        self.assertTrue(result['valid'][0])
+        self.assertEqual(int(result['final_price_paise'][0]), tariff.quote(*trip)['exact']['final_price_paise'])
+
+        result = price_trips(
+            tariff,
+            [MAX_DISTANCE_KM + 0.001, 1e17, float('nan'), float('inf'), -1.0, 5.0, 5.0],
+            [90, 90, 90, 90, 90, MAX_MINUTES + 1, 90],
+            [10, 10, 10, 10, 10, 10, -1],
+            [2] * 7,
+        )
+        self.assertFalse(result['in_range'].any())
+        self.assertFalse(result['valid'].any())
+        self.assertFalse(result['final_price_paise'].any())
+
+    def test_engine_bounds_distance_by_tariff_prices(self):
+        """Test that a tariff with extreme prices prices the longest distance it allows without overflow"""
+        tariff = CompiledTariff(
+            1, '', ((Decimal('3'), Decimal('99999999.99')),) * 7, (1,), (Decimal('99.99'),), Decimal('99999999.99')
+        )
+        vector = vectorize(tariff)
+        self.assertLess(vector.max_distance_m, MAX_DISTANCE_KM * 1000)
+        longest = Decimal(int(vector.max_distance_m)).scaleb(-3)
+        result = price_trips(tariff, [float(longest), float(longest) + 0.001], [90, 90], [0, 0], [2, 2])
+        self.assertEqual(result['in_range'].tolist(), [True, False])
+        self.assertEqual(int(result['final_price_paise'][0]), tariff.quote(longest, 90, 0, 2)['exact']['final_price_paise'])
+
+    def test_bulk_rejects_out_of_range_trips(self):
+        """Test that bulk pricing reports out-of-range trips per row instead of mispricing them"""
+        rows = list(price_rows(get_active_tariff(), [
+            {'distance': '1e12', 'duration': 90, 'waiting_time': 10, 'day_of_week': 2},
+            {'distance': '5.0', 'duration': 10 ** 20, 'waiting_time': 10, 'day_of_week': 2},
+            {'distance': '5.0', 'duration': 90, 'waiting_time': 10, 'day_of_week': 2},
+        ]))
+        self.assertIn('Distance must be between', rows[0]['error'])
+        self.assertIn('Duration and waiting time must be between', rows[1]['error'])
+        self.assertEqual(rows[2]['final_price'], '190.00')
+
+
+class BulkPricingTest(PricingTestCase):
+    trips_csv = (
+        'trip_id,distance,duration,waiting_time,day_of_week\n'
+        't1,3.0,30,2,2\n'
+        't2,5.0,90,10,2\n'
+        't3,5.0,30,2,4\n'
+        't4,invalid,30,2,2\n'
+    )
+
+    def test_price_trips_command_csv(self):
+        """Test that the price_trips command prices a CSV file chunk by chunk"""
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'trips.csv')
+            target = os.path.join(tmp, 'priced.csv')
+            with open(source, 'w') as f:
+                f.write(self.trips_csv)
+            call_command('price_trips', source, output=target, chunk_size=2)
+            with open(target) as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual([row['trip_id'] for row in rows], ['t1', 't2', 't3', 't4'])
+        self.assertEqual(rows[0]['final_price'], '80.00')
+        self.assertEqual(rows[1]['final_price'], '190.00')
+        self.assertEqual(rows[1]['time_multiplier'], '1.25')
+        self.assertIn('No base price configuration found for day', rows[2]['error'])
+        self.assertTrue(rows[3]['error'])
+
+    def test_price_trips_endpoint_streams_ndjson(self):
+        """Test the streaming endpoint with NDJSON input against a chosen config"""
+        body = '\n'.join([
+            json.dumps({'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 6}),
+            'not json',
+            json.dumps({'distance': 3.0, 'duration': 30, 'waiting_time': 10, 'day_of_week': 2}),
+        ])
+        response = self.client.post(
+            reverse('price_trips_stream') + f'?config={self.config.pk}',
+            body,
+            content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows[0]['final_price'], '140.00')
+        self.assertIn('Invalid JSON', rows[1]['error'])
+        self.assertEqual(rows[2]['final_price'], '95.00')
+
+    def test_price_trips_endpoint_unknown_config(self):
+        """Test that pricing against a missing config is rejected"""
+        response = self.client.post(reverse('price_trips_stream') + '?config=999999', self.trips_csv, content_type='text/csv')
+        self.assertEqual(response.status_code, 404)
+
+
+class WeekdayMaskTest(PricingTestCase):
+    def test_days_stored_as_mask(self):
+        """Test that days_of_week is packed into the weekday bitmask"""
+        base_price = self.config.distance_base_prices.get(base_price=Decimal('90'))
+        self.assertEqual(base_price.days_mask, 0b0100001)  # Monday, Saturday
+        self.assertEqual(base_price.days_of_week, [0, 5])
+        self.assertEqual(base_price.get_day_names(), ['Monday', 'Saturday'])
+
+    def test_for_day_lookup(self):
+        """Test looking base prices up by weekday"""
+        prices = DistanceBasePrice.objects.filter(pricing_config=self.config)
+        self.assertEqual(prices.for_day(2).get().base_price, Decimal('80'))
+        self.assertEqual(prices.for_day(6).get().base_price, Decimal('95'))
+        self.assertFalse(prices.for_day(4).exists())
+        self.assertFalse(prices.for_day(7).exists())
+
+    def test_form_round_trip(self):
+        """Test that the base price form reads and writes the weekday mask"""
+        base_price = self.config.distance_base_prices.get(base_price=Decimal('95'))
+        form = DistanceBasePriceForm(instance=base_price)
+        self.assertEqual(form.initial['days_of_week'], [6])
+
+        form = DistanceBasePriceForm({
+            'days_of_week': ['4', '6'],
+            'base_distance': '3.5',
+            'base_price': '95',
+        }, instance=base_price)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        base_price.refresh_from_db()
+        self.assertEqual(base_price.days_of_week, [4, 6])
+
+
+class TariffVersionTest(PricingTestCase):
+    def quote(self):
+        return self.client.post(reverse('calculate_price'), {
+            'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 2
+        }, content_type='application/json').json()
+
+    def test_quote_carries_version(self):
+        """Test that quotes report the tariff version they were priced with"""
+        data = self.quote()
+        self.config.refresh_from_db()
+        self.assertIsNotNone(self.config.current_version)
+        self.assertEqual(data['tariff_version'], self.config.current_version_id)
+
+    def test_edit_creates_new_version_and_revert_reuses_it(self):
+        """Test that versions are content-addressed snapshots of the components"""
+        first = self.quote()['tariff_version']
+
+        additional_price = self.config.distance_additional_prices.get()
+        additional_price.price_per_km = Decimal('40')
+        additional_price.save()
+        second = self.quote()
+        self.assertNotEqual(second['tariff_version'], first)
+        self.assertEqual(second['final_price'], 160.0)
+
+        additional_price.price_per_km = Decimal('30.00')
+        additional_price.save()
+        self.assertEqual(self.quote()['tariff_version'], first)
+        self.assertEqual(PricingConfigVersion.objects.count(), 2)
+
+    def test_reused_version_id_is_recompiled(self):
+        """Test that a version ID reused with other content never serves the old compiled tariff or quotes"""
+        version = PricingConfigVersion.objects.get(pk=self.quote()['tariff_version'])
+        tariff = get_version_tariff(version)
+        self.assertIs(get_version_tariff(PricingConfigVersion.objects.get(pk=version.pk)), tariff)
+
+        # What an insert reusing the ID of a rolled back version looks like
+        payload = dict(version.payload, additional_prices=['40.00'])
+        reused = PricingConfigVersion(pk=version.pk, content_hash=content_hash(payload), payload=payload)
+        recompiled = get_version_tariff(reused)
+        self.assertEqual((recompiled.version_id, recompiled.price_per_km), (version.pk, Decimal('40.00')))
+
+        trip = (Decimal('5.0'), 30, 2, 2)
+        self.assertEqual(cached_quote(tariff, *trip)['final_price'], 140.0)
+        self.assertEqual(cached_quote(recompiled, *trip)['final_price'], 160.0)
+
+    def test_versions_are_immutable(self):
+        """Test that a stored version cannot be overwritten"""
+        version = PricingConfigVersion.objects.get(pk=self.quote()['tariff_version'])
+        version.payload = {}
+        with self.assertRaises(ValueError):
+            version.save()
+
+
+class QuoteCacheTest(PricingTestCase):
+    def test_lru_eviction(self):
+        """Test that the least recently used quote is evicted first"""
+        cache = QuoteCache(max_size=2, ttl=0)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'b' is now least recently used
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (3, 1, 1))
+
+    def test_ttl_expiry(self):
+        """Test that entries expire after the TTL"""
+        cache = QuoteCache(max_size=10, ttl=60)
+        with mock.patch('pricing.quote_cache.time.monotonic', return_value=1000.0):
+            cache.set('a', 1)
+        with mock.patch('pricing.quote_cache.time.monotonic', return_value=1059.0):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('pricing.quote_cache.time.monotonic', return_value=1060.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_repeated_quote_is_served_from_cache(self):
+        """Test that identical quotes hit the cache and model changes clear it"""
+        cache = get_quote_cache()
+        trip = {'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 2}
+        self.client.post(reverse('calculate_price'), trip, content_type='application/json')
+        hits = cache.stats()['hits']
+        response = self.client.post(reverse('calculate_price'), dict(trip, distance='5.00'), content_type='application/json')
+        self.assertEqual(response.json()['final_price'], 140.0)
+        self.assertEqual(cache.stats()['hits'], hits + 1)
+
+        self.config.save()
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_metrics_endpoint_requires_staff(self):
+        """Test that cache counters are exposed to staff only"""
+        response = self.client.get(reverse('pricing_metrics'))
+        self.assertEqual(response.status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('pricing_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hits', response.json()['quote_cache'])
+
+
+class SingleFlightTest(PricingTestCase):
+    def run_concurrently(self, group, key, fn, callers):
+        """Call group.do(key, fn) from several threads while the first call is still running."""
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.outcome(group.do, key, fn)))
+            for _ in range(callers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def outcome(self, do, key, fn):
+        try:
+            return do(key, fn)
+        except Exception as e:
+            return e
+
+    def wait_for_calls(self, group, count):
+        deadline = time.monotonic() + 5
+        while group.calls < count:
+            self.assertLess(time.monotonic(), deadline, 'callers did not join the flight')
+            time.sleep(0.001)
+
+    def test_concurrent_calls_share_one_computation(self):
+        """Test that identical concurrent calls share one computation, results and errors alike"""
+        for outcome in ('result', 'error'):
+            group = single_flight.SingleFlight('test')
+            release = threading.Event()
+            computations = []
+
+            def compute():
+                computations.append(1)
+                release.wait(5)
+                if outcome == 'error':
+                    raise TariffError('no base price')
+                return {'final_price': 190.0}
+
+            threads, results = self.run_concurrently(group, 'trip', compute, 5)
+            self.wait_for_calls(group, 5)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(len(computations), 1)
+            self.assertEqual(len(results), 5)
+            if outcome == 'result':
+                self.assertTrue(all(result is results[0] for result in results))
+            else:
+                self.assertTrue(all(isinstance(result, TariffError) for result in results))
+            self.assertEqual(group.stats(), {'calls': 5, 'computed': 1, 'shared': 4, 'coalescing_ratio': 0.8})
+            # Nothing is kept once the flight lands
+            self.assertEqual(group.do('trip', lambda: 'again'), 'again')
+
+    def test_async_calls_share_one_computation(self):
+        """Test that identical concurrent coroutines share one computation"""
+        group = single_flight.AsyncSingleFlight('test')
+        computations = []
+
+        async def compute():
+            computations.append(1)
+            await asyncio.sleep(0.01)
+            return 'tariff'
+
+        async def run():
+            return await asyncio.gather(*(group.do('generation', compute) for _ in range(4)))
+
+        self.assertEqual(asyncio.run(run()), ['tariff'] * 4)
+        self.assertEqual(len(computations), 1)
+        self.assertEqual(group.stats()['coalescing_ratio'], 0.75)
+
+    def test_tariff_loaded_once_after_invalidation(self):
+        """Test that threads missing the active tariff together wait for one load"""
+        active = get_active()
+        release = threading.Event()
+        loads = []
+
+        def load():
+            loads.append(1)
+            release.wait(5)
+            return active
+
+        invalidate()
+        before = single_flight.tariff_loads.calls
+        with mock.patch('pricing.tariff.load_active', side_effect=load):
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(get_active())) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            self.wait_for_calls(single_flight.tariff_loads, before + 4)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, [active] * 4)
+
+    def test_metrics_show_coalescing(self):
+        """Test that the coalescing counters are exposed through the metrics endpoint"""
+        self.user.is_staff = True
+        self.user.save()
+        coalescing = self.client.get(reverse('pricing_metrics')).json()['coalescing']
+        self.assertEqual(sorted(coalescing), ['async_tariff_loads', 'quotes', 'tariff_loads'])
+        self.assertIn('coalescing_ratio', coalescing['quotes'])
+
+
+class CalculationLogTest(PricingTestCase):
+    def quote(self, **data):
+        payload = {'distance': 5.0, 'duration': 90, 'waiting_time': 10, 'day_of_week': 2}
+        payload.update(data)
+        return self.client.post(reverse('calculate_price'), payload, content_type='application/json')
+
+    def test_quotes_are_logged_in_batches(self):
+        """Test that quotes are queued and written with bulk_create on flush"""
+        writer = CalculationLogWriter(batch_size=2, autostart=False)
+        with override_settings(PRICING_CALCULATION_LOG={'ENABLED': True}), \
+                mock.patch('pricing.calculation_log.get_writer', return_value=writer):
+            for duration in (30, 90, 150):
+                self.assertEqual(self.quote(duration=duration).status_code, 200)
+            self.quote(day_of_week=4)  # Not priced, so not logged
+
+        self.assertEqual(PriceCalculationLog.objects.count(), 0)
+        with self.assertNumQueries(2):
+            self.assertEqual(writer.flush(), 3)
+
+        log = PriceCalculationLog.objects.get(duration=90)
+        self.assertEqual(log.pricing_config, self.config)
+        self.assertEqual(log.distance, Decimal('5.000'))
+        self.assertEqual(log.final_price, Decimal('190.00'))
+        self.assertEqual(log.breakdown['breakdown']['waiting_charge'], 15.0)
+        self.assertEqual(log.version_id, log.breakdown['tariff_version'])
+
+    def test_full_queue_drops_entries(self):
+        """Test that a full queue drops new entries instead of blocking"""
+        writer = CalculationLogWriter(max_queue=1, autostart=False)
+        writer.record(self.config.pk, None, Decimal('5'), 30, 2, 2, {'final_price': 140.0})
+        writer.record(self.config.pk, None, Decimal('5'), 30, 2, 2, {'final_price': 140.0})
+        self.assertEqual(writer.stats()['dropped'], 1)
+        self.assertEqual(writer.flush(), 1)
+
+    def test_sampling(self):
+        """Test that a zero sample rate logs nothing"""
+        writer = CalculationLogWriter(sample_rate=0, autostart=False)
+        writer.record(self.config.pk, None, Decimal('5'), 30, 2, 2, {'final_price': 140.0})
+        self.assertEqual(writer.stats()['sampled_out'], 1)
+        self.assertEqual(writer.flush(), 0)
+
+
+class AsyncPriceCalculationTest(PricingTestCase):
+    async def test_async_quote_matches_sync(self):
+        """Test that the native async view returns the same breakdown"""
+        trip = {'distance': 5.0, 'duration': 90, 'waiting_time': 10, 'day_of_week': 2}
+        response = await self.async_client.post(reverse('calculate_price_async'), trip, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['final_price'], 190.0)
+
+        sync_response = await self.async_client.post(reverse('calculate_price'), trip, content_type='application/json')
+        self.assertEqual(response.json(), sync_response.json())
+
+    async def test_async_quote_errors(self):
+        """Test error responses from the native async view"""
+        response = await self.async_client.post(reverse('calculate_price_async'), {
+            'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 4
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('No base price configuration found for day', response.json()['error'])
+
+        response = await self.async_client.post(reverse('calculate_price_async'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.get(reverse('calculate_price_async'))
+        self.assertEqual(response.status_code, 405)
+
+
+class StageTimingTest(PricingTestCase):
+    trip = {'distance': 5.0, 'duration': 90, 'waiting_time': 10, 'day_of_week': 2}
+
+    def setUp(self):
+        super().setUp()
+        get_histograms().reset()
+
+    def server_timing(self, response):
+        return dict(
+            entry.split(';dur=') for entry in response['Server-Timing'].split(', ')
+        )
+
+    def test_no_timing_when_disabled(self):
+        """Test that quotes carry no Server-Timing header by default"""
+        response = self.client.post(reverse('calculate_price'), self.trip, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(get_histograms().snapshot(), {})
+
+    @override_settings(PRICING_STAGE_TIMING=True)
+    def test_server_timing_header(self):
+        """Test that every quote stage is reported and aggregated"""
+        get_quote_cache().clear()
+        response = self.client.post(reverse('calculate_price'), self.trip, content_type='application/json')
+        self.assertEqual(response.json()['final_price'], 190.0)
+        stages = self.server_timing(response)
+        self.assertEqual(
+            set(stages),
+            {'config', 'parse', 'cache', 'base', 'multiplier', 'waiting', 'log', 'serialize', 'total'}
+        )
+        self.assertTrue(all(float(ms) >= 0 for ms in stages.values()))
+
+        response = self.client.post(reverse('calculate_price_async'), self.trip, content_type='application/json')
+        self.assertIn('serialize', self.server_timing(response))
+        self.assertEqual(get_histograms().snapshot()['total']['count'], 2)
+
+    @override_settings(PRICING_STAGE_TIMING=True)
+    def test_body_parsing_is_timed_as_parse(self):
+        """Test that reading the request body is counted in the parse stage"""
+        parse = JSONParser.parse
+
+        def slow_parse(*args, **kwargs):
+            time.sleep(0.05)
+            return parse(*args, **kwargs)
+
+        with mock.patch.object(JSONParser, 'parse', slow_parse):
+            response = self.client.post(reverse('calculate_price'), self.trip, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(float(self.server_timing(response)['parse']), 50)
+
+    def test_histogram_percentiles(self):
+        """Test that percentiles come from the bucket bounds"""
+        histograms = StageHistograms(buckets=(1, 10, 100))
+        for ms in [0.5] * 98 + [50, 500]:
+            histograms.record({'quote': ms / 1000})
+        quote = histograms.snapshot()['quote']
+        self.assertEqual(quote['count'], 100)
+        self.assertEqual(quote['p50_ms'], 1)
+        self.assertEqual(quote['p99_ms'], 100)
+        self.assertAlmostEqual(quote['max_ms'], 500)
+        self.assertEqual(quote['buckets_ms'], {'1': 98, '10': 0, '100': 1, '+Inf': 1})
+
+    @override_settings(PRICING_STAGE_TIMING=True)
+    def test_metrics_endpoint_shows_histograms(self):
+        """Test that stage histograms are exposed through the metrics endpoint"""
+        self.client.post(reverse('calculate_price'), self.trip, content_type='application/json')
+        self.user.is_staff = True
+        self.user.save()
+        stage_timing = self.client.get(reverse('pricing_metrics')).json()['stage_timing']
+        self.assertTrue(stage_timing['enabled'])
+        self.assertEqual(stage_timing['stages']['config']['count'], 1)
+
+
+class QueryProfilingTest(PricingTestCase):
+    def setUp(self):
+        super().setUp()
+        get_query_stats().reset()
+
+    def test_profile_counts_repeated_queries(self):
+        """Test that duplicate and similar queries are told apart"""
+        profile = QueryProfile()
+        execute = lambda sql, params, many, context: None
+        for params in ((1,), (1,), (2,)):
+            profile(execute, 'SELECT %s', params, False, {})
+        profile(execute, 'SELECT 1', (), False, {})
+        self.assertEqual(profile.count, 4)
+        self.assertEqual(profile.duplicates, 1)
+        self.assertEqual(profile.similar, 2)
+        self.assertEqual(profile.most_repeated(), ('SELECT %s', 3))
+
+    @override_settings(DEBUG=False)
+    def test_budget_warning_without_debug(self):
+        """Test that a view over its query budget is logged and counted"""
+        for _ in range(3):
+            PricingConfigLog.objects.create(pricing_config=self.config, user=self.user, action='updated', details={})
+        budgets = {'pricing_config_detail': 2}
+        with override_settings(PRICING_QUERY_PROFILING={'BUDGETS': budgets}), \
+                self.assertLogs('pricing.middleware', 'WARNING') as logs:
+            self.client.get(reverse('pricing_config_detail', args=[self.config.pk]))
+        self.assertIn('pricing_config_detail ran', logs.output[0])
+        self.assertIn('over its budget of 2', logs.output[0])
+
+        detail = get_query_stats().slowest()[0]
+        self.assertEqual(detail['view'], 'pricing_config_detail')
+        self.assertEqual(detail['over_budget'], 1)
+        self.assertGreater(detail['max_queries'], 2)
+
+    def test_metrics_endpoint_lists_views(self):
+        """Test that per-view query statistics are exposed through the metrics endpoint"""
+        self.client.post(reverse('calculate_price'), {
+            'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 2
+        }, content_type='application/json')
+        self.user.is_staff = True
+        self.user.save()
+        views = self.client.get(reverse('pricing_metrics')).json()['slowest_views']
+        self.assertIn('calculate_price', [view['view'] for view in views])
+
+    def test_middleware_is_async_capable(self):
+        """Test that the middleware runs as a coroutine in an async chain and synchronously otherwise"""
+        async def get_async_response(request):
+            return 'async'
+
+        self.assertTrue(iscoroutinefunction(QueryProfilingMiddleware(get_async_response)))
+        self.assertFalse(iscoroutinefunction(QueryProfilingMiddleware(lambda request: 'sync')))
+
+    async def test_async_requests_are_profiled(self):
+        """Test that requests through the async middleware chain are recorded"""
+        response = await self.async_client.post(reverse('calculate_price_async'), {
+            'distance': 5.0, 'duration': 30, 'waiting_time': 2, 'day_of_week': 2
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        views = [view['view'] for view in get_query_stats().slowest()]
+        self.assertIn('calculate_price_async', views)
+
+
+class ConfigPagesTest(PricingTestCase):
+    def test_list_is_paginated_and_annotated(self):
+        """Test that the list page shows per-config counts and pages through configs"""
+        PricingConfigLog.objects.create(pricing_config=self.config, user=self.user, action='updated', details={})
+        for i in range(3):
+            PricingConfig.objects.create(name=f'Extra {i}', is_active=False)
+
+        with override_settings(PRICING_CONFIGS_PER_PAGE=2):
+            response = self.client.get(reverse('pricing_config_list'))
+            config = response.context['configs'][0]
+            self.assertEqual(config, self.config)
+            self.assertEqual(
+                (config.base_price_count, config.additional_price_count,
+                 config.time_multiplier_count, config.waiting_charge_count),
+                (3, 1, 3, 1)
+            )
+            self.assertIsNotNone(config.last_change)
+            self.assertEqual(response.context['page'].paginator.num_pages, 2)
+
+            response = self.client.get(reverse('pricing_config_list'), {'page': 2})
+            self.assertEqual([config.name for config in response.context['configs']], ['Extra 1', 'Extra 2'])
+            self.assertEqual(response.context['configs'][0].base_price_count, 0)
+            self.assertIsNone(response.context['configs'][0].last_change)
+
+    def test_detail_prefetches_components(self):
+        """Test that the detail page renders from one prefetch pass"""
+        for i in range(12):
+            PricingConfigLog.objects.create(pricing_config=self.config, user=self.user, action=f'change {i}', details={})
+        # Session, user, config and one query per prefetched relation
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('pricing_config_detail', args=[self.config.pk]))
+        self.assertEqual(len(response.context['base_prices']), 3)
+        self.assertEqual(
+            [log.action for log in response.context['change_logs']],
+            [f'change {i}' for i in range(11, 1, -1)]
+        )
+
+    def edit_data(self):
+        # The form only accepts time thresholds above 0
+        self.config.time_multipliers.filter(time_threshold=0).update(time_threshold=1)
+        return edit_post_data(self.config)
+
+    def test_edit_writes_changed_rows(self):
+        """Test that an edit writes only the changed rows and logs each change field by field"""
+        base_price = self.config.distance_base_prices.get(base_price=Decimal('80'))
+        multiplier = self.config.time_multipliers.get(time_threshold=120)
+        data = self.edit_data()
+        for i in range(3):
+            if data[f'distance_base_prices-{i}-id'] == str(base_price.pk):
+                data[f'distance_base_prices-{i}-base_price'] = '85.50'
+            if data[f'time_multipliers-{i}-id'] == str(multiplier.pk):
+                data[f'time_multipliers-{i}-DELETE'] = 'on'
+        data.update({
+            'waiting_charges-TOTAL_FORMS': '2',
+            'waiting_charges-1-initial_wait_time': '10',
+            'waiting_charges-1-charge_per_interval': '7',
+            'waiting_charges-1-interval_minutes': '5',
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('pricing_config_edit', args=[self.config.pk]), data)
+        self.assertRedirects(response, reverse('pricing_config_detail', args=[self.config.pk]))
+
+        base_price.refresh_from_db()
+        self.assertEqual(base_price.base_price, Decimal('85.50'))
+        self.assertFalse(self.config.time_multipliers.filter(pk=multiplier.pk).exists())
+        charge = self.config.waiting_charges.get(initial_wait_time=10)
+
+        log = PricingConfigLog.objects.get(pricing_config=self.config, action='updated')
+        changes = log.details['changes']
+        self.assertEqual(sorted(changes), ['base_prices', 'time_multipliers', 'waiting_charges'])
+        self.assertEqual(changes['base_prices'], [
+            {'action': 'updated', 'id': base_price.pk, 'fields': {'base_price': ['80.00', '85.50']}}
+        ])
+        self.assertEqual(changes['time_multipliers'], [
+            {'action': 'deleted', 'id': multiplier.pk, 'values': {'time_threshold': 120, 'multiplier': '2.20'}}
+        ])
+        self.assertEqual(changes['waiting_charges'], [{
+            'action': 'created',
+            'id': charge.pk,
+            'values': {'initial_wait_time': 10, 'charge_per_interval': '7', 'interval_minutes': 5},
+        }])
+        self.assertTrue(log.details['base_prices_modified'])
+        self.assertFalse(log.details['additional_prices_modified'])
+
+        # The version is built from the rows in memory and matches the database
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.current_version.payload, build_payload(self.config))
+        self.assertEqual(get_active_tariff().quote(Decimal('3'), 30, 0, 2)['final_price'], 85.5)
+
+    def test_edit_without_changes(self):
+        """Test that resubmitting a config unchanged writes nothing"""
+        data = self.edit_data()
+        # Session, user, config, the rows of each formset and an empty transaction
+        with self.assertNumQueries(9):
+            response = self.client.post(reverse('pricing_config_edit', args=[self.config.pk]), data)
+        self.assertRedirects(response, reverse('pricing_config_detail', args=[self.config.pk]), fetch_redirect_response=False)
+        self.assertFalse(PricingConfigLog.objects.filter(pricing_config=self.config).exists())
+
+    def test_edit_rejects_rows_of_other_configs(self):
+        """Test that a posted row ID must belong to the edited config"""
+        other = PricingConfig.objects.create(name='Other', is_active=False)
+        row = DistanceAdditionalPrice.objects.create(pricing_config=other, price_per_km=Decimal('10'))
+        data = self.edit_data()
+        data['distance_additional_prices-0-id'] = str(row.pk)
+        data['distance_additional_prices-0-price_per_km'] = '99'
+
+        response = self.client.post(reverse('pricing_config_edit', args=[self.config.pk]), data)
+        self.assertEqual(response.status_code, 200)
+        row.refresh_from_db()
+        self.assertEqual(row.price_per_km, Decimal('10'))
+
+
+class ChangeLogHistoryTest(PricingTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        PricingConfigLog.objects.bulk_create([
+            PricingConfigLog(pricing_config=self.config, user=self.user, action=f'change {i}', details={'i': i})
+            for i in range(7)
+        ])
+        # auto_now_add ignores explicit values, so spread the timestamps afterwards;
+        # two rows share a timestamp to exercise the id tie-break
+        for i, log in enumerate(PricingConfigLog.objects.order_by('pk')):
+            days = 100 * (7 - min(i, 5))
+            PricingConfigLog.objects.filter(pk=log.pk).update(timestamp=now - timedelta(days=days))
+
+    @override_settings(PRICING_LOGS_PER_PAGE=3)
+    def test_keyset_pages(self):
+        """Test that history pages follow each other without gaps or repeats"""
+        seen = []
+        url = reverse('pricing_config_logs', args=[self.config.pk])
+        params = {}
+        while True:
+            response = self.client.get(url, params)
+            self.assertLessEqual(len(response.context['change_logs']), 3)
+            seen += [log.action for log in response.context['change_logs']]
+            if not response.context['next_cursor']:
+                break
+            params = {'after': response.context['next_cursor']}
+        self.assertEqual(seen, ['change 6', 'change 5', 'change 4', 'change 3', 'change 2', 'change 1', 'change 0'])
+
+        response = self.client.get(url, {'after': 'bogus'})
+        self.assertEqual(len(response.context['change_logs']), 3)
+
+    def test_archive_command(self):
+        """Test that old rows are archived per month and deleted"""
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('archive_pricing_logs', older_than=250, output_dir=directory, dry_run=True, stdout=io.StringIO())
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(PricingConfigLog.objects.count(), 7)
+
+            call_command('archive_pricing_logs', older_than=250, output_dir=directory, chunk_size=2, stdout=io.StringIO())
+            remaining = sorted(PricingConfigLog.objects.values_list('action', flat=True))
+            self.assertEqual(remaining, ['change 5', 'change 6'])
+
+            archived = []
+            for name in sorted(os.listdir(directory)):
+                self.assertRegex(name, r'^pricingconfiglog-\d{4}-\d{2}\.ndjson\.gz$')
+                with gzip.open(os.path.join(directory, name), 'rt') as archive:
+                    archived += [json.loads(line) for line in archive]
+            self.assertEqual(sorted(row['action'] for row in archived), [f'change {i}' for i in range(5)])
+            self.assertEqual(archived[0]['pricing_config_id'], self.config.pk)
+
+
+class ConfigTransferTest(PricingTestCase):
+    def setUp(self):
+        super().setUp()
+        # The fixture's 0 minute threshold predates the form rule that
+        # imports are held to
+        TimeMultiplierFactor.objects.filter(pricing_config=self.config, time_threshold=0).update(time_threshold=1)
+
+    def export(self, config):
+        document, = export_configs(PricingConfig.objects.filter(pk=config.pk))
+        return document
+
+    def test_json_round_trip(self):
+        """Test that an exported config imports as an identical tariff"""
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('export_pricing_configs'), {'config': self.config.pk})
+        document, = response.json()['configs']
+        self.assertEqual(document['base_prices'][0], {'days_of_week': [0, 5], 'base_distance': '3.50', 'base_price': '90.00'})
+
+        document['name'] = 'Imported Pricing'
+        response = self.client.post(reverse('import_pricing_configs'), {'configs': [document]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        imported = PricingConfig.objects.get(pk=response.json()['created'][0])
+        self.assertEqual(self.export(imported), document)
+        # Same components, so the import shares the original's tariff version
+        self.assertEqual(imported.current_version, snapshot_config(self.config))
+        self.assertEqual(imported.pricingconfiglog_set.get().action, 'imported')
+
+    def test_csv_round_trip_with_commands(self):
+        """Test export and import of CSV files through the management commands"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'configs.csv')
+            call_command('export_pricing_configs', output=path, stderr=io.StringIO())
+            with open(path) as f:
+                self.assertEqual(next(csv.reader(f))[:3], ['config', 'is_active', 'component'])
+            call_command('import_pricing_configs', path, stdout=io.StringIO())
+
+        original, imported = PricingConfig.objects.filter(name='Standard Pricing').order_by('pk')
+        self.assertEqual(self.export(imported), self.export(original))
+
+    def test_validation_matches_forms(self):
+        """Test that imports are rejected with the edit form messages"""
+        document = self.export(self.config)
+        document['name'] = 'ab'
+        document['base_prices'][0]['base_price'] = '0'
+        document['base_prices'][1]['days_of_week'] = [7]
+        document['waiting_charges'][0]['initial_wait_time'] = -1
+        document['time_multipliers'][0]['multiplier'] = 'x'
+        with self.assertRaises(TransferError) as raised:
+            clean_documents([document])
+        errors = '\n'.join(raised.exception.errors)
+        for message in (
+            'Name must be at least 3 characters long',
+            'base_prices[0].base_price: Base price must be greater than 0',
+            'base_prices[1].days_of_week: Invalid day value. Days must be between 0 and 6',
+            'waiting_charges[0].initial_wait_time: Initial wait time cannot be negative',
+            'time_multipliers[0].multiplier:',
+        ):
+            self.assertIn(message, errors)
+
+        self.user.is_staff = True
+        self.user.save()
+        configs = PricingConfig.objects.count()
+        response = self.client.post(reverse('import_pricing_configs'), [document], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 5)
+        self.assertEqual(PricingConfig.objects.count(), configs)
+
+    def test_endpoints_require_staff(self):
+        """Test that import and export are limited to staff"""
+        self.assertEqual(self.client.get(reverse('export_pricing_configs')).status_code, 403)
+        self.assertEqual(self.client.post(reverse('import_pricing_configs'), [], content_type='application/json').status_code, 403)
+
+
+class BacktestTest(PricingTestCase):
+    def setUp(self):
+        super().setUp()
+        # The draft raises the weekday base price, drops Sunday and charges
+        # 6 INR per waiting interval
+        self.draft = PricingConfig.objects.create(name='Draft Pricing', is_active=False)
+        DistanceBasePrice.objects.create(
+            pricing_config=self.draft, days_of_week=[0, 1, 2, 3, 5], base_distance=Decimal('3'), base_price=Decimal('85')
+        )
+        DistanceAdditionalPrice.objects.create(pricing_config=self.draft, price_per_km=Decimal('30'))
+        TimeMultiplierFactor.objects.create(pricing_config=self.draft, time_threshold=60, multiplier=Decimal('1.25'))
+        WaitingCharge.objects.create(
+            pricing_config=self.draft, initial_wait_time=3, charge_per_interval=Decimal('6'), interval_minutes=3
+        )
+        self.current_tariff = tariff_for_config(self.config.pk)
+        self.draft_tariff = tariff_for_config(self.draft.pk)
+
+    def trips(self, count):
+        rng = random.Random(7)
+        return [
+            {
+                'distance': str(Decimal(rng.randint(0, 30000)) / 1000),
+                'duration': rng.randint(0, 200),
+                'waiting_time': rng.randint(0, 30),
+                'day_of_week': rng.randint(0, 6),
+            }
+            for _ in range(count)
+        ]
+
+    def test_matches_scalar_quotes(self):
+        """Test that the backtest totals agree with calculate_price trip by trip"""
+        trips = self.trips(300)
+        details = []
+        summary = run_backtest(self.current_tariff, self.draft_tariff, trips, chunk_size=64, details=details.extend)
+
+        current_total = draft_total = compared = 0
+        for trip, row in zip(trips, details):
+            args = (Decimal(trip['distance']), trip['duration'], trip['waiting_time'], trip['day_of_week'])
+            try:
+                current = Decimal(str(self.current_tariff.quote(*args)['final_price']))
+                draft = Decimal(str(self.draft_tariff.quote(*args)['final_price']))
+            except TariffError:
+                self.assertTrue(row['error'])
+                continue
+            current = current.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            draft = draft.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            self.assertEqual(row['final_price_delta'], draft - current, trip)
+            current_total += current
+            draft_total += draft
+            compared += 1
+
+        report = summary.as_dict()
+        self.assertEqual([row['trip'] for row in details], list(range(300)))
+        self.assertEqual(report['compared'], compared)
+        self.assertEqual(report['components']['final_price']['current'], current_total)
+        self.assertEqual(report['components']['final_price']['draft'], draft_total)
+        final_price = report['final_price']
+        self.assertEqual(final_price['increased'] + final_price['decreased'] + final_price['unchanged'], compared)
+
+    def test_components(self):
+        """Test the per-component deltas of a single trip"""
+        details = []
+        summary = run_backtest(
+            self.current_tariff, self.draft_tariff,
+            [{'distance': '5', 'duration': 90, 'waiting_time': 10, 'day_of_week': 2}],
+            details=details.extend
+        )
+        components = summary.as_dict()['components']
+        self.assertEqual(components['distance_base_price']['delta'], Decimal('5.00'))
+        self.assertEqual(components['base_fare']['delta'], Decimal('5.00'))
+        # The multiplier scales the 5 INR base price rise by 1.25
+        self.assertEqual(components['time_multiplier_adjustment']['delta'], Decimal('1.25'))
+        self.assertEqual(components['waiting_charge']['delta'], Decimal('3.00'))
+        self.assertEqual(components['final_price']['delta'], Decimal('9.25'))
+        self.assertEqual(details[0]['final_price_current'], Decimal('190.00'))
+
+    def test_command_in_parallel(self):
+        """Test the backtest command with a process pool against the in-process result"""
+        trips = self.trips(500) + [{'distance': 'invalid', 'duration': 1, 'waiting_time': 0, 'day_of_week': 1}]
+        expected = run_backtest(self.current_tariff, self.draft_tariff, trips).as_dict()
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'trips.ndjson')
+            target = os.path.join(directory, 'details.csv')
+            with open(source, 'w') as f:
+                f.write('\n'.join(json.dumps(trip) for trip in trips))
+            out = io.StringIO()
+            call_command(
+                'backtest_pricing', source, self.config.pk, self.draft.pk,
+                workers=2, chunk_size=50, details=target, json=True, stdout=out
+            )
+            with open(target) as f:
+                rows = list(csv.DictReader(f))
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['trips'], 501)
+        self.assertEqual(report['invalid'], 1)
+        self.assertEqual(report['compared'], expected['compared'])
+        self.assertEqual(Decimal(report['components']['final_price']['delta']), expected['components']['final_price']['delta'])
+        self.assertEqual(Decimal(report['final_price']['p50_delta']), expected['final_price']['p50_delta'])
+        self.assertEqual(len(rows), 500)
+        self.assertEqual([int(row['trip']) for row in rows], list(range(500)))
+
+    def test_file_chunks_parsed_by_workers(self):
+        """Test that backtesting raw CSV lines in a process pool matches backtesting parsed rows"""
+        trips = self.trips(300)
+        trips.insert(100, {'distance': 'invalid', 'duration': 1, 'waiting_time': 0, 'day_of_week': 1})
+        expected_details = []
+        expected = run_backtest(
+            self.current_tariff, self.draft_tariff, trips, details=expected_details.extend
+        ).as_dict()
+
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=['distance', 'duration', 'waiting_time', 'day_of_week'])
+        writer.writeheader()
+        writer.writerows(trips)
+        for workers in (1, 2):
+            details = []
+            stream = io.BytesIO(text.getvalue().encode())
+            summary = run_backtest_file(
+                self.current_tariff, self.draft_tariff, stream, 'csv', chunk_size=64, workers=workers,
+                details=details.extend
+            )
+            self.assertEqual(summary.as_dict(), expected)
+            self.assertEqual(
+                [(row['trip'], row.get('final_price_delta')) for row in details],
+                [(row['trip'], row.get('final_price_delta')) for row in expected_details]
+            )
+
+    def test_command_unknown_config(self):
+        """Test that backtesting against a missing config fails cleanly"""
+        with self.assertRaisesMessage(CommandError, 'Pricing configuration 999999 does not exist'):
+            call_command('backtest_pricing', 'trips.csv', self.config.pk, 999999, workers=1)
+
+
+class ShadowPricingTest(PricingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.draft = PricingConfig.objects.create(name='Draft Pricing', is_active=False)
+        DistanceBasePrice.objects.create(
+            pricing_config=self.draft, days_of_week=[2], base_distance=Decimal('3'), base_price=Decimal('85')
+        )
+
+    def compare(self, data):
+        return self.client.post(reverse('calculate_price_compare'), data, content_type='application/json')
+
+    def test_compares_named_configs(self):
+        """Test that one trip is priced under each requested config, in the order asked for"""
+        trip = {'distance': 5.0, 'duration': 90, 'waiting_time': 10, 'day_of_week': 2}
+        response = self.compare({**trip, 'configs': [self.draft.pk, self.config.pk]})
+        self.assertEqual(response.status_code, 200)
+        draft, current = response.json()['results']
+
+        self.assertEqual((draft['name'], draft['is_active']), ('Draft Pricing', False))
+        self.assertEqual(draft['final_price'], 85.0)
+        self.assertEqual(current['final_price'], 190.0)
+        self.assertEqual(current['breakdown'], self.client.post(reverse('calculate_price'), trip, content_type='application/json').json()['breakdown'])
+        # Shadow quotes are not logged
+        self.assertFalse(PriceCalculationLog.objects.exists())
+
+    def test_compares_all_configs(self):
+        """Test that every config is priced when none are named, errors per config"""
+        response = self.compare({'distance': 5.0, 'duration': 30, 'waiting_time': 0, 'day_of_week': 6})
+        current, draft = response.json()['results']
+        self.assertEqual(current['config_id'], self.config.pk)
+        self.assertEqual(current['final_price'], 140.0)
+        self.assertIn('No base price configuration found for day 6', draft['error'])
+
+    def test_tariffs_are_preloaded(self):
+        """Test that compiled config tariffs are reused until a component changes"""
+        get_config_tariffs()
+        with self.assertNumQueries(0):
+            config_tariffs = get_config_tariffs()
+        self.assertEqual([config_tariff.config_id for config_tariff in config_tariffs], [self.config.pk, self.draft.pk])
+
+        DistanceBasePrice.objects.filter(pricing_config=self.draft).get().delete()
+        DistanceBasePrice.objects.create(
+            pricing_config=self.draft, days_of_week=[2], base_distance=Decimal('3'), base_price=Decimal('99')
+        )
+        response = self.compare({'distance': 3.0, 'duration': 30, 'waiting_time': 0, 'day_of_week': 2, 'configs': [self.draft.pk]})
+        self.assertEqual(response.json()['results'][0]['final_price'], 99.0)
+
+    def test_invalid_requests(self):
+        """Test unknown configs, malformed config lists and non-staff users"""
+        response = self.compare({'distance': 5.0, 'configs': [self.config.pk, 999999]})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('999999', response.json()['error'])
+        self.assertEqual(self.compare({'distance': 5.0, 'configs': 'all'}).status_code, 400)
+        self.assertEqual(self.compare({'distance': 'far'}).status_code, 400)
+
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.compare({'distance': 5.0}).status_code, 403)
+
+
+def decimal_quote(tariff, distance, duration, waiting_time, day_of_week):
+    """The Decimal arithmetic calculate_price used before quotes moved to integers."""
+    day_entry = tariff.base_price_for_day(day_of_week)
+    if day_entry is None:
+        raise TariffError(f'No base price configuration found for day {day_of_week}')
+    base_distance, dbp = day_entry
+    additional_distance = max(distance - base_distance, Decimal('0'))
+    additional_price = additional_distance * (tariff.price_per_km or 0)
+    base_fare = dbp + additional_price
+    time_multiplier = tariff.time_multiplier(duration)
+    time_adjusted_fare = base_fare * time_multiplier
+    waiting_charge = Decimal('0')
+    if tariff.waiting and waiting_time > tariff.waiting[0]:
+        initial_wait_time, charge_per_interval, interval_minutes = tariff.waiting
+        waiting_charge = -(-(waiting_time - initial_wait_time) // interval_minutes) * charge_per_interval
+    return {
+        'distance_base_price': dbp,
+        'additional_distance': additional_distance,
+        'additional_distance_price': additional_price,
+        'base_fare': base_fare,
+        'time_multiplier': time_multiplier,
+        'time_adjusted_fare': time_adjusted_fare,
+        'waiting_charge': waiting_charge,
+        'final_price': time_adjusted_fare + waiting_charge,
+    }
+
+
+class FixedPointQuoteTest(SimpleTestCase):
+    # Decimal amount: (exact column, its scale)
+    fields = {
+        'distance_base_price': ('distance_base_price_paise', 2),
+        'additional_distance': ('additional_distance_m', 3),
+        'additional_distance_price': ('additional_distance_price_paise', 2),
+        'base_fare': ('base_fare_paise', 2),
+        'time_multiplier': ('time_multiplier_c', 2),
+        'time_adjusted_fare': ('time_adjusted_fare_paise', 2),
+        'waiting_charge': ('waiting_charge_paise', 2),
+        'final_price': ('final_price_paise', 2),
+    }
+
+    def random_tariff(self, rng):
+        def amount(low, high):
+            return Decimal(rng.randint(low * 100, high * 100)) / 100
+
+        day_table = [None] * 7
+        for day in rng.sample(range(7), rng.randint(1, 7)):
+            day_table[day] = (amount(1, 10), amount(20, 200))
+        thresholds = tuple(sorted(rng.sample(range(1, 240), rng.randint(0, 4))))
+        return CompiledTariff(
+            version_id=1,
+            content_hash='',
+            day_table=tuple(day_table),
+            thresholds=thresholds,
+            multipliers=tuple(amount(1, 4) for _ in thresholds),
+            price_per_km=amount(1, 60) if rng.random() < 0.9 else None,
+            waiting=(rng.randint(0, 10), amount(1, 20), rng.randint(1, 10)) if rng.random() < 0.9 else None,
+        )
+
+    def test_matches_decimal_arithmetic(self):
+        """Test that integer quotes equal the Decimal arithmetic, rounded to paise, over random tariffs and trips"""
+        rng = random.Random(2024)
+        for _ in range(200):
+            tariff = self.random_tariff(rng)
+            for _ in range(100):
+                trip = (
+                    Decimal(rng.randint(0, 60000)) / 1000,
+                    rng.randint(0, 300),
+                    rng.randint(0, 60),
+                    rng.randint(-1, 7),
+                )
+                try:
+                    expected = decimal_quote(tariff, *trip)
+                except TariffError:
+                    with self.assertRaises(TariffError):
+                        tariff.quote(*trip)
+                    continue
+
+                quote = tariff.quote(*trip)
+                for name, (column, places) in self.fields.items():
+                    exact = expected[name].scaleb(places).to_integral_value(ROUND_HALF_UP)
+                    self.assertEqual(quote['exact'][column], exact, (name, trip))
+                self.assertEqual(quote['final_price'], float(quote['exact']['final_price_paise']) / 100)
+
+    def test_distance_is_rounded_to_metres(self):
+        """Test that distances finer than a metre are rounded, halves up"""
+        tariff = CompiledTariff(1, '', ((Decimal('3'), Decimal('80')),) * 7, (), (), Decimal('30'))
+        self.assertEqual(tariff.quote(Decimal('5.0005'), 0, 0, 0)['exact']['additional_distance_m'], 2001)
+        self.assertEqual(tariff.quote(Decimal('5.0004999'), 0, 0, 0)['exact']['additional_distance_m'], 2000)
+
+
+class BenchmarkRegressionTest(SimpleTestCase):
+    baseline = {
+        'calculate_price': {'p50_ms': 2.0, 'queries': 3},
+        'config_list': {'p50_ms': 10.0, 'queries': 5},
+    }
+
+    def regressions(self, results, threshold=0.2):
+        return BenchmarkPricingCommand().regressions(results, self.baseline, threshold)
+
+    def test_more_queries_per_request(self):
+        """Test that a scenario running more queries than the baseline is a regression"""
+        found = self.regressions({'calculate_price': {'p50_ms': 2.0, 'queries': 4}})
+        self.assertEqual(found, ['calculate_price: 3 -> 4 queries per request'])
+
+    def test_p50_beyond_threshold(self):
+        """Test that a p50 slowdown beyond the threshold is a regression"""
+        found = self.regressions({'config_list': {'p50_ms': 12.5, 'queries': 5}})
+        self.assertEqual(found, ['config_list: p50 10.00ms -> 12.50ms'])
+        self.assertEqual(self.regressions({'config_list': {'p50_ms': 12.5, 'queries': 5}}, threshold=0.3), [])
+
+    def test_within_threshold(self):
+        """Test that a slowdown within the threshold and fewer queries are not regressions"""
+        found = self.regressions({
+            'calculate_price': {'p50_ms': 2.4, 'queries': 2},
+            'config_list': {'p50_ms': 8.0, 'queries': 5},
+        })
+        self.assertEqual(found, [])
+
+    def test_path_missing_from_baseline(self):
+        """Test that scenarios the baseline did not run are skipped"""
+        found = self.regressions({
+            'calculate_price_batch': {'p50_ms': 50.0, 'queries': 40},
+            'calculate_price': {'p50_ms': 3.0, 'queries': 4},
+        })
+        self.assertEqual(found, [
+            'calculate_price: 3 -> 4 queries per request',
+            'calculate_price: p50 2.00ms -> 3.00ms',
+        ])
+
+
+class QuoteOnlyProfileTest(PricingTestCase):
+    trip = {'distance': 5.0, 'duration': 90, 'waiting_time': 10, 'day_of_week': 2}
+
+    def test_quotes_match_full_site(self):
+        """Test that the quote-only URLconf returns the same quotes without any middleware"""
+        expected = self.client.post(reverse('calculate_price'), self.trip, content_type='application/json').json()
+        with override_settings(ROOT_URLCONF='config.urls_quote', MIDDLEWARE=[]):
+            client = Client()
+            for name in ('calculate_price', 'calculate_price_async'):
+                response = client.post(reverse(name), self.trip, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected)
+
+            self.assertEqual(client.post(reverse('calculate_price'), 'not json', content_type='application/json').status_code, 400)
+            self.assertEqual(client.post(reverse('calculate_price'), [], content_type='application/json').status_code, 400)
+            self.assertEqual(client.get(reverse('calculate_price')).status_code, 405)
+
+    def test_entry_point_loads_only_the_engine(self):
+        """Test that the quote-only WSGI entry point imports no DRF, admin, sessions or pages"""
+        heavy = ['rest_framework', 'django.contrib.admin', 'django.contrib.sessions', 'pricing.views', 'pricing.forms']
+        code = (
+            'import sys, config.wsgi_quote; '
+            f'print(",".join(module for module in {heavy!r} if module in sys.modules))'
+        )
+        env = {**os.environ, 'PYTHONPATH': str(settings.BASE_DIR)}
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, cwd=settings.BASE_DIR)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class TariffSnapshotTest(PricingTestCase):
+    trip = {'distance': 5.0, 'duration': 90, 'waiting_time': 10, 'day_of_week': 2}
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'tariff.bin')
+
+    def write_snapshot(self):
+        call_command('snapshot_tariff', output=self.path, stdout=io.StringIO())
+
+    def test_round_trip(self):
+        """Test that a decoded snapshot quotes exactly like the compiled tariff"""
+        active = get_active()
+        stamp, decoded = tariff_snapshot.decode(tariff_snapshot.encode(active, stamp=7))
+        self.assertEqual(stamp, 7)
+        self.assertEqual(decoded, active)
+        for trip in [(Decimal('5'), 90, 10, 2), (Decimal('12.345'), 150, 4, 6), (Decimal('1'), 0, 0, 0)]:
+            self.assertEqual(decoded[1].quote(*trip), active[1].quote(*trip))
+
+        self.assertEqual(tariff_snapshot.decode(tariff_snapshot.encode(None))[1], None)
+        damaged = bytearray(tariff_snapshot.encode(active))
+        damaged[-10] ^= 1
+        with self.assertRaisesMessage(tariff_snapshot.SnapshotError, 'checksum'):
+            tariff_snapshot.decode(bytes(damaged))
+
+    def test_quotes_without_database(self):
+        """Test that quotes are served from the snapshot while the database is unavailable"""
+        self.write_snapshot()
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.path))], ['tariff.bin'])
+        with override_settings(PRICING_TARIFF_SNAPSHOT_PATH=self.path), \
+                mock.patch('pricing.tariff.load_active', side_effect=OperationalError('database is down')):
+            invalidate()
+            with self.assertNumQueries(0):
+                response = Client().post(reverse('calculate_price'), self.trip, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['final_price'], 190.0)
+
+    @override_settings(PRICING_TARIFF_SNAPSHOT_CHECK_INTERVAL=0)
+    def test_reloads_replaced_snapshot(self):
+        """Test that workers pick up a new snapshot and keep the last good one when the file is damaged"""
+        self.write_snapshot()
+        with override_settings(PRICING_TARIFF_SNAPSHOT_PATH=self.path):
+            first = get_active()[1]
+            base_price = DistanceBasePrice.objects.get(pricing_config=self.config, base_price=Decimal('80'))
+            base_price.base_price = Decimal('100')
+            base_price.save()
+            # The snapshot, not the database, decides until it is rewritten
+            self.assertEqual(get_active()[1], first)
+
+            self.write_snapshot()
+            second = get_active()[1]
+            self.assertNotEqual(second.version_id, first.version_id)
+            self.assertEqual(second.quote(Decimal('3'), 0, 0, 2)['final_price'], 100.0)
+
+            with open(self.path + '.new', 'wb') as f:
+                f.write(b'not a snapshot')
+            os.replace(self.path + '.new', self.path)
+            with self.assertLogs('pricing.snapshot', 'WARNING'):
+                self.assertEqual(get_active()[1], second)
+
+    def test_missing_snapshot_uses_database(self):
+        """Test that the database is used until a snapshot has been written"""
+        with override_settings(PRICING_TARIFF_SNAPSHOT_PATH=self.path), self.assertLogs('pricing.snapshot', 'WARNING'):
+            self.assertEqual(get_active()[0], self.config.pk)
+
+
+class QuoteSocketTest(PricingTestCase):
+    trips = [(5.0, 90, 10, 2), (12.345, 150, 4, 6), (1, 0, 0, 0), (3.75, 45, 2, 5), (2, 10, 0, 4)]
+
+    def test_matches_http_api(self):
+        """Test that pipelined socket quotes match the HTTP API, errors included"""
+        expected = []
+        for distance, duration, waiting_time, day_of_week in self.trips:
+            response = self.client.post(reverse('calculate_price'), {
+                'distance': distance, 'duration': duration, 'waiting_time': waiting_time, 'day_of_week': day_of_week
+            }, content_type='application/json')
+            body = response.json()
+            expected.append({'error': body['error']} if response.status_code == 400 else {
+                'final_price': body['final_price'], 'exact': body['exact'], 'tariff_version': body['tariff_version']
+            })
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'quotes.sock')
+            with BackgroundServer(path), QuoteClient(path) as client:
+                self.assertEqual(client.quote_many(self.trips), expected)
+                self.assertEqual(client.quote(5.0, 90, 10, 2)['final_price'], 190.0)
+                with self.assertRaisesMessage(QuoteError, 'day 4'):
+                    client.quote(2, 10, 0, 4)
+            self.assertFalse(os.path.exists(path))
+
+    def test_out_of_range_trips(self):
+        """Test that out-of-range trips get an error frame and the requests pipelined behind them are answered"""
+        bad = [
+            (-5000, 90, 10),
+            (MAX_DISTANCE_KM * 1000 + 1, 90, 10),
+            (2 ** 62, 90, 10),
+            (5000, -1, 10),
+            (5000, 90, MAX_MINUTES + 1),
+        ]
+        # The server thread cannot see the test transaction, so the tariff is compiled here first
+        get_active()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'quotes.sock')
+            with BackgroundServer(path), QuoteClient(path) as client:
+                for request_id, (distance_m, duration, waiting_time) in enumerate(bad):
+                    client.sock.sendall(
+                        quote_protocol.frame(quote_protocol.REQUEST.pack(request_id, distance_m, duration, waiting_time, 2))
+                        + quote_protocol.encode_request(100 + request_id, 5.0, 90, 10, 2)
+                    )
+                    request_id_back, result = quote_protocol.decode_response(client.read_frame())
+                    self.assertEqual(request_id_back, request_id)
+                    self.assertIn('must be between', result['error'])
+                    request_id_back, result = quote_protocol.decode_response(client.read_frame())
+                    self.assertEqual((request_id_back, result['final_price']), (100 + request_id, 190.0))
+
+    def test_unencodable_result_is_a_request_error(self):
+        """Test that a quote too large for the response frame fails only its own request"""
+        # Beyond what a pricing model can store, so only a hand-built tariff gets here
+        tariff = CompiledTariff(1, '', ((Decimal('3'), Decimal('80')),) * 7, (), (), Decimal('1e15'))
+        payload = quote_protocol.REQUEST.pack(3, MAX_DISTANCE_KM * 1000, 90, 0, 2)
+        request_id, result = quote_protocol.decode_response(
+            answer((self.config.pk, tariff), payload)[quote_protocol.LENGTH.size:]
+        )
+        self.assertEqual(request_id, 3)
+        self.assertIn('error', result)
+
+    def test_socket_path_in_use(self):
+        """Test that a stale socket file is replaced but a live server's socket is left alone"""
+        get_active()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'quotes.sock')
+            # A socket file nobody listens on, as a killed server leaves behind
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+                stale.bind(path)
+            with BackgroundServer(path):
+                with self.assertRaisesMessage(RuntimeError, 'Another quote server is listening'):
+                    with BackgroundServer(path):
+                        pass
+                with QuoteClient(path) as client:
+                    self.assertEqual(client.quote(5.0, 90, 10, 2)['final_price'], 190.0)
+
+    def test_malformed_frames(self):
+        """Test that malformed requests get an error and oversized frames close the connection"""
+        active = get_active()
+        request_id, result = quote_protocol.decode_response(
+            answer(active, quote_protocol.REQUEST_ID.pack(7) + b'short')[quote_protocol.LENGTH.size:]
+        )
+        self.assertEqual((request_id, result), (7, {'error': 'Malformed request'}))
+
+        oversized = quote_protocol.LENGTH.pack(quote_protocol.MAX_FRAME_SIZE + 1)
+        with self.assertRaises(quote_protocol.ProtocolError):
+            async_to_sync(answer_frames)(bytearray(oversized))
+        # A partial frame waits for the rest
+        request = quote_protocol.encode_request(1, 5, 90, 10, 2)
+        self.assertEqual(async_to_sync(answer_frames)(bytearray(request[:-1])), (b'', 0))
+        self.assertEqual(quote_protocol.distance_to_metres(Decimal('3.0005')), 3001)
+
+
+# Stamps are bumped once per committed transaction, so these tests commit
+@override_settings(PRICING_CALCULATION_LOG={'ENABLED': False}, PRICING_STAMP_CHECK_INTERVAL=0)
+class PricingStampTest(TransactionTestCase):
+    trip = {'distance': 2.0, 'duration': 30, 'waiting_time': 0, 'day_of_week': 2}
+
+    def setUp(self):
+        self.config = PricingConfig.objects.create(name='Standard Pricing', is_active=True)
+        self.base_price = DistanceBasePrice.objects.create(
+            pricing_config=self.config,
+            days_of_week=[0, 1, 2, 3, 4, 5, 6],
+            base_distance=Decimal('3'),
+            base_price=Decimal('80')
+        )
+        TimeMultiplierFactor.objects.create(pricing_config=self.config, time_threshold=0, multiplier=Decimal('1'))
+
+    def quote(self):
+        response = Client().post(reverse('calculate_price'), self.trip, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['final_price']
+
+    def test_bumped_once_per_transaction(self):
+        """Test that a transaction bumps the stamp once however many rows it changes"""
+        version = stamp.current()
+        with transaction.atomic():
+            DistanceAdditionalPrice.objects.create(pricing_config=self.config, price_per_km=Decimal('30'))
+            WaitingCharge.objects.create(
+                pricing_config=self.config, initial_wait_time=3, charge_per_interval=Decimal('5'), interval_minutes=3
+            )
+        self.assertEqual(stamp.current(), version + 1)
+
+        self.base_price.base_price = Decimal('85')
+        self.base_price.save()
+        self.assertEqual(stamp.current(), version + 2)
+
+    def test_rolled_back_savepoint(self):
+        """Test that a bump rolled back with a savepoint is made again by the next change"""
+        version = stamp.current()
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    self.base_price.base_price = Decimal('85')
+                    self.base_price.save()
+                    raise ValueError
+            except ValueError:
+                pass
+            self.config.name = 'Renamed'
+            self.config.save()
+        self.assertEqual(stamp.current(), version + 1)
+
+    def test_change_from_another_process(self):
+        """Test that a worker drops its cached tariff once another process bumps the stamp"""
+        self.assertEqual(self.quote(), 80.0)
+        # Queryset updates send no signals, like a write made in another process
+        DistanceBasePrice.objects.filter(pk=self.base_price.pk).update(base_price=Decimal('100'))
+        self.assertEqual(self.quote(), 80.0)
+
+        stamp.bump()
+        self.assertEqual(self.quote(), 100.0)
+
+    def test_check_interval(self):
+        """Test that the stamp is read at most once per check interval"""
+        checker = stamp.StampChecker(60)
+        self.assertTrue(checker.is_stale())
+        stamp.bump()
+        with self.assertNumQueries(0):
+            self.assertFalse(checker.is_stale())
+        with override_settings(PRICING_STAMP_CHECK_INTERVAL=None):
+            self.assertIsNone(stamp.get_checker())
@@ -0,0 +1,260 @@
+"""
+Bulk import and export of pricing configurations.
+
+A configuration travels as a document holding its name, active flag and
+component rows:
+
+    {"name": "Pune", "is_active": true,
+     "base_prices": [{"days_of_week": [0, 1, 2], "base_distance": "3.00", "base_price": "80.00"}],
+     "additional_prices": [{"price_per_km": "30.00"}],
+     "time_multipliers": [{"time_threshold": 60, "multiplier": "1.25"}],
+     "waiting_charges": [{"initial_wait_time": 3, "charge_per_interval": "5.00", "interval_minutes": 3}]}
+
+A JSON file holds {"configs": [...]}. A CSV file has one row per config
+(component "config") and one per component row, tied together by the config
+name. Imports are validated with the same rules as the edit forms and then
+written with bulk_create in a single transaction.
+"""
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .forms import (
+    validate_config_name,
+    validate_days_of_week,
+    validate_base_distance,
+    validate_base_price,
+    validate_price_per_km,
+    validate_time_threshold,
+    validate_multiplier,
+    validate_initial_wait_time,
+    validate_charge_per_interval,
+    validate_interval_minutes
+)
+from .models import (
+    PricingConfig,
+    DistanceBasePrice,
+    DistanceAdditionalPrice,
+    TimeMultiplierFactor,
+    WaitingCharge,
+    PricingConfigLog
+)
+from .signals import pricing_data_changed
+from .tariff import payload_from_rows, snapshot_configs
+
+FORMATS = ('json', 'csv')
+BATCH_SIZE = 1000
+
+# Component key: (model, CSV component name, {field: form validation rule})
+COMPONENTS = {
+    'base_prices': (DistanceBasePrice, 'base_price', {
+        'days_of_week': validate_days_of_week,
+        'base_distance': validate_base_distance,
+        'base_price': validate_base_price,
+    }),
+    'additional_prices': (DistanceAdditionalPrice, 'additional_price', {
+        'price_per_km': validate_price_per_km,
+    }),
+    'time_multipliers': (TimeMultiplierFactor, 'time_multiplier', {
+        'time_threshold': validate_time_threshold,
+        'multiplier': validate_multiplier,
+    }),
+    'waiting_charges': (WaitingCharge, 'waiting_charge', {
+        'initial_wait_time': validate_initial_wait_time,
+        'charge_per_interval': validate_charge_per_interval,
+        'interval_minutes': validate_interval_minutes,
+    }),
+}
+
+CSV_BOOLEANS = {'1': True, 'true': True, 'yes': True, '0': False, 'false': False, 'no': False}
+
+CSV_FIELDS = ['config', 'is_active', 'component'] + [
+    field for _, _, validators in COMPONENTS.values() for field in validators
+]
+
+
+class TransferError(Exception):
+    """An import that did not validate; errors lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} validation error(s)')
+        self.errors = errors
+
+
+def _value(value):
+    # Decimals are exported as strings so no precision is lost
+    return value if isinstance(value, (bool, int, list)) else str(value)
+
+
+def export_configs(queryset):
+    """Documents for every config in queryset, fetched in a fixed number of queries."""
+    documents = []
+    for config in queryset.with_components().order_by('pk'):
+        document = {'name': config.name, 'is_active': config.is_active}
+        for key, (model, _, validators) in COMPONENTS.items():
+            rows = getattr(config, model._meta.get_field('pricing_config').related_query_name()).all()
+            document[key] = [
+                {field: _value(getattr(row, field)) for field in validators}
+                for row in rows
+            ]
+        documents.append(document)
+    return documents
+
+
+def write_json(documents, stream):
+    json.dump({'configs': documents}, stream, indent=2)
+
+
+def write_csv(documents, stream):
+    writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for document in documents:
+        writer.writerow({'config': document['name'], 'is_active': document['is_active'], 'component': 'config'})
+        for key, (_, component, _) in COMPONENTS.items():
+            for row in document[key]:
+                row = dict(row)
+                if 'days_of_week' in row:
+                    row['days_of_week'] = ';'.join(str(day) for day in row['days_of_week'])
+                writer.writerow({'config': document['name'], 'component': component, **row})
+
+
+def read_json(stream):
+    try:
+        data = json.load(stream)
+    except ValueError as e:
+        raise TransferError([f'Invalid JSON: {e}'])
+    documents = data.get('configs') if isinstance(data, dict) else data
+    if not isinstance(documents, list) or not all(isinstance(document, dict) for document in documents):
+        raise TransferError(['Expected {"configs": [...]} or a list of configs'])
+    return documents
+
+
+def read_csv(stream):
+    components = {component: key for key, (_, component, _) in COMPONENTS.items()}
+    documents = {}
+    errors = []
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        name = (row.get('config') or '').strip()
+        document = documents.get(name)
+        if document is None:
+            document = documents[name] = {'name': name, 'is_active': True, **{key: [] for key in COMPONENTS}}
+        component = (row.get('component') or '').strip()
+        if component == 'config':
+            is_active = (row.get('is_active') or '').strip()
+            if is_active:
+                # Anything unrecognised is left for validation to reject
+                document['is_active'] = CSV_BOOLEANS.get(is_active.lower(), is_active)
+        elif component in components:
+            key = components[component]
+            values = {field: row.get(field) for field in COMPONENTS[key][2]}
+            if 'days_of_week' in values:
+                values['days_of_week'] = [day for day in (values['days_of_week'] or '').split(';') if day.strip()]
+            document[key].append(values)
+        else:
+            errors.append(f'line {line}: unknown component {component!r}')
+    if errors:
+        raise TransferError(errors)
+    return list(documents.values())
+
+
+def read_documents(stream, fmt):
+    """Parse a binary stream of JSON or CSV into config documents."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return read_json(text) if fmt == 'json' else read_csv(text)
+
+
+def _clean_field(model, field, validate, value):
+    if field == 'days_of_week':
+        return validate(value if isinstance(value, list) else [value])
+    return validate(model._meta.get_field(field).clean(value, None))
+
+
+def clean_documents(documents):
+    """
+    Validate documents with the edit form rules, converting every value.
+    Returns the cleaned documents or raises TransferError listing all errors.
+    """
+    cleaned = []
+    errors = []
+    for index, document in enumerate(documents):
+        where = f"configs[{index}] ({document.get('name', '')})"
+        config = {}
+        try:
+            config['name'] = validate_config_name(PricingConfig._meta.get_field('name').clean(document.get('name'), None))
+            config['is_active'] = PricingConfig._meta.get_field('is_active').clean(document.get('is_active', True), None)
+        except ValidationError as e:
+            errors.append(f"{where}: {' '.join(e.messages)}")
+
+        for key, (model, _, validators) in COMPONENTS.items():
+            rows = document.get(key) or []
+            if not isinstance(rows, list):
+                errors.append(f'{where}.{key}: expected a list')
+                continue
+            config[key] = []
+            for row_index, row in enumerate(rows):
+                if not isinstance(row, dict):
+                    errors.append(f'{where}.{key}[{row_index}]: expected an object')
+                    continue
+                values = {}
+                for field, validate in validators.items():
+                    try:
+                        values[field] = _clean_field(model, field, validate, row.get(field))
+                    except ValidationError as e:
+                        errors.append(f"{where}.{key}[{row_index}].{field}: {' '.join(e.messages)}")
+                config[key].append(values)
+        cleaned.append(config)
+    if errors:
+        raise TransferError(errors)
+    return cleaned
+
+
+@transaction.atomic
+def import_configs(cleaned, user=None):
+    """
+    Create configs from cleaned documents with bulk inserts, snapshot their
+    tariff versions and log the import. Returns the created configs.
+    """
+    configs = PricingConfig.objects.bulk_create(
+        [PricingConfig(name=document['name'], is_active=document['is_active']) for document in cleaned],
+        batch_size=BATCH_SIZE
+    )
+
+    rows = {key: [] for key in COMPONENTS}
+    rows_by_config = []
+    for config, document in zip(configs, cleaned):
+        config_rows = {}
+        for key, (model, _, _) in COMPONENTS.items():
+            instances = []
+            for values in document[key]:
+                values = dict(values)
+                days = values.pop('days_of_week', None)
+                instance = model(pricing_config=config, **values)
+                if days is not None:
+                    instance.days_of_week = days
+                instances.append(instance)
+            config_rows[key] = instances
+            rows[key] += instances
+        rows_by_config.append(config_rows)
+    for key, (model, _, _) in COMPONENTS.items():
+        model.objects.bulk_create(rows[key], batch_size=BATCH_SIZE)
+
+    # Rows are inserted in document order, which is their primary key order
+    versions = snapshot_configs(configs, [
+        payload_from_rows(*(config_rows[key] for key in COMPONENTS)) for config_rows in rows_by_config
+    ])
+    PricingConfigLog.objects.bulk_create([
+        PricingConfigLog(
+            pricing_config=config,
+            user=user,
+            action='imported',
+            details={'name': config.name, 'is_active': config.is_active, 'version': version.pk}
+        )
+        for config, version in zip(configs, versions)
+    ], batch_size=BATCH_SIZE)
+
+    # Bulk writes send no model signals, so record the change here
+    pricing_data_changed()
+    return configs
@@ -5,8 +5,16 @@ urlpatterns = [
     path('', views.pricing_config_list, name='pricing_config_list'),
     path('create/', views.pricing_config_create, name='pricing_config_create'),
     path('<int:pk>/', views.pricing_config_detail, name='pricing_config_detail'),
+    path('<int:pk>/logs/', views.pricing_config_logs, name='pricing_config_logs'),
     path('<int:pk>/edit/', views.pricing_config_edit, name='pricing_config_edit'),
     path('<int:pk>/delete/', views.pricing_config_delete, name='pricing_config_delete'),
     path('calculator/', views.price_calculator, name='price_calculator'),
     path('api/calculate-price/', views.calculate_price, name='calculate_price'),
+    path('api/calculate-price/async/', views.calculate_price_async, name='calculate_price_async'),
+    path('api/calculate-price/batch/', views.calculate_price_batch, name='calculate_price_batch'),
+    path('api/calculate-price/compare/', views.calculate_price_compare, name='calculate_price_compare'),
+    path('api/price-trips/', views.price_trips_stream, name='price_trips_stream'),
+    path('api/configs/export/', views.export_pricing_configs, name='export_pricing_configs'),
+    path('api/configs/import/', views.import_pricing_configs, name='import_pricing_configs'),
+    path('api/metrics/', views.pricing_metrics, name='pricing_metrics'),
 ] 
\ No newline at end of file
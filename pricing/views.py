@@ -1,11 +1,14 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.paginator import Paginator
+from django.http import HttpResponse, StreamingHttpResponse
 from django.db import transaction
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from decimal import Decimal
+import io
 from .models import (
     PricingConfig,
     DistanceBasePrice,
@@ -21,11 +24,40 @@ from .forms import (
     TimeMultiplierFactorFormSet,
     WaitingChargeFormSet
 )
+from . import single_flight
+from .bulk import price_stream
+from .calculation_log import get_writer, log_calculation
+from .middleware import get_query_stats
+from .pagination import keyset_page
+from .quote_cache import cached_quote, get_quote_cache
+from .quote_views import _parse_trip, _quote, calculate_price_async  # noqa: F401
+from .signals import pricing_data_changed
+from .stage_timing import get_histograms, start_timer
+from .tariff import (
+    get_active,
+    get_active_tariff,
+    get_config_tariffs,
+    payload_from_rows,
+    snapshot_config,
+    tariff_for_config
+)
+from .transfer import (
+    FORMATS as TRANSFER_FORMATS,
+    TransferError,
+    clean_documents,
+    export_configs,
+    import_configs,
+    read_documents,
+    write_csv
+)
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json')
 
 @login_required
 def pricing_config_list(request):
-    configs = PricingConfig.objects.all()
-    return render(request, 'pricing/config_list.html', {'configs': configs})
+    configs = PricingConfig.objects.with_summary().order_by('pk')
+    page = Paginator(configs, settings.PRICING_CONFIGS_PER_PAGE).get_page(request.GET.get('page'))
+    return render(request, 'pricing/config_list.html', {'configs': page.object_list, 'page': page})
 
 @login_required
 def pricing_config_create(request):
@@ -34,11 +66,12 @@ def pricing_config_create(request):
         if form.is_valid():
             with transaction.atomic():
                 config = form.save()
+                version = snapshot_config(config)
                 PricingConfigLog.objects.create(
                     pricing_config=config,
                     user=request.user,
                     action='created',
-                    details={'name': config.name}
+                    details={'name': config.name, 'version': version.pk}
                 )
                 messages.success(request, 'Pricing configuration created successfully.')
                 return redirect('pricing_config_detail', pk=config.pk)
@@ -48,26 +81,42 @@ def pricing_config_create(request):
 
 @login_required
 def pricing_config_edit(request, pk):
-    config = get_object_or_404(PricingConfig, pk=pk)
+    config = get_object_or_404(PricingConfig.objects.select_related('current_version'), pk=pk)
     if request.method == 'POST':
         form = PricingConfigForm(request.POST, instance=config)
         base_price_formset = DistanceBasePriceFormSet(request.POST, instance=config)
         additional_price_formset = DistanceAdditionalPriceFormSet(request.POST, instance=config)
         time_multiplier_formset = TimeMultiplierFactorFormSet(request.POST, instance=config)
         waiting_charge_formset = WaitingChargeFormSet(request.POST, instance=config)
+        formsets = {
+            'base_prices': base_price_formset,
+            'additional_prices': additional_price_formset,
+            'time_multipliers': time_multiplier_formset,
+            'waiting_charges': waiting_charge_formset,
+        }
 
-        if (form.is_valid() and base_price_formset.is_valid() and
-            additional_price_formset.is_valid() and time_multiplier_formset.is_valid() and
-            waiting_charge_formset.is_valid()):
-            
+        if form.is_valid() and all(formset.is_valid() for formset in formsets.values()):
             with transaction.atomic():
+                # Only rows that changed are written, in bulk
+                for formset in formsets.values():
+                    formset.save()
+                changes = {name: formset.changes for name, formset in formsets.items() if formset.changes}
+                if not changes and not form.has_changed():
+                    messages.info(request, 'No changes to save.')
+                    return redirect('pricing_config_detail', pk=config.pk)
+
                 config = form.save()
-                base_price_formset.save()
-                additional_price_formset.save()
-                time_multiplier_formset.save()
-                waiting_charge_formset.save()
+                # The bulk writes of the formsets send no model signals
+                pricing_data_changed()
+                version = snapshot_config(config, payload_from_rows(
+                    *(formset.saved_rows() for formset in formsets.values())
+                ))
 
-                # Log the changes
+                # Log the changes, field by field
+                if form.has_changed():
+                    changes['config'] = {
+                        name: [form.initial.get(name), form.cleaned_data[name]] for name in form.changed_data
+                    }
                 PricingConfigLog.objects.create(
                     pricing_config=config,
                     user=request.user,
@@ -75,10 +124,12 @@ def pricing_config_edit(request, pk):
                     details={
                         'name': config.name,
                         'is_active': config.is_active,
-                        'base_prices_modified': base_price_formset.has_changed(),
-                        'additional_prices_modified': additional_price_formset.has_changed(),
-                        'time_multipliers_modified': time_multiplier_formset.has_changed(),
-                        'waiting_charges_modified': waiting_charge_formset.has_changed(),
+                        'base_prices_modified': 'base_prices' in changes,
+                        'additional_prices_modified': 'additional_prices' in changes,
+                        'time_multipliers_modified': 'time_multipliers' in changes,
+                        'waiting_charges_modified': 'waiting_charges' in changes,
+                        'changes': changes,
+                        'version': version.pk,
                     }
                 )
 
@@ -102,105 +153,199 @@ def pricing_config_edit(request, pk):
 
 @login_required
 def pricing_config_detail(request, pk):
-    config = get_object_or_404(PricingConfig, pk=pk)
-    base_prices = config.distance_base_prices.all()
-    additional_prices = config.distance_additional_prices.all()
-    time_multipliers = config.time_multipliers.all()
-    waiting_charges = config.waiting_charges.all()
-    change_logs = config.pricingconfiglog_set.all().order_by('-timestamp')[:10]
-    
+    config = get_object_or_404(PricingConfig.objects.with_components().with_recent_logs(), pk=pk)
     return render(request, 'pricing/config_detail.html', {
         'config': config,
-        'base_prices': base_prices,
-        'additional_prices': additional_prices,
-        'time_multipliers': time_multipliers,
-        'waiting_charges': waiting_charges,
-        'change_logs': change_logs,
+        'base_prices': config.distance_base_prices.all(),
+        'additional_prices': config.distance_additional_prices.all(),
+        'time_multipliers': config.time_multipliers.all(),
+        'waiting_charges': config.waiting_charges.all(),
+        'change_logs': config.recent_logs,
+    })
+
+@login_required
+def pricing_config_logs(request, pk):
+    config = get_object_or_404(PricingConfig, pk=pk)
+    # Keyset pagination: each page starts after the last row of the previous one
+    logs, next_cursor = keyset_page(
+        config.pricingconfiglog_set.select_related('user'),
+        request.GET.get('after'),
+        settings.PRICING_LOGS_PER_PAGE
+    )
+    return render(request, 'pricing/config_logs.html', {
+        'config': config,
+        'change_logs': logs,
+        'next_cursor': next_cursor,
     })
 
 @api_view(['POST'])
 def calculate_price(request):
-    try:
-        # Get input parameters
-        distance = Decimal(request.data.get('distance', 0))  # Total distance in KM
-        duration = int(request.data.get('duration', 0))      # Total duration in minutes
-        waiting_time = int(request.data.get('waiting_time', 0))  # Total waiting time in minutes
-        day_of_week = int(request.data.get('day_of_week', 0))   # Day of week (0-6, Monday-Sunday)
-
-        # Get active pricing config
-        config = PricingConfig.objects.filter(is_active=True).first()
-        if not config:
-            return Response({'error': 'No active pricing configuration found'}, status=400)
+    timer = start_timer()
+    with timer.stage('config'):
+        active = get_active()
+    # request.data parses the body on first access, so it is read here,
+    # inside the timed parse stage
+    with timer.stage('parse'):
+        data = request.data
+    body, status = _quote(active, data, timer)
+    return timer.finish_on_render(Response(body, status=status))
+
+@api_view(['POST'])
+def calculate_price_batch(request):
+    trips = request.data
+    if isinstance(trips, dict):
+        trips = trips.get('trips')
+    if not isinstance(trips, list):
+        return Response({'error': 'Expected a list of trips'}, status=400)
+    if len(trips) > settings.PRICING_BATCH_MAX_TRIPS:
+        return Response(
+            {'error': f'At most {settings.PRICING_BATCH_MAX_TRIPS} trips can be priced per request'},
+            status=400
+        )
+
+    # The tariff is resolved once and shared by every trip in the batch
+    active = get_active()
+    if not active:
+        return Response({'error': 'No active pricing configuration found'}, status=400)
+    config_id, tariff = active
+
+    results = []
+    for trip in trips:
+        try:
+            if not isinstance(trip, dict):
+                raise ValueError('Each trip must be an object')
+            trip = _parse_trip(trip)
+            quote = cached_quote(tariff, *trip)
+        except Exception as e:
+            results.append({'error': str(e)})
+        else:
+            log_calculation(config_id, tariff, *trip, quote)
+            results.append(quote)
 
-        # 1. Calculate Distance Base Price (DBP)
-        base_price_config = config.distance_base_prices.filter(
-            days_of_week__contains=[day_of_week]
-        ).first()
-        
-        if not base_price_config:
-            return Response({'error': f'No base price configuration found for day {day_of_week}'}, status=400)
-
-        dbp = base_price_config.base_price
-        
-        # 2. Calculate Additional Distance Price (Dn * DAP)
-        additional_distance = Decimal('0')
-        additional_price = Decimal('0')
-        
-        if distance > base_price_config.base_distance:
-            additional_distance = distance - base_price_config.base_distance
-            additional_price_config = config.distance_additional_prices.first()
-            if additional_price_config:
-                additional_price = additional_distance * additional_price_config.price_per_km
-
-        # Calculate base fare with distance components
-        base_fare = dbp + additional_price
-
-        # 3. Calculate Time Multiplier Factor (TMF)
-        time_multiplier = Decimal('1.0')
-        for multiplier in config.time_multipliers.all().order_by('-time_threshold'):
-            if duration >= multiplier.time_threshold:
-                time_multiplier = multiplier.multiplier
-                break
-
-        # Apply time multiplier to the base fare
-        time_adjusted_fare = base_fare * time_multiplier
-
-        # 4. Calculate Waiting Charges (WC)
-        waiting_charge = Decimal('0')
-        waiting_config = config.waiting_charges.first()
-        if waiting_config and waiting_time > waiting_config.initial_wait_time:
-            chargeable_waiting_time = waiting_time - waiting_config.initial_wait_time
-            # Calculate full intervals, rounding up
-            intervals = (chargeable_waiting_time + waiting_config.interval_minutes - 1) // waiting_config.interval_minutes
-            waiting_charge = intervals * waiting_config.charge_per_interval
-
-        # Calculate final price: (DBP + (Dn * DAP)) * TMF + WC
-        final_price = time_adjusted_fare + waiting_charge
-
-        return Response({
-            'breakdown': {
-                'distance_base_price': float(dbp),
-                'additional_distance': float(additional_distance),
-                'additional_distance_price': float(additional_price),
-                'time_multiplier': float(time_multiplier),
-                'waiting_charge': float(waiting_charge),
-                'waiting_time_details': {
-                    'total_waiting_time': waiting_time,
-                    'initial_free_time': waiting_config.initial_wait_time if waiting_config else 0,
-                    'chargeable_time': chargeable_waiting_time if waiting_config and waiting_time > waiting_config.initial_wait_time else 0,
-                    'charge_per_interval': float(waiting_config.charge_per_interval) if waiting_config else 0,
-                    'interval_minutes': waiting_config.interval_minutes if waiting_config else 0,
-                    'intervals_charged': int(intervals) if waiting_config and waiting_time > waiting_config.initial_wait_time else 0
-                }
-            },
-            'base_fare': float(base_fare),
-            'time_adjusted_fare': float(time_adjusted_fare),
-            'final_price': float(final_price)
-        })
+    return Response({'results': results})
 
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def calculate_price_compare(request):
+    # Shadow pricing: one trip quoted under several configs, active or not,
+    # without logging the quotes
+    config_ids = request.data.get('configs')
+    if config_ids is not None:
+        if not isinstance(config_ids, list) or not all(
+            isinstance(config_id, int) and not isinstance(config_id, bool) for config_id in config_ids
+        ):
+            return Response({'error': 'configs must be a list of pricing configuration IDs'}, status=400)
+    try:
+        trip = _parse_trip(request.data)
     except Exception as e:
         return Response({'error': str(e)}, status=400)
 
+    # Preloaded tariffs: no queries once every config has been compiled
+    config_tariffs = get_config_tariffs(config_ids)
+    if config_ids is not None:
+        missing = sorted(set(config_ids) - {config_tariff.config_id for config_tariff in config_tariffs})
+        if missing:
+            return Response(
+                {'error': f"Pricing configuration(s) {', '.join(map(str, missing))} do not exist"}, status=404
+            )
+
+    results = []
+    for config_tariff in config_tariffs:
+        result = {
+            'config_id': config_tariff.config_id,
+            'name': config_tariff.name,
+            'is_active': config_tariff.is_active,
+            'version': config_tariff.tariff.version_id,
+        }
+        try:
+            result.update(cached_quote(config_tariff.tariff, *trip))
+        except Exception as e:
+            result['error'] = str(e)
+        results.append(result)
+    return Response({'results': results})
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def price_trips_stream(request):
+    # The request body is a trip file; NDJSON when sent as JSON, CSV otherwise
+    content_type = request.content_type.split(';')[0].strip()
+    fmt = 'ndjson' if content_type in NDJSON_CONTENT_TYPES else 'csv'
+
+    config_id = request.query_params.get('config')
+    if config_id:
+        try:
+            tariff = tariff_for_config(int(config_id))
+        except (ValueError, PricingConfig.DoesNotExist):
+            return Response({'error': f'Pricing configuration {config_id} does not exist'}, status=404)
+    else:
+        tariff = get_active_tariff()
+        if not tariff:
+            return Response({'error': 'No active pricing configuration found'}, status=400)
+
+    # Trips are read from the request body as they are priced, never loaded whole
+    stream = request.stream or io.BytesIO()
+    response = StreamingHttpResponse(
+        price_stream(tariff, stream, fmt),
+        content_type='application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    )
+    response['X-Tariff-Version'] = str(tariff.version_id)
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def pricing_metrics(request):
+    return Response({
+        'quote_cache': get_quote_cache().stats(),
+        'calculation_log': get_writer().stats(),
+        'stage_timing': {
+            'enabled': settings.PRICING_STAGE_TIMING,
+            'stages': get_histograms().snapshot(),
+        },
+        'slowest_views': get_query_stats().slowest(),
+        'coalescing': single_flight.stats(),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_pricing_configs(request):
+    # 'format' is taken by DRF's renderer negotiation, hence 'file_format'
+    fmt = request.query_params.get('file_format', 'json')
+    if fmt not in TRANSFER_FORMATS:
+        return Response({'error': f"file_format must be one of {', '.join(TRANSFER_FORMATS)}"}, status=400)
+    configs = PricingConfig.objects.all()
+    config_ids = request.query_params.getlist('config')
+    if config_ids:
+        try:
+            configs = configs.filter(pk__in=[int(config_id) for config_id in config_ids])
+        except ValueError:
+            return Response({'error': 'config must be a pricing configuration ID'}, status=400)
+
+    documents = export_configs(configs)
+    if fmt == 'json':
+        return Response({'configs': documents})
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="pricing_configs.csv"'
+    write_csv(documents, response)
+    return response
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def import_pricing_configs(request):
+    # The body is a CSV file when sent as CSV, JSON otherwise. It is read
+    # from the stream so large imports are not refused as oversized forms.
+    content_type = request.content_type.split(';')[0].strip()
+    fmt = 'csv' if content_type == 'text/csv' else 'json'
+    body = request.stream.read() if request.stream else b''
+    try:
+        cleaned = clean_documents(read_documents(io.BytesIO(body), fmt))
+    except TransferError as e:
+        return Response({'errors': e.errors}, status=400)
+
+    if request.query_params.get('dry_run'):
+        return Response({'valid': len(cleaned)})
+    configs = import_configs(cleaned, user=request.user)
+    return Response({'created': [config.pk for config in configs]}, status=201)
+
 def pricing_config_delete(request, pk):
     config = get_object_or_404(PricingConfig, pk=pk)
     if request.method == 'POST':